@@ -0,0 +1,278 @@
+"""
+asyncio (ASGI) front end for the One-Access API.
+
+    uvicorn --factory app.aio:create_async_app --port 8000 --backlog 4096
+
+create_async_app() serves the same routes as the Flask app in main.py by
+dispatching into it, so route logic, security.py and the store are shared.
+Connections live on the event loop instead of each holding a thread. Every
+view runs on a thread pool, since all of them sync the store (SQLite I/O
+with ONEACCESS_STORE=sqlite): the routes that sign or verify Ed25519 tokens
+on their own pool, the rest on another, so neither stalls the loop.
+
+Requests that wait are parked on the loop and cost no thread meanwhile:
+
+- GET /reader/policy also accepts ?wait=<seconds> with If-None-Match and is
+  held until the policy version changes.
+- /audit/stream and /occupancy/stream pull what is new on the view pool,
+  then wait on the loop for the next change (see main.NONBLOCKING_STREAMS).
+  A client disconnecting ends the stream and closes its generator.
+
+A watcher task syncs the store every POLL_INTERVAL seconds and wakes them.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+from urllib.parse import parse_qs
+
+from flask import Flask
+
+from . import main
+
+
+# Routes that sign or verify Ed25519 tokens
+CRYPTO_ROUTES = {
+    ("POST", "/qr/token"),
+    ("POST", "/qr/token/batch"),
+    ("POST", "/access/verify"),
+    ("POST", "/access/verify/batch"),
+    ("POST", "/visitor/token"),
+    ("GET", "/reader/policy"),
+}
+LONG_POLL_MAX_SECONDS = 60
+POLL_INTERVAL = 0.25
+STREAM_IDLE_PULL_SECONDS = 1.0  # pull idle streams this often anyway, for their keepalives
+
+
+def _environ(scope: dict[str, Any], body: bytes) -> dict[str, Any]:
+    """Build a WSGI environ from an ASGI http scope"""
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin-1")
+        value = raw_value.decode("latin-1")
+        if name == "content-length":
+            continue
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+            continue
+        key = "HTTP_" + name.upper().replace("-", "_")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_wsgi(flask_app: Flask, environ: dict[str, Any]):
+    """Run one request through the Flask app; returns (status, headers, body iterable)"""
+    started: dict[str, Any] = {}
+
+    def start_response(status: str, headers: list[tuple[str, str]], exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+
+    body = flask_app(environ, start_response)
+    if any(name.lower() == "content-length" for name, _ in started["headers"]):
+        # Not streamed: read it here, off the loop, and finish the request
+        iterable = body
+        try:
+            body = list(iterable)
+        finally:
+            close = getattr(iterable, "close", None)
+            if close:
+                close()
+    return started["status"], started["headers"], body
+
+
+async def _until_disconnect(receive: Callable) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+class _StoreWatcher:
+    """Syncs the store on a timer and wakes parked requests when it changes"""
+
+    def __init__(self, executor: ThreadPoolExecutor) -> None:
+        self._executor = executor
+        self._changed = asyncio.Event()  # policy version
+        self.activity = asyncio.Event()  # audit events or occupancy; replaced after each change
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        version = main.store.policy_version
+        seen = (main.store.audit.next_seq, main.store.occupancy.version)
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            await loop.run_in_executor(self._executor, main.store.sync)
+            if main.store.policy_version != version:
+                version = main.store.policy_version
+                self._changed.set()
+                self._changed = asyncio.Event()
+            current = (main.store.audit.next_seq, main.store.occupancy.version)
+            if current != seen:
+                seen = current
+                self.activity.set()
+                self.activity = asyncio.Event()
+
+    async def wait(self, etag: str, timeout: float) -> None:
+        if f'"{main.store.policy_version}"' != etag:
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class AsyncApp:
+    """ASGI application wrapping the Flask app"""
+
+    def __init__(self, flask_app: Flask, executor: ThreadPoolExecutor, view_executor: ThreadPoolExecutor) -> None:
+        self.flask_app = flask_app
+        self.executor = executor  # token signing and verification
+        self.view_executor = view_executor  # every other view, and store syncs
+        self.watcher = _StoreWatcher(view_executor)
+
+    async def __call__(self, scope: dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.watcher.start()
+                if main.LAZY_STARTUP:
+                    self.executor.submit(main.warm_up)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.watcher.stop()
+                self.executor.shutdown(wait=False)
+                self.view_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope: dict[str, Any], receive: Callable, send: Callable) -> None:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        environ = _environ(scope, b"".join(chunks))
+        environ[main.NONBLOCKING_STREAMS] = True
+        method, path = scope["method"], scope["path"]
+
+        if method == "GET" and path == "/reader/policy":
+            await self._long_poll(environ)
+
+        loop = asyncio.get_running_loop()
+        executor = self.executor if (method, path) in CRYPTO_ROUTES else self.view_executor
+        status, headers, body = await loop.run_in_executor(executor, _call_wsgi, self.flask_app, environ)
+
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+        })
+        if isinstance(body, list):
+            for chunk in body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        elif not await self._stream(body, receive, send):
+            return
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _stream(self, body, receive: Callable, send: Callable) -> bool:
+        """Send a streamed body until it ends (True) or the client goes away (False), then close it"""
+        loop = asyncio.get_running_loop()
+        iterator = iter(body)
+        disconnected = loop.create_task(_until_disconnect(receive))
+        pulled: Future | None = None
+        try:
+            while not disconnected.done():
+                activity = self.watcher.activity  # taken first, so a change during the pull is not missed
+                pulled = self.view_executor.submit(next, iterator, None)
+                chunk = await asyncio.wrap_future(pulled)
+                if chunk is None:
+                    return True
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                    continue
+                # Nothing new: park until the store changes, the client leaves or a keepalive is due
+                changed = loop.create_task(activity.wait())
+                await asyncio.wait((changed, disconnected), timeout=STREAM_IDLE_PULL_SECONDS,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                changed.cancel()
+            return False
+        finally:
+            disconnected.cancel()
+            close = getattr(body, "close", None)
+            if close:
+                # A generator can't be closed mid-step: a pull still running closes it when done
+                if pulled is None:
+                    close()
+                else:
+                    pulled.add_done_callback(lambda _: close())
+
+    async def _long_poll(self, environ: dict[str, Any]) -> None:
+        etag = environ.get("HTTP_IF_NONE_MATCH")
+        wait = parse_qs(environ["QUERY_STRING"]).get("wait")
+        if not etag or not wait:
+            return
+        try:
+            seconds = min(float(wait[0]), LONG_POLL_MAX_SECONDS)
+        except ValueError:
+            return
+        if seconds > 0:
+            await self.watcher.wait(etag, seconds)
+
+
+def _threads(env: str) -> int:
+    return int(os.environ.get(env, "0")) or min(32, (os.cpu_count() or 1) + 4)
+
+
+def create_async_app(flask_app: Flask | None = None, *, crypto_threads: int | None = None,
+                     view_threads: int | None = None) -> AsyncApp:
+    """Build the ASGI app; crypto_threads sizes the pool for signing and verification, view_threads the other"""
+    executor = ThreadPoolExecutor(max_workers=crypto_threads or _threads("ONEACCESS_CRYPTO_THREADS"),
+                                  thread_name_prefix="oneaccess-crypto")
+    view_executor = ThreadPoolExecutor(max_workers=view_threads or _threads("ONEACCESS_VIEW_THREADS"),
+                                       thread_name_prefix="oneaccess-view")
+    return AsyncApp(flask_app or main.app, executor, view_executor)
@@ -0,0 +1,444 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from dataclasses import asdict, dataclass
+from typing import Callable, Iterator, Sequence
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class AuditEvent:
+    ts: int
+    user_id: str | None
+    company_id: str | None
+    gate_id: str
+    reader_id: str
+    decision: str
+    reason: str
+    door_status: str = "UNKNOWN"  # "OPENED", "FAILED", "UNKNOWN"
+    delegated_by: str | None = None
+    visitor_pass_id: str | None = None
+
+
+# String columns, in AuditEvent field order after ts
+_STR_FIELDS = (
+    "user_id", "company_id", "gate_id", "reader_id", "decision",
+    "reason", "door_status", "delegated_by", "visitor_pass_id",
+)
+
+
+# Columns with a per-segment index (code -> event offsets) for filtered queries
+INDEXED_FIELDS = ("user_id", "company_id", "gate_id", "decision", "door_status")
+_INDEXED_COLS = tuple(_STR_FIELDS.index(name) for name in INDEXED_FIELDS)
+
+# A segment as (base_seq, min_ts, max_ts, ts column, string columns); see AuditLog.columns
+SegmentColumns = tuple[int, int, int, Sequence[int], tuple[Sequence[int], ...]]
+
+
+class _Interner:
+    """Maps strings to small integer codes. Code 0 is reserved for None."""
+
+    def __init__(self) -> None:
+        self._codes: dict[str, int] = {}
+        self._strings: list[str | None] = [None]
+
+    def code(self, value: str | None) -> int:
+        if value is None:
+            return 0
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self._strings)
+            self._codes[value] = code
+            self._strings.append(value)
+        return code
+
+    def find(self, value: str) -> int | None:
+        """Code of an already interned string"""
+        return self._codes.get(value)
+
+    def lookup(self, code: int) -> str | None:
+        return self._strings[code]
+
+    def strings(self) -> list[str | None]:
+        """Every interned string, by code"""
+        return list(self._strings)
+
+    @classmethod
+    def of(cls, strings: list[str | None]) -> _Interner:
+        """Rebuild from strings(); entry 0 must be None"""
+        interner = cls()
+        interner._strings = list(strings)
+        interner._codes = {s: code for code, s in enumerate(strings) if code}
+        return interner
+
+
+class _Segment:
+    """
+    A fixed-capacity run of events stored column-wise, with its own indexes.
+
+    Segments restored from a snapshot may hold read-only memoryviews instead
+    of arrays, and build their index on the first query that needs it.
+    """
+
+    __slots__ = ("base_seq", "ts", "cols", "index", "min_ts", "max_ts")
+
+    def __init__(self, base_seq: int) -> None:
+        self.base_seq = base_seq
+        self.ts: Sequence[int] = array("q")
+        self.cols: tuple[Sequence[int], ...] = tuple(array("I") for _ in _STR_FIELDS)
+        self.index: tuple[dict[int, array], ...] | None = tuple({} for _ in INDEXED_FIELDS)  # ascending offsets
+        self.min_ts = sys.maxsize
+        self.max_ts = -sys.maxsize
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def postings(self) -> tuple[dict[int, array], ...]:
+        if self.index is None:
+            index = tuple({} for _ in INDEXED_FIELDS)
+            for postings, col in zip(index, _INDEXED_COLS):
+                for offset, code in enumerate(self.cols[col]):
+                    offsets = postings.get(code)
+                    if offsets is None:
+                        offsets = postings[code] = array("I")
+                    offsets.append(offset)
+            self.index = index
+        return self.index
+
+    def candidates(self, filters: list[tuple[int, int]], lo: int, hi: int):
+        """Offsets in [lo, hi) that may match filters, ascending, from the shortest posting list"""
+        if not filters:
+            return range(lo, hi)
+        best = None
+        index = self.postings()
+        for field, code in filters:
+            postings = index[field].get(code)
+            if postings is None:
+                return ()
+            if best is None or len(postings) < len(best):
+                best = postings
+        return best[bisect_left(best, lo):bisect_left(best, hi)]
+
+
+class AuditLog:
+    """
+    Bounded audit trail stored in array-backed column segments.
+
+    Events are kept in a ring of segments holding at most ``max_events``
+    events, optionally also bounded by age (``retention_seconds``). When a
+    segment falls out of the ring it is written to ``spill_dir`` as NDJSON
+    if one is configured (read back by spilled()), otherwise it is dropped
+    and ``dropped_max_ts`` records how recent the dropped events reach
+    (as it does for a segment whose spill fails).
+    Spills are written by a background thread, off the append path; the
+    segments are full, so they no longer change.
+
+    ``listener``, if set, is called with (first seq, events) under the log's
+    lock after every append, so it sees appends in sequence order.
+    """
+
+    def __init__(self, *, max_events: int = 100_000, segment_size: int = 4096,
+                 retention_seconds: int = 0, spill_dir: str | None = None) -> None:
+        if max_events < 1 or segment_size < 1:
+            raise ValueError("max_events and segment_size must be positive")
+        self.segment_size = min(segment_size, max_events)
+        self.max_segments = -(-max_events // self.segment_size) + 1  # + the segment being filled
+        self.retention_seconds = retention_seconds
+        self.spill_dir = spill_dir
+        self._strings = _Interner()
+        self._segments: list[_Segment] = [_Segment(0)]
+        self._lock = threading.Lock()
+        self._appended = threading.Condition(self._lock)
+        self.listener: Callable[[int, list[AuditEvent]], None] | None = None
+        self.dropped_max_ts: int | None = None  # newest ts among events evicted without (or failing) a spill
+        self._spill_cond = threading.Condition()
+        self._to_spill: list[tuple[_Segment, _Interner]] = []  # oldest first, removed once written
+        self._spiller: threading.Thread | None = None
+
+    def __len__(self) -> int:
+        # Segments, not next_seq - first_seq: extend(first_seq=) can leave gaps between them
+        return sum(len(seg) for seg in self._segments)
+
+    @property
+    def first_seq(self) -> int:
+        """Sequence number of the oldest event still held in memory"""
+        return self._segments[0].base_seq
+
+    @property
+    def next_seq(self) -> int:
+        """Sequence number the next appended event will get"""
+        last = self._segments[-1]
+        return last.base_seq + len(last)
+
+    def append(self, event: AuditEvent) -> int:
+        """Append an event and return its sequence number"""
+        with self._lock:
+            seq = self._append(event)
+            if self.listener is not None:
+                self.listener(seq, [event])
+            self._appended.notify_all()
+            return seq
+
+    def extend(self, events: list[AuditEvent], first_seq: int | None = None) -> None:
+        """
+        Append several events under a single lock acquisition. first_seq
+        numbers them from an outside sequence (e.g. database rows): the log
+        skips ahead to it, leaving a gap, but never goes back.
+        """
+        with self._lock:
+            if first_seq is not None and first_seq != self.next_seq:
+                self._skip_to(first_seq)
+            first = self.next_seq
+            for event in events:
+                self._append(event)
+            if self.listener is not None and events:
+                self.listener(first, events)
+            self._appended.notify_all()
+
+    def _skip_to(self, seq: int) -> None:
+        if seq < self.next_seq:
+            raise ValueError(f"Audit seq {seq} is below the next one, {self.next_seq}")
+        last = self._segments[-1]
+        if not len(last):
+            last.base_seq = seq
+        else:
+            self._new_segment(seq)
+
+    def _new_segment(self, base_seq: int) -> _Segment:
+        seg = _Segment(base_seq)
+        self._segments.append(seg)
+        if len(self._segments) > self.max_segments:
+            self._evict_oldest()
+        return seg
+
+    def _append(self, event: AuditEvent) -> int:
+        seg = self._segments[-1]
+        if len(seg) >= self.segment_size:
+            seg = self._new_segment(seg.base_seq + len(seg))
+        offset = len(seg)
+        seg.ts.append(event.ts)
+        seg.min_ts = min(seg.min_ts, event.ts)
+        seg.max_ts = max(seg.max_ts, event.ts)
+        code = self._strings.code
+        codes = [code(getattr(event, name)) for name in _STR_FIELDS]
+        for col, value in zip(seg.cols, codes):
+            col.append(value)
+        for index, col in zip(seg.index, _INDEXED_COLS):
+            postings = index.get(codes[col])
+            if postings is None:
+                postings = index[codes[col]] = array("I")
+            postings.append(offset)
+        if self.retention_seconds:
+            self._expire(event.ts - self.retention_seconds)
+        return seg.base_seq + offset
+
+    def columns(self) -> tuple[list[str | None], list[SegmentColumns]]:
+        """
+        The interned strings and every held segment as (base_seq, min_ts,
+        max_ts, ts column, string columns), for writing a snapshot. Only the
+        segment being filled is copied; full segments never change.
+        """
+        with self._lock:
+            segments = [(seg.base_seq, seg.min_ts, seg.max_ts, seg.ts, seg.cols) for seg in self._segments]
+            last = self._segments[-1]
+            segments[-1] = (last.base_seq, last.min_ts, last.max_ts, array("q", last.ts),
+                            tuple(array("I", col) for col in last.cols))
+            return self._strings.strings(), segments
+
+    def restore(self, strings: list[str | None], segments: list[SegmentColumns]) -> None:
+        """
+        Replace the log's contents with columns() output, e.g. read from a
+        snapshot. Columns may be memoryviews, which are used without copying
+        except for the last segment, which keeps being appended to.
+        """
+        with self._lock:
+            restored: list[_Segment] = []
+            for base_seq, min_ts, max_ts, ts, cols in segments:
+                if not len(ts):
+                    continue
+                seg = _Segment(base_seq)
+                seg.ts, seg.cols, seg.index = ts, cols, None
+                seg.min_ts, seg.max_ts = min_ts, max_ts
+                restored.append(seg)
+            if restored and len(restored[-1]) < self.segment_size:
+                last = restored[-1]
+                last.ts, last.cols = array("q", last.ts), tuple(array("I", col) for col in last.cols)
+                last.postings()
+            else:
+                restored.append(_Segment(restored[-1].base_seq + len(restored[-1]) if restored else 0))
+            self._strings = _Interner.of(strings)
+            self._segments = restored
+            while len(self._segments) > self.max_segments:
+                self._evict_oldest()
+
+    def _expire(self, cutoff: int) -> None:
+        """Evict whole segments whose newest event is older than cutoff"""
+        while len(self._segments) > 1 and self._segments[0].max_ts < cutoff:
+            self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        seg = self._segments.pop(0)
+        if self.spill_dir:
+            self._queue_spill(seg)
+        else:
+            self._note_dropped(seg)
+
+    def _note_dropped(self, seg: _Segment) -> None:
+        if len(seg):
+            self.dropped_max_ts = max(seg.max_ts, self.dropped_max_ts or seg.max_ts)
+
+    def _queue_spill(self, seg: _Segment) -> None:
+        # With the interner of the moment: restore() may replace it before the segment is written
+        with self._spill_cond:
+            self._to_spill.append((seg, self._strings))
+            if self._spiller is None:
+                self._spiller = threading.Thread(target=self._spill_loop, name="audit-spill", daemon=True)
+                self._spiller.start()
+            self._spill_cond.notify_all()
+
+    def _spill_loop(self) -> None:
+        while True:
+            with self._spill_cond:
+                while not self._to_spill:
+                    self._spill_cond.wait()
+                seg, strings = self._to_spill[0]
+            try:
+                self._spill(seg, strings)
+            except Exception:
+                log.exception("Dropping audit segment %d after a failed spill", seg.base_seq)
+                with self._lock:
+                    self._note_dropped(seg)
+            with self._spill_cond:
+                self._to_spill.pop(0)
+                self._spill_cond.notify_all()
+
+    def _spill(self, seg: _Segment, strings: _Interner) -> None:
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"audit-{seg.base_seq:012d}.ndjson")
+        tmp = f"{path}.tmp"
+        lookup = strings.lookup
+        # Written aside and renamed, so spilled() never reads a half-written file
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                for i in range(len(seg)):
+                    event = AuditEvent(seg.ts[i], *(lookup(col[i]) for col in seg.cols))
+                    f.write(json.dumps(asdict(event), separators=(",", ":")))
+                    f.write("\n")
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def flush_spills(self, timeout: float | None = None) -> bool:
+        """Block until every evicted segment handed to the spill thread is written"""
+        with self._spill_cond:
+            return self._spill_cond.wait_for(lambda: not self._to_spill, timeout)
+
+    def spilled(self, from_seq: int, before_seq: int) -> Iterator[tuple[int, AuditEvent]]:
+        """(seq, event) pairs spilled to spill_dir with from_seq <= seq < before_seq, oldest first"""
+        if not self.spill_dir:
+            return
+        self.flush_spills()
+        if not os.path.isdir(self.spill_dir):
+            return
+        bases = sorted(int(name[6:-7]) for name in os.listdir(self.spill_dir)
+                       if name.startswith("audit-") and name.endswith(".ndjson"))
+        for n, base in enumerate(bases):
+            if base >= before_seq:
+                return
+            if n + 1 < len(bases) and bases[n + 1] <= from_seq:
+                continue
+            with open(os.path.join(self.spill_dir, f"audit-{base:012d}.ndjson"), encoding="utf-8") as f:
+                for seq, line in enumerate(f, base):
+                    if seq >= before_seq:
+                        return
+                    if seq >= from_seq:
+                        yield seq, AuditEvent(**json.loads(line))
+
+    def _event(self, seg: _Segment, i: int) -> AuditEvent:
+        lookup = self._strings.lookup
+        return AuditEvent(seg.ts[i], *(lookup(col[i]) for col in seg.cols))
+
+    def latest(self, limit: int) -> list[AuditEvent]:
+        """Get up to ``limit`` most recent events, newest first"""
+        out: list[AuditEvent] = []
+        with self._lock:
+            for seg in reversed(self._segments):
+                for i in range(len(seg) - 1, -1, -1):
+                    if len(out) >= limit:
+                        return out
+                    out.append(self._event(seg, i))
+        return out
+
+    def query(self, *, limit: int, cursor: int | None = None, newest_first: bool = False,
+              since_ts: int | None = None, until_ts: int | None = None,
+              **equals: str | None) -> tuple[list[tuple[int, AuditEvent]], int]:
+        """
+        Get up to ``limit`` events matching every filter as (seq, event) pairs,
+        plus the cursor for the next page.
+
+        Oldest first from ``cursor`` (seq >= cursor), or with ``newest_first``
+        newest first below it (seq < cursor). ``equals`` filters on any of
+        INDEXED_FIELDS; ts is filtered to [since_ts, until_ts). Each segment
+        walks only the shortest posting list among the filters and segments
+        outside the time range are skipped, so cost follows the result size
+        rather than the log size.
+        """
+        out: list[tuple[int, AuditEvent]] = []
+        with self._lock:
+            first, end = self.first_seq, self.next_seq
+            if not newest_first and cursor is not None:
+                # A cursor from a process further along (shared database) is kept, never moved back
+                end = max(end, cursor)
+            filters: list[tuple[int, int]] = []
+            for name, value in equals.items():
+                if name not in INDEXED_FIELDS:
+                    raise ValueError(f"Cannot filter audit events on {name}")
+                if value is None:
+                    continue
+                code = self._strings.find(value)
+                if code is None:  # never seen: nothing can match yet
+                    return out, first if newest_first else end
+                filters.append((INDEXED_FIELDS.index(name), code))
+            low_ts = -sys.maxsize if since_ts is None else since_ts
+            high_ts = sys.maxsize if until_ts is None else until_ts
+
+            if newest_first:
+                cursor = end if cursor is None else min(cursor, end)
+                segments = reversed(self._segments)
+            else:
+                cursor = first if cursor is None else max(cursor, first)
+                segments = iter(self._segments)
+            for seg in segments:
+                if newest_first:
+                    lo, hi = 0, min(len(seg), cursor - seg.base_seq)
+                else:
+                    lo, hi = max(0, cursor - seg.base_seq), len(seg)
+                if lo >= hi or seg.max_ts < low_ts or seg.min_ts >= high_ts:
+                    continue
+                check_ts = seg.min_ts < low_ts or seg.max_ts >= high_ts
+                offsets = seg.candidates(filters, lo, hi)
+                for i in (reversed(offsets) if newest_first else offsets):
+                    if check_ts and not low_ts <= seg.ts[i] < high_ts:
+                        continue
+                    if not all(seg.cols[_INDEXED_COLS[field]][i] == code for field, code in filters):
+                        continue
+                    if len(out) >= limit:
+                        return out, seg.base_seq + i + 1 if newest_first else seg.base_seq + i
+                    out.append((seg.base_seq + i, self._event(seg, i)))
+            return out, (out[-1][0] if out else cursor) if newest_first else end
+
+    def wait(self, cursor: int, timeout: float) -> bool:
+        """Block until an event with sequence number >= cursor exists; False on timeout"""
+        with self._lock:
+            return self._appended.wait_for(lambda: self.next_seq > cursor, timeout)
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import importlib
+from typing import Any
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access.
+
+    Keeps heavy dependencies (PyJWT, cryptography) off the import path of
+    app.main, so a cold process can answer requests that don't need them
+    sooner. Attributes are copied onto the stand-in as they are first read,
+    so later reads cost the same as on the module itself. importlib's
+    per-module import lock makes the first access safe from any thread.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.__name = name
+
+    def __getattr__(self, attr: str) -> Any:
+        value = getattr(importlib.import_module(self.__name), attr)
+        setattr(self, attr, value)
+        return value
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self.__name!r}>"
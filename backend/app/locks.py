@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+import threading
+from typing import Callable, Hashable
+
+
+class StripedLock:
+    """
+    A fixed pool of locks picked by key hash.
+
+    Operations on different keys almost never contend, unlike one global
+    lock, and the number of locks stays bounded however many keys exist.
+    Two keys may share a stripe, so never hold one stripe while taking
+    another.
+    """
+
+    def __init__(self, stripes: int = 64, factory: Callable[[], object] = threading.Lock) -> None:
+        self._locks = tuple(factory() for _ in range(stripes))
+
+    def for_key(self, key: Hashable):
+        return self._locks[hash(key) % len(self._locks)]
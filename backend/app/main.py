@@ -1,29 +1,207 @@
 from __future__ import annotations
 
+import atexit
+import hmac
+import json
 import os
+import threading
 import time
-from datetime import datetime
+import uuid
+from datetime import date, datetime, timedelta
 
-import jwt
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 
-from .security import SigningKeys, issue_access_jwt, load_or_create_keys, verify_access_jwt
-from .store import InMemoryStore, User
+from .audit_log import AuditEvent, AuditLog
+from .export import csv_chunks, gzip_chunks, ndjson_chunks
+from .lazy import LazyModule
+from .metrics import Registry
+from .policy_snapshot import build_snapshot, sign_snapshot
+from .replay import REPLAY, RETRY, ReplayGuard
+from .security import (
+    KeyRing, VerifiedTokenCache, issue_access_jwt, issue_access_jwts, verify_access_jwt,
+)
+from .store import Gate, InMemoryStore, TimeSession, User
+from .sweeper import ExpirySweeper
 
 
 DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".data"))
 APP_AUTH_SECRET = os.environ.get("ONEACCESS_APP_AUTH_SECRET", "dev-only-change-me")
 TOKEN_TTL_SECONDS = int(os.environ.get("ONEACCESS_TOKEN_TTL_SECONDS", "20"))
+AUDIT_MAX_EVENTS = int(os.environ.get("ONEACCESS_AUDIT_MAX_EVENTS", "100000"))
+AUDIT_RETENTION_SECONDS = int(os.environ.get("ONEACCESS_AUDIT_RETENTION_SECONDS", "0"))  # 0 = size bound only
+AUDIT_SPILL_DIR = os.environ.get("ONEACCESS_AUDIT_SPILL_DIR") or None
+STORE_BACKEND = os.environ.get("ONEACCESS_STORE", "memory").lower()  # "memory" | "sqlite" | "snapshot"
+DB_PATH = os.environ.get("ONEACCESS_DB_PATH") or os.path.join(DATA_DIR, "oneaccess.db")
+SNAPSHOT_DIR = os.environ.get("ONEACCESS_SNAPSHOT_DIR") or os.path.join(DATA_DIR, "snapshot")
+SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get("ONEACCESS_SNAPSHOT_INTERVAL_SECONDS", "300"))
+VERIFY_CACHE_SIZE = int(os.environ.get("ONEACCESS_VERIFY_CACHE_SIZE", "10000"))  # 0 disables
+SWEEP_INTERVAL_SECONDS = float(os.environ.get("ONEACCESS_SWEEP_INTERVAL_SECONDS", "1"))
+MAX_SESSION_HOURS = float(os.environ.get("ONEACCESS_MAX_SESSION_HOURS", "16"))  # 0 = never auto-close
+ADMIN_KEY = os.environ.get("ONEACCESS_ADMIN_KEY") or None  # unset disables /admin endpoints
+READER_KEY = os.environ.get("ONEACCESS_READER_KEY") or None  # unset: only the admin key may use /audit/bulk
+KEYS_KEEP_PREVIOUS = int(os.environ.get("ONEACCESS_KEYS_KEEP_PREVIOUS", "2"))
+LAZY_STARTUP = os.environ.get("ONEACCESS_LAZY_STARTUP", "0") == "1"  # see warm_up()
+
+jwt = LazyModule("jwt")  # HS256 app sessions
+
+
+def _create_store() -> InMemoryStore:
+    audit_log = AuditLog(max_events=AUDIT_MAX_EVENTS, retention_seconds=AUDIT_RETENTION_SECONDS,
+                         spill_dir=AUDIT_SPILL_DIR)
+    if AUDIT_SPILL_DIR:
+        atexit.register(audit_log.flush_spills, 10.0)  # segments evicted but not yet written
+    if STORE_BACKEND == "sqlite":
+        from .sqlite_store import SQLiteStore
+
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        sqlite_store = SQLiteStore(DB_PATH, audit=audit_log)
+        atexit.register(sqlite_store.close)
+        return sqlite_store
+    if STORE_BACKEND == "snapshot":
+        from .snapshot_store import SnapshotStore
+
+        snapshot_store = SnapshotStore(SNAPSHOT_DIR, audit=audit_log, snapshot_interval=SNAPSHOT_INTERVAL_SECONDS)
+        atexit.register(snapshot_store.close)
+        return snapshot_store
+    if STORE_BACKEND != "memory":
+        raise ValueError(f"Unknown ONEACCESS_STORE: {STORE_BACKEND}")
+    return InMemoryStore(audit=audit_log)
+
+
+def _create_replay_guard():
+    if STORE_BACKEND == "sqlite":
+        from .sqlite_store import SQLiteReplayGuard
+
+        # Shared by every worker (and across restarts) through the database
+        return SQLiteReplayGuard(DB_PATH, bucket_seconds=TOKEN_TTL_SECONDS)
+    return ReplayGuard(bucket_seconds=TOKEN_TTL_SECONDS)
+
 
 app = Flask(__name__)
-store = InMemoryStore()
-signing_keys: SigningKeys = load_or_create_keys(DATA_DIR)
+store = _create_store()
+key_ring = KeyRing(DATA_DIR, keep_previous=KEYS_KEEP_PREVIOUS)
+token_cache = VerifiedTokenCache(max_entries=VERIFY_CACHE_SIZE)
+replay_guard = _create_replay_guard()
+sweeper: ExpirySweeper | None = None  # started by the first request, so never in a preloading master
+_sweeper_lock = threading.Lock()
+_pre_fork_state: list = []
+
+metrics = Registry()
+REQUEST_SECONDS = metrics.histogram("oneaccess_http_request_duration_seconds",
+                                    "Time to build each response (to first byte for streams)",
+                                    ("endpoint", "method", "status"))
+STAGE_SECONDS = metrics.histogram("oneaccess_stage_duration_seconds",
+                                  "Time spent in each hot-path stage", ("stage",))
+ACCESS_DECISIONS = metrics.counter("oneaccess_access_decisions_total",
+                                   "Access verify decisions by reason", ("decision", "reason"))
+TOKENS_ISSUED = metrics.counter("oneaccess_tokens_issued_total",
+                                "Access tokens issued; rate() of this is the issuance rate", ("kind",))
+metrics.gauge("oneaccess_store_objects", "Objects held by this process", lambda: [
+    (("users",), len(store.users_by_id)),
+    (("gates",), len(store.gates)),
+    (("delegations",), len(store.delegations)),
+    (("visitor_passes",), len(store.visitor_passes)),
+    (("active_sessions",), len(store.active_sessions)),
+    (("time_sessions",), len(store.time_sessions)),
+    (("audit_events",), len(store.audit)),
+    (("revoked_devices",), len(store.revoked_devices)),
+    (("verified_token_cache",), len(token_cache)),
+], ("kind",))
+metrics.gauge("oneaccess_policy_version", "Reader policy snapshot version", lambda: store.policy_version)
+_SYNC_STAGE = STAGE_SECONDS.labels("store_sync")
+_VERIFY_STAGE = STAGE_SECONDS.labels("verify")  # signature check, or verified-token cache hit
+_DECIDE_STAGE = STAGE_SECONDS.labels("decide")  # policy and store lookups, replay check, audit write
+_SIGN_STAGE = STAGE_SECONDS.labels("sign")
+_SIGN_BATCH_STAGE = STAGE_SECONDS.labels("sign_batch")
+_SERIALIZE_STAGE = STAGE_SECONDS.labels("serialize")
+
+
+def init_worker() -> None:
+    """
+    Re-create per-process state in a worker forked from a preloaded app
+    (see gunicorn.conf.py). Signing keys are inherited from the parent; the
+    store, replay guard and token cache get fresh handles and threads.
+    """
+    global store, token_cache, replay_guard, sweeper
+    # Keep the parent's database handles referenced so they are never closed from the child, at exit included;
+    # its writer and spill threads didn't survive the fork, so its exit hooks would only close or wait on them
+    _pre_fork_state.append((store, replay_guard))
+    for hook in (getattr(store, "close", None), store.audit.flush_spills):
+        if hook is not None:
+            atexit.unregister(hook)
+    store = _create_store()
+    replay_guard = _create_replay_guard()
+    token_cache = VerifiedTokenCache(max_entries=VERIFY_CACHE_SIZE)
+    sweeper = None
+
+
+def warm_up() -> None:
+    """
+    Load what the token routes need: PyJWT and cryptography, the signing
+    keys and their signer. Runs at import unless ONEACCESS_LAZY_STARTUP=1;
+    then the process answers sooner after a cold start and the server calls
+    this in the background once it is up (gunicorn.conf.py, aio.py), or else
+    the first request needing a key pays for it.
+    """
+    token = issue_access_jwt(keys=key_ring.current(), claims={"sub": "warm-up"}, ttl_seconds=60)
+    verify_access_jwt(token=token, keys=key_ring)
+    jwt.encode({"sub": "warm-up"}, APP_AUTH_SECRET, algorithm="HS256")
+
+
+def start_warm_up() -> None:
+    """Run warm_up in a background thread when startup is lazy"""
+    if LAZY_STARTUP:
+        threading.Thread(target=warm_up, name="oneaccess-warm-up", daemon=True).start()
+
+
+if not LAZY_STARTUP:
+    warm_up()
+
+
+def _start_sweeper() -> None:
+    global sweeper
+    with _sweeper_lock:
+        if sweeper is None and SWEEP_INTERVAL_SECONDS > 0:
+            sweeper = ExpirySweeper(store, interval_seconds=SWEEP_INTERVAL_SECONDS,
+                                    max_session_seconds=int(MAX_SESSION_HOURS * 3600))
+            sweeper.start()
+
+
+@app.before_request
+def _start_timer():
+    g.started = time.perf_counter()
+
+
+@app.before_request
+def _sync_store():
+    started = time.perf_counter()
+    store.sync()
+    _SYNC_STAGE.observe(time.perf_counter() - started)
+    if sweeper is None:
+        _start_sweeper()
+
+
+@app.after_request
+def _observe_request(response: Response) -> Response:
+    started = g.get("started")
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.labels(endpoint, request.method, str(response.status_code)).observe(
+            time.perf_counter() - started)
+    return response
 
 
 def _json_error(message: str, status: int):
     return jsonify({"error": message}), status
 
 
+def _jsonify_timed(body) -> Response:
+    started = time.perf_counter()
+    response = jsonify(body)
+    _SERIALIZE_STAGE.observe(time.perf_counter() - started)
+    return response
+
+
 def _require_json() -> dict:
     if not request.is_json:
         raise ValueError("Expected application/json")
@@ -71,9 +249,56 @@ def _format_duration(seconds: int) -> str:
         return f"{secs}s"
 
 
+def _session_json(s: TimeSession) -> dict:
+    return {
+        "sessionId": s.session_id,
+        "userId": s.user_id,
+        "companyId": s.company_id,
+        "gateIdEntry": s.gate_id_entry,
+        "entryTime": s.entry_time.isoformat(),
+        "exitTime": s.exit_time.isoformat() if s.exit_time else None,
+        "durationSeconds": s.duration_seconds,
+        "durationFormatted": _format_duration(s.duration_seconds) if s.duration_seconds else None,
+        "status": s.status
+    }
+
+
+@app.get("/healthz")
+def healthz():
+    return jsonify({"status": "ok"})
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/.well-known/jwks.json")
 def jwks():
-    return jsonify({"keys": [signing_keys.public_jwk()]})
+    return jsonify(key_ring.jwks())
+
+
+@app.get("/reader/policy")
+def reader_policy():
+    """Signed policy snapshot for offline readers; ?since=<version> returns only changed sections"""
+    etag = f'"{store.policy_version}"'
+    if request.headers.get("If-None-Match") == etag:
+        return "", 304, {"ETag": etag}
+    try:
+        since = max(0, int(request.args.get("since", "0")))
+    except ValueError:
+        return _json_error("Invalid since", 400)
+    revoked = request.args.get("revoked", "list")
+    if revoked not in ("list", "bloom"):
+        return _json_error("revoked must be list or bloom", 400)
+    snapshot = build_snapshot(store, since=since, revoked_bloom=revoked == "bloom")
+    response = jsonify({
+        "version": snapshot["version"],
+        "since": snapshot["since"],
+        "snapshot": sign_snapshot(snapshot, key_ring.current()),
+    })
+    response.headers["ETag"] = etag
+    return response
 
 
 @app.post("/auth/login")
@@ -91,180 +316,337 @@ def login():
         return _json_error(str(e), 400)
 
 
+QR_BATCH_MAX = 100
+
+
+def _qr_claims(user: User, item: dict) -> tuple[dict | None, str, int]:
+    """Build access token claims for one request; returns (claims, error, status) with claims None on error"""
+    gate_id = str(item.get("gateId", "")).strip()
+    reader_nonce = str(item.get("readerNonce", "")).strip()
+    device_id = item.get("deviceId")
+    device_id = str(device_id).strip() if device_id else None
+
+    if not gate_id:
+        return None, "Missing gateId", 400
+    if not reader_nonce or not (8 <= len(reader_nonce) <= 64):
+        return None, "Invalid readerNonce", 400
+
+    gate = store.gates.get(gate_id)
+    if not gate:
+        return None, "Unknown gateId", 404
+
+    if device_id and device_id in store.revoked_devices:
+        return None, "Device revoked", 403
+
+    # Company gates, or a delegation for this gate
+    allowed, delegation = store.access_policy.check(user, gate_id)
+    if not allowed:
+        return None, "Not allowed for this building", 403
+    delegated_by = delegation.delegator_id if delegation else None
+
+    claims = {
+        "v": 1,
+        "sub": user.user_id,
+        "cid": user.company_id,
+        "gid": gate_id,
+        "rnonce": reader_nonce,
+        "did": device_id or "UNKNOWN_DEVICE",
+        "jti": f"{user.user_id}:{gate_id}:{uuid.uuid4().hex}",
+    }
+    
+    if delegated_by:
+        claims["delegated_by"] = delegated_by
+
+    return claims, "", 200
+
+
 @app.post("/qr/token")
 def qr_token():
     try:
         user = _get_user_from_bearer()
         data = _require_json()
-        gate_id = str(data.get("gateId", "")).strip()
-        reader_nonce = str(data.get("readerNonce", "")).strip()
-        device_id = data.get("deviceId")
-        device_id = str(device_id).strip() if device_id else None
-
-        if not gate_id:
-            return _json_error("Missing gateId", 400)
-        if not reader_nonce or not (8 <= len(reader_nonce) <= 64):
-            return _json_error("Invalid readerNonce", 400)
-
-        gate = store.gates.get(gate_id)
-        if not gate:
-            return _json_error("Unknown gateId", 404)
+        now = int(time.time())
+        claims, error, status = _qr_claims(user, data)
+        if claims is None:
+            return _json_error(error, status)
+
+        started = time.perf_counter()
+        token = issue_access_jwt(keys=key_ring.current(), claims=claims, ttl_seconds=TOKEN_TTL_SECONDS)
+        _SIGN_STAGE.observe(time.perf_counter() - started)
+        TOKENS_ISSUED.labels("user").inc()
+        return _jsonify_timed({"token": token, "expEpochSeconds": now + TOKEN_TTL_SECONDS})
+    except PermissionError as e:
+        return _json_error(str(e), 401)
+    except ValueError as e:
+        return _json_error(str(e), 400)
 
-        if gate.kind == "BUILDING" and gate.company_id != user.company_id:
-            return _json_error("Not allowed for this building", 403)
-        if device_id and device_id in store.revoked_devices:
-            return _json_error("Device revoked", 403)
-
-        # Check if user has delegated access for this gate
-        delegated_by = None
-        if gate.kind == "BUILDING" and gate.company_id != user.company_id:
-            # Check for active delegations
-            delegations = store.get_active_delegations_for_user(user.user_id)
-            for delegation in delegations:
-                if gate_id in delegation.gate_ids:
-                    delegated_by = delegation.delegator_id
-                    break
-            if not delegated_by:
-                return _json_error("Not allowed for this building", 403)
 
+@app.post("/qr/token/batch")
+def qr_token_batch():
+    """Issue tokens for several upcoming reader nonces or gates in one call, one result per request in order"""
+    try:
+        user = _get_user_from_bearer()
+        data = _require_json()
+        items = data.get("requests")
+        if not isinstance(items, list) or not items:
+            return _json_error("Missing requests", 400)
+        if len(items) > QR_BATCH_MAX:
+            return _json_error(f"At most {QR_BATCH_MAX} requests per batch", 400)
+
+        # Top-level gateId/deviceId apply to every request that doesn't set its own
+        defaults = {k: data[k] for k in ("gateId", "deviceId") if data.get(k)}
         now = int(time.time())
-        exp = now + TOKEN_TTL_SECONDS
-        claims = {
-            "v": 1,
-            "sub": user.user_id,
-            "cid": user.company_id,
-            "gid": gate_id,
-            "rnonce": reader_nonce,
-            "did": device_id or "UNKNOWN_DEVICE",
-            "jti": f"{user.user_id}:{reader_nonce}:{now}",
-        }
-        
-        if delegated_by:
-            claims["delegated_by"] = delegated_by
-            
-        token = issue_access_jwt(keys=signing_keys, claims=claims, ttl_seconds=TOKEN_TTL_SECONDS)
-        return jsonify({"token": token, "expEpochSeconds": exp})
+        results: list[dict] = []
+        to_sign: list[dict] = []
+        for item in items:
+            if not isinstance(item, dict):
+                results.append({"error": "Invalid request", "status": 400})
+                continue
+            claims, error, status = _qr_claims(user, {**defaults, **item})
+            if claims is None:
+                results.append({"error": error, "status": status})
+            else:
+                results.append({})
+                to_sign.append(claims)
+
+        started = time.perf_counter()
+        tokens = iter(issue_access_jwts(keys=key_ring.current(), claims=to_sign, ttl_seconds=TOKEN_TTL_SECONDS))
+        _SIGN_BATCH_STAGE.observe(time.perf_counter() - started)
+        TOKENS_ISSUED.labels("user").inc(len(to_sign))
+        for result in results:
+            if not result:
+                result["token"] = next(tokens)
+                result["expEpochSeconds"] = now + TOKEN_TTL_SECONDS
+        return _jsonify_timed({"tokens": results})
     except PermissionError as e:
         return _json_error(str(e), 401)
     except ValueError as e:
         return _json_error(str(e), 400)
 
 
+VERIFY_BATCH_MAX = 1000
+
+
+def _decide_access(*, gate: Gate, reader_id: str, payload: dict | None, user: User | None,
+                   door_opened: bool, direction: str, record) -> dict:
+    """Apply access policy to a verified token payload (None if invalid) and audit the decision via record()"""
+    gate_id = gate.gate_id
+    if payload is None:
+        record(user_id=None, company_id=None, gate_id=gate_id, reader_id=reader_id, 
+               decision="DENY", reason="Invalid token", door_status="UNKNOWN")
+        return {"decision": "DENY", "reason": "INVALID_TOKEN"}
+
+    user_id = payload.get("sub")
+    token_cid = payload.get("cid")
+    token_gid = payload.get("gid")
+    delegated_by = payload.get("delegated_by")
+    visitor_pass_id = payload.get("visitor_pass_id")
+
+    if payload.get("did") in store.revoked_devices:
+        record(user_id=user_id, company_id=token_cid, gate_id=gate_id, reader_id=reader_id,
+               decision="DENY", reason="Device revoked", door_status="UNKNOWN")
+        return {"decision": "DENY", "reason": "DEVICE_REVOKED"}
+
+    # Handle visitor passes
+    if visitor_pass_id:
+        visitor_pass = store.get_visitor_pass(visitor_pass_id)
+        if not visitor_pass or not visitor_pass.active:
+            record(user_id=None, company_id=None, gate_id=gate_id, reader_id=reader_id,
+                   decision="DENY", reason="Invalid visitor pass", door_status="UNKNOWN")
+            return {"decision": "DENY", "reason": "INVALID_VISITOR_PASS"}
+        
+        if visitor_pass.used_count >= visitor_pass.max_uses:
+            record(user_id=None, company_id=visitor_pass.host_company_id, gate_id=gate_id, reader_id=reader_id,
+                   decision="DENY", reason="Visitor pass usage exceeded", door_status="UNKNOWN", 
+                   visitor_pass_id=visitor_pass_id)
+            return {"decision": "DENY", "reason": "USAGE_EXCEEDED"}
+
+    if not user or not user.active:
+        door_status = "OPENED" if door_opened else "UNKNOWN"
+        record(user_id=user_id, company_id=token_cid, gate_id=gate_id, reader_id=reader_id, 
+               decision="DENY", reason="Unknown/inactive user", door_status=door_status)
+        return {"decision": "DENY", "reason": "USER_INACTIVE"}
+
+    if token_gid != gate_id:
+        door_status = "OPENED" if door_opened else "UNKNOWN"
+        record(user_id=user.user_id, company_id=user.company_id, gate_id=gate_id, reader_id=reader_id, 
+               decision="DENY", reason="Token gate mismatch", door_status=door_status)
+        return {"decision": "DENY", "reason": "GATE_MISMATCH"}
+
+    # Check building access (including delegations)
+    has_access, _ = store.access_policy.check(user, gate_id)
+    if not has_access:
+        door_status = "OPENED" if door_opened else "UNKNOWN"
+        record(user_id=user.user_id, company_id=user.company_id, gate_id=gate_id, reader_id=reader_id, 
+               decision="DENY", reason="Not allowed for building", door_status=door_status,
+               delegated_by=delegated_by, visitor_pass_id=visitor_pass_id)
+        return {"decision": "DENY", "reason": "NOT_ALLOWED"}
+
+    # Each token opens a door once; the same reader may retry it (e.g. after a door-sensor timeout)
+    jti = payload.get("jti")
+    if not jti:
+        record(user_id=user.user_id, company_id=user.company_id, gate_id=gate_id, reader_id=reader_id,
+               decision="DENY", reason="Token without jti", door_status="UNKNOWN")
+        return {"decision": "DENY", "reason": "INVALID_TOKEN"}
+    jti, exp = str(jti), int(payload["exp"])
+    use, first_result = replay_guard.claim(jti, exp, reader_id)
+    if use == RETRY:
+        # The first use's answer again, without acting on it twice; still recorded, as an ALLOW opens the door
+        response = dict(first_result) if first_result else {"decision": "DENY", "reason": "RETRY_PENDING"}
+        allowed = response["decision"] == "ALLOW"
+        record(user_id=user.user_id, company_id=user.company_id, gate_id=gate_id, reader_id=reader_id,
+               decision=response["decision"], reason="Token retried",
+               door_status="OPENED" if door_opened else ("FAILED" if allowed else "UNKNOWN"),
+               delegated_by=delegated_by, visitor_pass_id=visitor_pass_id)
+        return response
+    if use == REPLAY:
+        door_status = "OPENED" if door_opened else "UNKNOWN"
+        record(user_id=user.user_id, company_id=user.company_id, gate_id=gate_id, reader_id=reader_id,
+               decision="DENY", reason="Token already used", door_status=door_status,
+               delegated_by=delegated_by, visitor_pass_id=visitor_pass_id)
+        return {"decision": "DENY", "reason": "REPLAYED"}
+
+    # Take a visitor pass use atomically; the check above can race with concurrent scans of the same pass
+    if visitor_pass_id and store.use_visitor_pass(visitor_pass_id) is None:
+        record(user_id=None, company_id=visitor_pass.host_company_id, gate_id=gate_id, reader_id=reader_id,
+               decision="DENY", reason="Visitor pass usage exceeded", door_status="UNKNOWN",
+               visitor_pass_id=visitor_pass_id)
+        response = {"decision": "DENY", "reason": "USAGE_EXCEEDED"}
+        replay_guard.settle(jti, exp, response)
+        return response
+
+    # Access granted - record with door status
+    door_status = "OPENED" if door_opened else "FAILED"
+    record(user_id=user.user_id, company_id=user.company_id, gate_id=gate_id, reader_id=reader_id, 
+           decision="ALLOW", reason="OK", door_status=door_status,
+           delegated_by=delegated_by, visitor_pass_id=visitor_pass_id)
+    
+    # Time tracking for building gates (if door actually opened)
+    session_info = None
+    if door_opened and gate.kind == "BUILDING":
+        if direction == "ENTRY":
+            session_id = store.start_time_session(user.user_id, user.company_id, gate_id)
+            session_info = {"action": "SESSION_STARTED", "sessionId": session_id}
+        elif direction == "EXIT":
+            session = store.end_time_session(user.user_id, gate_id)
+            if session:
+                session_info = {
+                    "action": "SESSION_ENDED",
+                    "sessionId": session.session_id,
+                    "entryTime": session.entry_time.isoformat(),
+                    "exitTime": session.exit_time.isoformat() if session.exit_time else None,
+                    "durationSeconds": session.duration_seconds,
+                    "durationFormatted": _format_duration(session.duration_seconds) if session.duration_seconds else None
+                }
+    
+    response = {"decision": "ALLOW", "reason": "OK"}
+    if session_info:
+        response["timeTracking"] = session_info
+    replay_guard.settle(jti, exp, response)
+    return response
+
+
+def _parse_scan(data: dict) -> tuple[str, str, str, bool, str]:
+    reader_id = str(data.get("readerId", "")).strip()
+    gate_id = str(data.get("gateId", "")).strip()
+    token = str(data.get("token", "")).strip()
+    door_opened = bool(data.get("doorOpened", False))
+    direction = str(data.get("direction", "ENTRY")).strip().upper()  # "ENTRY" or "EXIT"
+    if not reader_id or not gate_id or not token:
+        raise ValueError("Missing readerId/gateId/token")
+    return reader_id, gate_id, token, door_opened, direction
+
+
+def _verify_token(token: str) -> dict | None:
+    started = time.perf_counter()
+    try:
+        return verify_access_jwt(token=token, keys=key_ring, cache=token_cache)
+    except Exception:
+        return None
+    finally:
+        _VERIFY_STAGE.observe(time.perf_counter() - started)
+
+
+def _decide_timed(**kwargs) -> dict:
+    started = time.perf_counter()
+    result = _decide_access(**kwargs)
+    _DECIDE_STAGE.observe(time.perf_counter() - started)
+    ACCESS_DECISIONS.labels(result["decision"], result["reason"]).inc()
+    return result
+
+
 @app.post("/access/verify")
 def verify():
     try:
         data = _require_json()
-        reader_id = str(data.get("readerId", "")).strip()
-        gate_id = str(data.get("gateId", "")).strip()
-        token = str(data.get("token", "")).strip()
-        door_opened = bool(data.get("doorOpened", False))
-        direction = str(data.get("direction", "ENTRY")).strip().upper()  # "ENTRY" or "EXIT"
-
-        if not reader_id or not gate_id or not token:
-            return _json_error("Missing readerId/gateId/token", 400)
+        reader_id, gate_id, token, door_opened, direction = _parse_scan(data)
 
         gate = store.gates.get(gate_id)
         if not gate:
             return _json_error("Unknown gateId", 404)
 
-        try:
-            payload = verify_access_jwt(token=token, public_key=signing_keys.public_key)
-        except Exception:
-            store.record(user_id=None, company_id=None, gate_id=gate_id, reader_id=reader_id, 
-                        decision="DENY", reason="Invalid token", door_status="UNKNOWN")
-            return jsonify({"decision": "DENY", "reason": "INVALID_TOKEN"})
-
-        user_id = payload.get("sub")
-        token_cid = payload.get("cid")
-        token_gid = payload.get("gid")
-        delegated_by = payload.get("delegated_by")
-        visitor_pass_id = payload.get("visitor_pass_id")
+        payload = _verify_token(token)
+        user_id = payload.get("sub") if payload else None
         user = store.users_by_id.get(user_id) if user_id else None
+        return _jsonify_timed(_decide_timed(gate=gate, reader_id=reader_id, payload=payload, user=user,
+                                            door_opened=door_opened, direction=direction, record=store.record))
+    except ValueError as e:
+        return _json_error(str(e), 400)
 
-        # Handle visitor passes
-        if visitor_pass_id:
-            visitor_pass = store.get_visitor_pass(visitor_pass_id)
-            if not visitor_pass or not visitor_pass.active:
-                store.record(user_id=None, company_id=None, gate_id=gate_id, reader_id=reader_id,
-                           decision="DENY", reason="Invalid visitor pass", door_status="UNKNOWN")
-                return jsonify({"decision": "DENY", "reason": "INVALID_VISITOR_PASS"})
-            
-            if visitor_pass.used_count >= visitor_pass.max_uses:
-                store.record(user_id=None, company_id=visitor_pass.host_company_id, gate_id=gate_id, reader_id=reader_id,
-                           decision="DENY", reason="Visitor pass usage exceeded", door_status="UNKNOWN", 
-                           visitor_pass_id=visitor_pass_id)
-                return jsonify({"decision": "DENY", "reason": "USAGE_EXCEEDED"})
 
-        if not user or not user.active:
-            door_status = "OPENED" if door_opened else "UNKNOWN"
-            store.record(user_id=user_id, company_id=token_cid, gate_id=gate_id, reader_id=reader_id, 
-                        decision="DENY", reason="Unknown/inactive user", door_status=door_status)
-            return jsonify({"decision": "DENY", "reason": "USER_INACTIVE"})
-
-        if token_gid != gate_id:
-            door_status = "OPENED" if door_opened else "UNKNOWN"
-            store.record(user_id=user.user_id, company_id=user.company_id, gate_id=gate_id, reader_id=reader_id, 
-                        decision="DENY", reason="Token gate mismatch", door_status=door_status)
-            return jsonify({"decision": "DENY", "reason": "GATE_MISMATCH"})
-
-        # Check building access (including delegations)
-        has_access = False
-        if gate.kind == "MAIN":
-            has_access = True
-        elif gate.kind == "BUILDING":
-            # Check direct access
-            if gate.company_id == user.company_id:
-                has_access = True
-            # Check delegated access
-            elif delegated_by:
-                delegations = store.get_active_delegations_for_user(user.user_id)
-                for delegation in delegations:
-                    if gate_id in delegation.gate_ids:
-                        has_access = True
-                        break
-
-        if not has_access:
-            door_status = "OPENED" if door_opened else "UNKNOWN"
-            store.record(user_id=user.user_id, company_id=user.company_id, gate_id=gate_id, reader_id=reader_id, 
-                        decision="DENY", reason="Not allowed for building", door_status=door_status,
-                        delegated_by=delegated_by, visitor_pass_id=visitor_pass_id)
-            return jsonify({"decision": "DENY", "reason": "NOT_ALLOWED"})
-
-        # Access granted - record with door status
-        door_status = "OPENED" if door_opened else "FAILED"
-        store.record(user_id=user.user_id, company_id=user.company_id, gate_id=gate_id, reader_id=reader_id, 
-                    decision="ALLOW", reason="OK", door_status=door_status,
-                    delegated_by=delegated_by, visitor_pass_id=visitor_pass_id)
-        
-        # Increment visitor pass usage if applicable
-        if visitor_pass_id:
-            visitor_pass = store.get_visitor_pass(visitor_pass_id)
-            if visitor_pass:
-                visitor_pass.used_count += 1
-        
-        # Time tracking for building gates (if door actually opened)
-        session_info = None
-        if door_opened and gate.kind == "BUILDING":
-            if direction == "ENTRY":
-                session_id = store.start_time_session(user.user_id, user.company_id, gate_id)
-                session_info = {"action": "SESSION_STARTED", "sessionId": session_id}
-            elif direction == "EXIT":
-                session = store.end_time_session(user.user_id, gate_id)
-                if session:
-                    session_info = {
-                        "action": "SESSION_ENDED",
-                        "sessionId": session.session_id,
-                        "entryTime": session.entry_time.isoformat(),
-                        "exitTime": session.exit_time.isoformat() if session.exit_time else None,
-                        "durationSeconds": session.duration_seconds,
-                        "durationFormatted": _format_duration(session.duration_seconds) if session.duration_seconds else None
-                    }
-        
-        response = {"decision": "ALLOW", "reason": "OK"}
-        if session_info:
-            response["timeTracking"] = session_info
-        
-        return jsonify(response)
+@app.post("/access/verify/batch")
+def verify_batch():
+    """Verify a buffered batch of reader scans, returning one decision per scan in order"""
+    try:
+        if not request.is_json:
+            raise ValueError("Expected application/json")
+        body = request.get_json(silent=True)
+        items = body.get("scans") if isinstance(body, dict) else body  # {"scans": [...]} or a bare array
+        if not isinstance(items, list) or not items:
+            return _json_error("Missing scans", 400)
+        if len(items) > VERIFY_BATCH_MAX:
+            return _json_error(f"At most {VERIFY_BATCH_MAX} scans per batch", 400)
+
+        scans: list[tuple | None] = []
+        errors: dict[int, str] = {}
+        for i, item in enumerate(items):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Invalid scan")
+                scans.append(_parse_scan(item))
+            except ValueError as e:
+                scans.append(None)
+                errors[i] = str(e)
+
+        # One signature pass over the distinct tokens, then one lookup per gate and user
+        payloads = {scan[2]: None for scan in scans if scan}
+        for token in payloads:
+            payloads[token] = _verify_token(token)
+        gates = {scan[1]: store.gates.get(scan[1]) for scan in scans if scan}
+        user_ids = {p.get("sub") for p in payloads.values() if p and p.get("sub")}
+        users = {uid: store.users_by_id.get(uid) for uid in user_ids}
+
+        audit_entries: list[dict] = []
+        results = []
+        for i, scan in enumerate(scans):
+            if scan is None:
+                results.append({"decision": "DENY", "reason": "BAD_REQUEST", "error": errors[i]})
+                ACCESS_DECISIONS.labels("DENY", "BAD_REQUEST").inc()
+                continue
+            reader_id, gate_id, token, door_opened, direction = scan
+            gate = gates[gate_id]
+            if not gate:
+                results.append({"decision": "DENY", "reason": "UNKNOWN_GATE", "error": "Unknown gateId"})
+                ACCESS_DECISIONS.labels("DENY", "UNKNOWN_GATE").inc()
+                continue
+            payload = payloads[token]
+            user = users.get(payload.get("sub")) if payload else None
+            results.append(_decide_timed(gate=gate, reader_id=reader_id, payload=payload, user=user,
+                                         door_opened=door_opened, direction=direction,
+                                         record=lambda **entry: audit_entries.append(entry)))
+
+        store.record_many(audit_entries)
+        return _jsonify_timed({"results": results})
     except ValueError as e:
         return _json_error(str(e), 400)
 
@@ -292,13 +674,13 @@ def visitor_token():
         if visitor_pass.used_count >= visitor_pass.max_uses:
             return _json_error("Visitor pass usage exceeded", 403)
 
-        if gate_id not in visitor_pass.gate_ids:
-            return _json_error("Gate not authorized for this visitor pass", 403)
-
         gate = store.gates.get(gate_id)
         if not gate:
             return _json_error("Unknown gateId", 404)
 
+        if not store.access_policy.allows_visitor(visitor_pass, gate_id):
+            return _json_error("Gate not authorized for this visitor pass", 403)
+
         now = int(time.time())
         exp = now + TOKEN_TTL_SECONDS
         claims = {
@@ -308,11 +690,14 @@ def visitor_token():
             "gid": gate_id,
             "rnonce": reader_nonce,
             "did": "VISITOR_DEVICE",
-            "jti": f"visitor:{pass_id}:{reader_nonce}:{now}",
+            "jti": f"visitor:{pass_id}:{gate_id}:{uuid.uuid4().hex}",
             "visitor_pass_id": pass_id,
         }
 
-        token = issue_access_jwt(keys=signing_keys, claims=claims, ttl_seconds=TOKEN_TTL_SECONDS)
+        started = time.perf_counter()
+        token = issue_access_jwt(keys=key_ring.current(), claims=claims, ttl_seconds=TOKEN_TTL_SECONDS)
+        _SIGN_STAGE.observe(time.perf_counter() - started)
+        TOKENS_ISSUED.labels("visitor").inc()
         return jsonify({
             "token": token, 
             "expEpochSeconds": exp,
@@ -345,7 +730,7 @@ def create_delegation():
             gate = store.gates.get(gate_id)
             if not gate:
                 return _json_error(f"Unknown gate: {gate_id}", 404)
-            if gate.kind == "BUILDING" and gate.company_id != user.company_id:
+            if not store.access_policy.company_allows(user, gate_id):
                 return _json_error(f"Not authorized for gate: {gate_id}", 403)
         
         delegation_id = store.create_delegation(
@@ -388,7 +773,7 @@ def create_visitor_pass():
             gate = store.gates.get(gate_id)
             if not gate:
                 return _json_error(f"Unknown gate: {gate_id}", 404)
-            if gate.kind == "BUILDING" and gate.company_id != user.company_id:
+            if not store.access_policy.company_allows(user, gate_id):
                 return _json_error(f"Not authorized for gate: {gate_id}", 403)
         
         pass_id = store.create_visitor_pass(
@@ -414,7 +799,7 @@ def list_delegations():
         
         # Get delegations created by this user
         created_delegations = []
-        for delegation in store.delegations.values():
+        for delegation in list(store.delegations.values()):
             if delegation.delegator_id == user.user_id and delegation.active:
                 delegatee = store.users_by_id.get(delegation.delegatee_id)
                 created_delegations.append({
@@ -451,7 +836,7 @@ def list_visitor_passes():
         user = _get_user_from_bearer()
         
         visitor_passes = []
-        for vpass in store.visitor_passes.values():
+        for vpass in list(store.visitor_passes.values()):
             if vpass.created_by == user.user_id and vpass.active:
                 visitor_passes.append({
                     "passId": vpass.pass_id,
@@ -469,31 +854,278 @@ def list_visitor_passes():
         return _json_error(str(e), 401)
 
 
+ADMIN_BULK_MAX = 10_000
+
+
+def _require_admin() -> None:
+    if not ADMIN_KEY:
+        raise PermissionError("Admin API disabled (set ONEACCESS_ADMIN_KEY)")
+    if not hmac.compare_digest(request.headers.get("X-Admin-Key", "").encode(), ADMIN_KEY.encode()):
+        raise PermissionError("Invalid admin key")
+
+
+def _id_list(data: dict, key: str) -> list[str]:
+    values = data.get(key, [])
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        raise ValueError(f"{key} must be a list of strings")
+    if len(values) > ADMIN_BULK_MAX:
+        raise ValueError(f"At most {ADMIN_BULK_MAX} {key} per call")
+    return [v.strip() for v in values if v.strip()]
+
+
+def _bulk_revocation(revoke: bool):
+    try:
+        _require_admin()
+        data = _require_json()
+        device_ids = _id_list(data, "deviceIds")
+        user_ids = _id_list(data, "userIds")
+        if not device_ids and not user_ids:
+            return _json_error("Missing deviceIds or userIds", 400)
+
+        devices = store.revoke_devices(device_ids) if revoke else store.unrevoke_devices(device_ids)
+        users, unknown_users = store.set_users_active(user_ids, active=not revoke)
+        return jsonify({
+            "devices": len(devices),
+            "users": len(users),
+            "unknownUserIds": unknown_users,
+            "revokedDevices": len(store.revoked_devices),
+            "version": store.policy_version,
+        })
+    except PermissionError as e:
+        return _json_error(str(e), 401)
+    except ValueError as e:
+        return _json_error(str(e), 400)
+
+
+@app.post("/admin/revoke")
+def admin_revoke():
+    """Revoke devices and deactivate users in bulk, e.g. when a company offboards staff"""
+    return _bulk_revocation(revoke=True)
+
+
+@app.post("/admin/unrevoke")
+def admin_unrevoke():
+    """Undo /admin/revoke for the given devices and users"""
+    return _bulk_revocation(revoke=False)
+
+
+@app.post("/admin/keys/rotate")
+def admin_rotate_keys():
+    """Add a signing key, active now or after activateInSeconds; older keys keep verifying"""
+    try:
+        _require_admin()
+        data = request.get_json(silent=True) or {}
+        try:
+            delay = float(data.get("activateInSeconds", 0))
+        except (TypeError, ValueError):
+            raise ValueError("activateInSeconds must be a number")
+        if delay < 0:
+            raise ValueError("activateInSeconds must not be negative")
+        activate_at = int(time.time() + delay)
+        keys = key_ring.rotate(activate_at=activate_at)
+        return jsonify({"kid": keys.kid, "activatesAt": activate_at,
+                        "currentKid": key_ring.current().kid, "keys": key_ring.jwks()["keys"]})
+    except PermissionError as e:
+        return _json_error(str(e), 401)
+    except ValueError as e:
+        return _json_error(str(e), 400)
+
+
+def _audit_json(e: AuditEvent) -> dict:
+    return {
+        "ts": e.ts,
+        "userId": e.user_id,
+        "companyId": e.company_id,
+        "gateId": e.gate_id,
+        "readerId": e.reader_id,
+        "decision": e.decision,
+        "reason": e.reason,
+        "doorStatus": e.door_status,
+        "delegatedBy": e.delegated_by,
+        "visitorPassId": e.visitor_pass_id,
+    }
+
+
+# /audit query parameter -> indexed AuditEvent field
+AUDIT_FILTERS = {
+    "userId": "user_id",
+    "companyId": "company_id",
+    "gateId": "gate_id",
+    "decision": "decision",
+    "doorStatus": "door_status",
+}
+
+
+def _epoch_arg(name: str) -> int | None:
+    raw = request.args.get(name)
+    if not raw:
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be epoch seconds") from None
+
+
 @app.get("/audit")
 def audit():
+    """
+    Latest audit events, newest first. With a cursor, pages forward oldest
+    first instead: {"events": [...], "nextCursor": n}; start from cursor=0.
+    """
     limit_raw = request.args.get("limit", "50")
     try:
         limit = max(1, min(500, int(limit_raw)))
     except ValueError:
         limit = 50
-    events = store.audit[-limit:]
-    return jsonify(
-        [
-            {
-                "ts": e.ts,
-                "userId": e.user_id,
-                "companyId": e.company_id,
-                "gateId": e.gate_id,
-                "readerId": e.reader_id,
-                "decision": e.decision,
-                "reason": e.reason,
-                "doorStatus": e.door_status,
-                "delegatedBy": e.delegated_by,
-                "visitorPassId": e.visitor_pass_id,
-            }
-            for e in reversed(events)
-        ]
-    )
+    try:
+        filters = {field: request.args.get(arg) or None for arg, field in AUDIT_FILTERS.items()}
+        since_ts, until_ts = _epoch_arg("from"), _epoch_arg("to")
+        cursor_raw = request.args.get("cursor")
+        cursor = int(cursor_raw) if cursor_raw else None
+    except ValueError as e:
+        return _json_error(str(e), 400)
+
+    if cursor is None:
+        events, _ = store.audit.query(limit=limit, newest_first=True, since_ts=since_ts, until_ts=until_ts, **filters)
+        return jsonify([dict(_audit_json(e), seq=seq) for seq, e in events])
+
+    events, next_cursor = store.audit.query(limit=limit, cursor=cursor, since_ts=since_ts, until_ts=until_ts, **filters)
+    return jsonify({"events": [dict(_audit_json(e), seq=seq) for seq, e in events], "nextCursor": next_cursor})
+
+
+AUDIT_STREAM_BATCH = 500
+AUDIT_STREAM_POLL_SECONDS = 1.0  # also how often other workers' events are pulled in
+AUDIT_STREAM_HEARTBEAT_SECONDS = 15.0
+# Set in the WSGI environ by the asyncio server (aio.py). Stream generators then never block: with
+# nothing to send they yield "", and the server waits on its event loop, holding no thread, before
+# pulling again. It also syncs the store for them.
+NONBLOCKING_STREAMS = "oneaccess.nonblocking_streams"
+
+
+@app.get("/audit/stream")
+def audit_stream():
+    """Push audit events as they are recorded, as Server-Sent Events or NDJSON"""
+    fmt = request.args.get("format", "sse")
+    if fmt not in ("sse", "ndjson"):
+        return _json_error("format must be sse or ndjson", 400)
+    gate_id = request.args.get("gateId") or None
+    company_id = request.args.get("companyId") or None
+    # An SSE client reconnecting sends the id of the last event it got, which is already the next cursor
+    cursor_raw = request.args.get("cursor") or request.headers.get("Last-Event-ID")
+    try:
+        cursor = int(cursor_raw) if cursor_raw else None
+    except ValueError:
+        return _json_error("Invalid cursor", 400)
+
+    current_store = store
+    audit_log = current_store.audit
+    nonblocking = request.environ.get(NONBLOCKING_STREAMS, False)
+    poll = 0 if nonblocking else AUDIT_STREAM_POLL_SECONDS
+
+    def encode(seq: int, e: AuditEvent) -> str:
+        body = _audit_json(e)
+        body["seq"] = seq
+        data = json.dumps(body, separators=(",", ":"))
+        return f"id: {seq + 1}\nevent: audit\ndata: {data}\n\n" if fmt == "sse" else data + "\n"
+
+    def events():
+        position = audit_log.next_seq if cursor is None else cursor
+        if fmt == "sse":
+            yield "retry: 3000\n\n"
+        sent = time.monotonic()
+        while True:
+            batch, position = audit_log.query(cursor=position, limit=AUDIT_STREAM_BATCH,
+                                              gate_id=gate_id, company_id=company_id)
+            if batch:
+                sent = time.monotonic()
+                yield "".join(encode(seq, e) for seq, e in batch)
+                continue
+            if audit_log.wait(position, poll):
+                continue
+            if not nonblocking:
+                current_store.sync()
+            if time.monotonic() - sent >= AUDIT_STREAM_HEARTBEAT_SECONDS:
+                # Keeps proxies from timing out and surfaces closed connections
+                sent = time.monotonic()
+                yield ": keepalive\n\n" if fmt == "sse" else "\n"
+            elif nonblocking:
+                yield ""
+
+    mimetype = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    return Response(events(), mimetype=mimetype, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+AUDIT_BULK_MAX = 5000
+AUDIT_BULK_MAX_AGE_SECONDS = 7 * 86400  # older offline timestamps are clamped to this
+AUDIT_REASONS = {
+    "ALLOW": {"OK", "Token retried"},
+    "DENY": {"Unknown gate", "Invalid token", "Device revoked", "Invalid visitor pass", "Visitor pass usage exceeded",
+             "Unknown/inactive user", "Token gate mismatch", "Not allowed for building", "Token without jti",
+             "Token already used", "Token retried"},
+}
+DOOR_STATUSES = {"OPENED", "FAILED", "UNKNOWN"}
+
+
+def _require_reader() -> None:
+    for header, key in (("X-Reader-Key", READER_KEY), ("X-Admin-Key", ADMIN_KEY)):
+        if key and hmac.compare_digest(request.headers.get(header, "").encode(), key.encode()):
+            return
+    raise PermissionError("Reader or admin key required")
+
+
+@app.post("/audit/bulk")
+def audit_bulk():
+    """Upload audit events decided offline by a reader"""
+    try:
+        _require_reader()
+        data = _require_json()
+        events = data.get("events")
+        if not isinstance(events, list) or not events:
+            return _json_error("Missing events", 400)
+        if len(events) > AUDIT_BULK_MAX:
+            return _json_error(f"At most {AUDIT_BULK_MAX} events per upload", 400)
+
+        now = int(time.time())
+        entries = []
+        for e in events:
+            if not isinstance(e, dict):
+                return _json_error("Invalid event", 400)
+            decision = e.get("decision")
+            gate_id = e.get("gateId")
+            reader_id = e.get("readerId")
+            if decision not in AUDIT_REASONS or not gate_id or not reader_id:
+                return _json_error("Event needs decision, gateId and readerId", 400)
+            if e.get("reason") not in AUDIT_REASONS[decision]:
+                return _json_error(f"Unknown reason for {decision}", 400)
+            door_status = e.get("doorStatus", "UNKNOWN")
+            if door_status not in DOOR_STATUSES:
+                return _json_error("Unknown doorStatus", 400)
+            if not isinstance(e.get("ts"), int):
+                return _json_error("Event needs an integer ts", 400)
+            entries.append({
+                # A reader's clock can't date events into the future or before the offline window
+                "ts": min(max(e["ts"], now - AUDIT_BULK_MAX_AGE_SECONDS), now),
+                "user_id": e.get("userId"),
+                "company_id": e.get("companyId"),
+                "gate_id": str(gate_id),
+                "reader_id": str(reader_id),
+                "decision": decision,
+                "reason": e["reason"],
+                "door_status": door_status,
+                "delegated_by": e.get("delegatedBy"),
+                "visitor_pass_id": e.get("visitorPassId"),
+            })
+
+        store.record_many(entries)
+        # Offline visitor entries still count against the pass; a retry's first use already did
+        for entry in entries:
+            if entry["decision"] == "ALLOW" and entry["reason"] == "OK" and entry["visitor_pass_id"]:
+                store.use_visitor_pass(entry["visitor_pass_id"])
+        return jsonify({"accepted": len(entries)})
+    except PermissionError as e:
+        return _json_error(str(e), 401)
+    except ValueError as e:
+        return _json_error(str(e), 400)
 
 
 @app.get("/time/sessions")
@@ -511,17 +1143,7 @@ def get_time_sessions():
         
         return jsonify({
             "sessions": [
-                {
-                    "sessionId": s.session_id,
-                    "userId": s.user_id,
-                    "companyId": s.company_id,
-                    "gateIdEntry": s.gate_id_entry,
-                    "entryTime": s.entry_time.isoformat(),
-                    "exitTime": s.exit_time.isoformat() if s.exit_time else None,
-                    "durationSeconds": s.duration_seconds,
-                    "durationFormatted": _format_duration(s.duration_seconds) if s.duration_seconds else None,
-                    "status": s.status
-                }
+                _session_json(s)
                 for s in sessions
             ]
         })
@@ -563,26 +1185,22 @@ def get_time_summary():
     """Get time tracking summary statistics for the logged-in user"""
     try:
         user = _get_user_from_bearer()
-        sessions = store.get_user_time_sessions(user.user_id, limit=1000)
+        stats = store.get_user_time_stats(user.user_id)
         
-        completed_sessions = [s for s in sessions if s.status == "COMPLETED" and s.duration_seconds]
-        
-        total_time = sum(s.duration_seconds for s in completed_sessions)
-        avg_time = total_time // len(completed_sessions) if completed_sessions else 0
+        total_time = stats.total_seconds
+        avg_time = total_time // stats.completed_sessions if stats.completed_sessions else 0
         
         # Today's sessions
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_sessions = [s for s in completed_sessions if s.entry_time >= today_start]
-        today_total = sum(s.duration_seconds for s in today_sessions)
+        today_sessions, today_total = stats.day(datetime.utcnow().date())
         
         return jsonify({
             "summary": {
-                "totalSessions": len(completed_sessions),
+                "totalSessions": stats.completed_sessions,
                 "totalTimeSeconds": total_time,
                 "totalTimeFormatted": _format_duration(total_time),
                 "averageTimeSeconds": avg_time,
                 "averageTimeFormatted": _format_duration(avg_time),
-                "todaySessions": len(today_sessions),
+                "todaySessions": today_sessions,
                 "todayTimeSeconds": today_total,
                 "todayTimeFormatted": _format_duration(today_total),
                 "hasActiveSession": user.user_id in store.active_sessions
@@ -592,6 +1210,209 @@ def get_time_summary():
         return _json_error(str(e), 401)
 
 
+def _occupancy_json(version: int, by_gate: dict[str, int], by_company: dict[str, int]) -> dict:
+    return {
+        "version": version,
+        "total": sum(by_company.values()),
+        "gates": [
+            {"gateId": g.gate_id, "kind": g.kind, "companyId": g.company_id, "occupancy": by_gate.get(g.gate_id, 0)}
+            for g in store.gates.values()
+        ],
+        "companies": by_company,
+    }
+
+
+@app.get("/occupancy")
+def occupancy():
+    """People currently inside, per entry gate and per company, from active sessions"""
+    gate_id = request.args.get("gateId")
+    if gate_id:
+        if gate_id not in store.gates:
+            return _json_error("Unknown gateId", 404)
+        return jsonify({"gateId": gate_id, "occupancy": store.occupancy.gate(gate_id)})
+    return jsonify(_occupancy_json(*store.occupancy.snapshot()))
+
+
+@app.get("/occupancy/stream")
+def occupancy_stream():
+    """Push the occupancy counts on every change, as Server-Sent Events or NDJSON"""
+    fmt = request.args.get("format", "sse")
+    if fmt not in ("sse", "ndjson"):
+        return _json_error("format must be sse or ndjson", 400)
+    current_store = store
+    counts = current_store.occupancy
+    nonblocking = request.environ.get(NONBLOCKING_STREAMS, False)
+    poll = 0 if nonblocking else AUDIT_STREAM_POLL_SECONDS
+
+    def encode(snapshot: tuple) -> str:
+        data = json.dumps(_occupancy_json(*snapshot), separators=(",", ":"))
+        return f"id: {snapshot[0]}\nevent: occupancy\ndata: {data}\n\n" if fmt == "sse" else data + "\n"
+
+    def updates():
+        snapshot = counts.snapshot()
+        yield encode(snapshot)
+        sent = time.monotonic()
+        while True:
+            # Bursts of ENTRY/EXIT collapse into one update carrying the latest counts
+            if not counts.wait(snapshot[0], poll):
+                if not nonblocking:
+                    current_store.sync()
+                if counts.version == snapshot[0]:
+                    if time.monotonic() - sent >= AUDIT_STREAM_HEARTBEAT_SECONDS:
+                        sent = time.monotonic()
+                        yield ": keepalive\n\n" if fmt == "sse" else "\n"
+                    elif nonblocking:
+                        yield ""
+                    continue
+            sent = time.monotonic()
+            snapshot = counts.snapshot()
+            yield encode(snapshot)
+
+    mimetype = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    return Response(updates(), mimetype=mimetype, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+REPORT_MAX_DAYS = 92
+REPORT_MAX_HOUR_DAYS = 31
+
+
+def _report_range(max_days: int) -> tuple[date, date]:
+    """Inclusive ?start=&end= ISO dates, defaulting to the 7 days ending today"""
+    try:
+        end = date.fromisoformat(request.args["end"]) if request.args.get("end") else datetime.utcnow().date()
+        start = date.fromisoformat(request.args["start"]) if request.args.get("start") else end - timedelta(days=6)
+    except ValueError:
+        raise ValueError("start and end must be YYYY-MM-DD") from None
+    if start > end:
+        raise ValueError("start must not be after end")
+    if (end - start).days >= max_days:
+        raise ValueError(f"At most {max_days} days per report")
+    return start, end
+
+
+@app.get("/reports/company/days")
+def report_company_days():
+    """Per-day sessions, hours and distinct users for the caller's company"""
+    try:
+        user = _get_user_from_bearer()
+        start, end = _report_range(REPORT_MAX_DAYS)
+        return jsonify({"companyId": user.company_id,
+                        "days": store.rollups.company_days(user.company_id, start, end)})
+    except PermissionError as e:
+        return _json_error(str(e), 401)
+    except ValueError as e:
+        return _json_error(str(e), 400)
+
+
+@app.get("/reports/users/days")
+def report_user_days():
+    """Per-day sessions and hours for the caller or a colleague (?userId=)"""
+    try:
+        user = _get_user_from_bearer()
+        user_id = request.args.get("userId") or user.user_id
+        subject = store.users_by_id.get(user_id)
+        if not subject or subject.company_id != user.company_id:
+            return _json_error("Not authorized for user", 403)
+        start, end = _report_range(REPORT_MAX_DAYS)
+        return jsonify({"userId": user_id, "days": store.rollups.user_days(user_id, start, end)})
+    except PermissionError as e:
+        return _json_error(str(e), 401)
+    except ValueError as e:
+        return _json_error(str(e), 400)
+
+
+@app.get("/reports/gates/hours")
+def report_gate_hours():
+    """Per-hour entries and occupancy for a gate the caller's company can use"""
+    try:
+        user = _get_user_from_bearer()
+        gate_id = str(request.args.get("gateId", "")).strip()
+        if not gate_id:
+            return _json_error("Missing gateId", 400)
+        if gate_id not in store.gates:
+            return _json_error("Unknown gateId", 404)
+        if not store.access_policy.company_allows(user, gate_id):
+            return _json_error(f"Not authorized for gate: {gate_id}", 403)
+        start, end = _report_range(REPORT_MAX_HOUR_DAYS)
+        return jsonify({"gateId": gate_id, "hours": store.rollups.gate_hours(gate_id, start, end)})
+    except PermissionError as e:
+        return _json_error(str(e), 401)
+    except ValueError as e:
+        return _json_error(str(e), 400)
+
+
+EXPORT_PAGE = 1000
+AUDIT_EXPORT_COLUMNS = ["seq", "ts", "userId", "companyId", "gateId", "readerId", "decision", "reason",
+                        "doorStatus", "delegatedBy", "visitorPassId"]
+SESSION_EXPORT_COLUMNS = ["sessionId", "userId", "companyId", "gateIdEntry", "entryTime", "exitTime",
+                          "durationSeconds", "status"]
+
+
+def _export_response(name: str, columns: list[str], rows, headers: dict[str, str] | None = None) -> Response:
+    """Stream rows as NDJSON (default) or CSV per ?format=, gzipped with ?gzip=1"""
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in ("ndjson", "csv"):
+        raise ValueError("format must be ndjson or csv")
+    chunks = csv_chunks(columns, rows) if fmt == "csv" else ndjson_chunks(rows)
+    filename = f"{name}.{fmt}"
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    if request.args.get("gzip") in ("1", "true"):
+        chunks, filename, mimetype = gzip_chunks(chunks), filename + ".gz", "application/gzip"
+    return Response(chunks, mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"', **(headers or {})})
+
+
+@app.get("/export/audit")
+def export_audit():
+    """Stream every audit event in a time range, oldest first, reading evicted ones from the store's archive"""
+    try:
+        since_ts, until_ts = _epoch_arg("from"), _epoch_arg("to")
+        company_id = request.args.get("companyId") or None
+        current_store = store
+        audit_log = current_store.audit
+        # Evicted and neither spilled nor in a database: say so rather than quietly start later
+        headers = {} if current_store.audit_complete_since(since_ts) else {"X-Audit-Truncated": "1"}
+
+        def rows():
+            cursor = 0
+            while True:
+                first = audit_log.first_seq
+                if cursor < first:
+                    for seq, e in current_store.iter_archived_audit(cursor, first, since_ts=since_ts,
+                                                                    until_ts=until_ts, company_id=company_id):
+                        yield dict(_audit_json(e), seq=seq)
+                    cursor = first
+                page, cursor = audit_log.query(limit=EXPORT_PAGE, cursor=cursor, since_ts=since_ts,
+                                               until_ts=until_ts, company_id=company_id)
+                if not page:
+                    return
+                for seq, e in page:
+                    yield dict(_audit_json(e), seq=seq)
+
+        return _export_response("audit", AUDIT_EXPORT_COLUMNS, rows(), headers)
+    except ValueError as e:
+        return _json_error(str(e), 400)
+
+
+@app.get("/export/sessions")
+def export_sessions():
+    """Stream the caller's company's time sessions entered in a time range"""
+    try:
+        user = _get_user_from_bearer()
+        company_id = request.args.get("companyId") or user.company_id
+        if company_id != user.company_id:
+            return _json_error("Not authorized for company", 403)
+        since_ts, until_ts = _epoch_arg("from"), _epoch_arg("to")
+        since = datetime.utcfromtimestamp(since_ts) if since_ts is not None else None
+        until = datetime.utcfromtimestamp(until_ts) if until_ts is not None else None
+        sessions = store.iter_time_sessions(company_id=company_id, since=since, until=until)
+        return _export_response("sessions", SESSION_EXPORT_COLUMNS, (_session_json(s) for s in sessions))
+    except PermissionError as e:
+        return _json_error(str(e), 401)
+    except ValueError as e:
+        return _json_error(str(e), 400)
+
+
 def create_app() -> Flask:
     return app
 
@@ -599,4 +1420,3 @@ def create_app() -> Flask:
 if __name__ == "__main__":
     # For local development
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8000)), debug=False)
-
@@ -0,0 +1,240 @@
+"""
+Prometheus text-format metrics.
+
+Counters and histograms are sharded per thread: a thread increments its own
+preallocated cells with no lock, and a scrape sums the shards. Shards of
+threads that have exited are folded into a retired total, so thread-per-request
+servers don't grow the shard list without bound. Gauges are read from a
+callback at scrape time and cost nothing between scrapes.
+
+Values are per process; with several workers each one reports its own.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+# Seconds; fine enough at the low end for sub-millisecond stages
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+class _Family:
+    kind = ""
+
+    def __init__(self, registry: Registry, name: str, help_text: str, labelnames: tuple[str, ...]) -> None:
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._children: dict[tuple[str, ...], _Child] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> _Child:
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._child(values))
+        return child
+
+    def _child(self, values: tuple[str, ...]) -> _Child:
+        raise NotImplementedError
+
+    def _samples(self, totals: dict) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class _Child:
+    __slots__ = ("registry", "values", "width")
+
+    def __init__(self, registry: Registry, values: tuple[str, ...], width: int) -> None:
+        self.registry = registry
+        self.values = values
+        self.width = width
+
+    def _cells(self) -> list:
+        try:
+            shard = self.registry._local.shard
+        except AttributeError:
+            shard = self.registry._new_shard()
+        cells = shard.get(self)
+        if cells is None:
+            cells = shard[self] = [0] * self.width
+        return cells
+
+
+class _CounterChild(_Child):
+    __slots__ = ()
+
+    def inc(self, amount: float = 1) -> None:
+        self._cells()[0] += amount
+
+
+class Counter(_Family):
+    kind = "counter"
+
+    def _child(self, values: tuple[str, ...]) -> _CounterChild:
+        return _CounterChild(self.registry, values, 1)
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self, totals: dict) -> Iterable[str]:
+        for values, child in sorted(self._children.items()):
+            cells = totals.get(child)
+            yield f"{self.name}{_labels(self.labelnames, values)} {_number(cells[0] if cells else 0)}"
+
+
+class _HistogramChild(_Child):
+    __slots__ = ("bounds",)
+
+    def __init__(self, registry: Registry, values: tuple[str, ...], bounds: tuple[float, ...]) -> None:
+        # One cell per bucket, one for +Inf, then the sum
+        super().__init__(registry, values, len(bounds) + 2)
+        self.bounds = bounds
+
+    def observe(self, value: float) -> None:
+        cells = self._cells()
+        cells[bisect_left(self.bounds, value)] += 1
+        cells[-1] += value
+
+
+class Histogram(_Family):
+    kind = "histogram"
+
+    def __init__(self, registry: Registry, name: str, help_text: str, labelnames: tuple[str, ...],
+                 buckets: tuple[float, ...]) -> None:
+        super().__init__(registry, name, help_text, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _child(self, values: tuple[str, ...]) -> _HistogramChild:
+        return _HistogramChild(self.registry, values, self.bounds)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self, totals: dict) -> Iterable[str]:
+        for values, child in sorted(self._children.items()):
+            cells = totals.get(child) or [0] * child.width
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), cells):
+                cumulative += count
+                le = 'le="' + _number(float(bound)) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, values)} {_number(float(cells[-1]))}"
+            yield f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}"
+
+
+class Gauge(_Family):
+    """
+    A value read at scrape time. The callback returns a number, or for a
+    labelled gauge an iterable of (label values, number).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, registry: Registry, name: str, help_text: str, labelnames: tuple[str, ...],
+                 read: Callable[[], float | Iterable[tuple[tuple[str, ...], float]]]) -> None:
+        super().__init__(registry, name, help_text, labelnames)
+        self.read = read
+
+    def _samples(self, totals: dict) -> Iterable[str]:
+        value = self.read()
+        rows = value if self.labelnames else [((), value)]
+        for values, number in rows:
+            yield f"{self.name}{_labels(self.labelnames, tuple(values))} {_number(number)}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._families: list[_Family] = []
+        self._local = threading.local()
+        self._shards: list[tuple[threading.Thread, dict]] = []
+        self._retired: dict[_Child, list] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, family: _Family) -> _Family:
+        if any(f.name == family.name for f in self._families):
+            raise ValueError(f"Duplicate metric: {family.name}")
+        self._families.append(family)
+        return family
+
+    def counter(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(self, name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, help_text, labelnames, buckets))
+
+    def gauge(self, name: str, help_text: str, read: Callable, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(self, name, help_text, labelnames, read))
+
+    def _new_shard(self) -> dict:
+        shard = self._local.shard = {}
+        with self._lock:
+            if len(self._shards) > 2 * threading.active_count() + 8:
+                self._fold_exited()
+            self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _fold_exited(self) -> None:
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                _add_into(self._retired, shard)
+        self._shards = live
+
+    def _totals(self) -> dict[_Child, list]:
+        with self._lock:
+            self._fold_exited()
+            totals = {child: list(cells) for child, cells in self._retired.items()}
+            for _, shard in self._shards:
+                _add_into(totals, shard)
+        return totals
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        totals = self._totals()
+        lines: list[str] = []
+        for family in self._families:
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            lines.extend(family._samples(totals))
+        return "\n".join(lines) + "\n"
+
+
+def _add_into(totals: dict[_Child, list], shard: dict[_Child, list]) -> None:
+    # list() copies the items in one step, so a thread adding a child meanwhile can't break the loop
+    for child, cells in list(shard.items()):
+        acc = totals.get(child)
+        if acc is None:
+            totals[child] = list(cells)
+        else:
+            for i, value in enumerate(cells):
+                acc[i] += value
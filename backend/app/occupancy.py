@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .store import TimeSession
+
+
+class Occupancy:
+    """
+    Live head counts per entry gate and per company, from ACTIVE time sessions.
+
+    The store calls enter() when a session becomes ACTIVE and leave() when an
+    ACTIVE session completes (exit, auto-close or a sync from another worker),
+    so reading a count is a dict lookup. ``version`` increases on every change
+    and wait() blocks until it moves, for streaming subscribers.
+    """
+
+    def __init__(self) -> None:
+        self.by_gate: dict[str, int] = {}
+        self.by_company: dict[str, int] = {}
+        self.version = 0
+        self._changed = threading.Condition()
+
+    def enter(self, session: TimeSession) -> None:
+        with self._changed:
+            self.by_gate[session.gate_id_entry] = self.by_gate.get(session.gate_id_entry, 0) + 1
+            self.by_company[session.company_id] = self.by_company.get(session.company_id, 0) + 1
+            self.version += 1
+            self._changed.notify_all()
+
+    def leave(self, session: TimeSession) -> None:
+        with self._changed:
+            _decrement(self.by_gate, session.gate_id_entry)
+            _decrement(self.by_company, session.company_id)
+            self.version += 1
+            self._changed.notify_all()
+
+    def replace(self, other: Occupancy) -> None:
+        """Take over other's counts, e.g. rebuilt from reloaded sessions, as one change"""
+        with self._changed:
+            self.by_gate, self.by_company = dict(other.by_gate), dict(other.by_company)
+            self.version += 1
+            self._changed.notify_all()
+
+    def gate(self, gate_id: str) -> int:
+        return self.by_gate.get(gate_id, 0)
+
+    def company(self, company_id: str) -> int:
+        return self.by_company.get(company_id, 0)
+
+    def snapshot(self) -> tuple[int, dict[str, int], dict[str, int]]:
+        """Consistent copy of (version, by_gate, by_company)"""
+        with self._changed:
+            return self.version, dict(self.by_gate), dict(self.by_company)
+
+    def wait(self, version: int, timeout: float) -> bool:
+        """Block until the counts change from ``version``; False on timeout"""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.version != version, timeout)
+
+
+def _decrement(counts: dict[str, int], key: str) -> None:
+    remaining = counts.get(key, 0) - 1
+    if remaining > 0:
+        counts[key] = remaining
+    else:
+        counts.pop(key, None)
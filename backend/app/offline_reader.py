@@ -0,0 +1,189 @@
+"""
+Reader-side verifier for offline-capable gates.
+
+A reader holds the backend's public keys (from /.well-known/jwks.json) and a
+signed policy snapshot (from /reader/policy). With those it decides ALLOW or
+DENY locally, mirroring /access/verify plus the snapshot's revoked-device
+list, and buffers audit events that are uploaded later through
+POST /audit/bulk. Only the snapshot refresh and the audit upload need the
+network, so doors keep working through outages.
+
+    reader = OfflineReader("READER_1", jwks)
+    reader.apply_snapshot(resp["snapshot"])          # GET /reader/policy?since=<reader.version>
+    decision = reader.verify("BLD_ACME", token, door_opened=True)
+    events = reader.drain_audit()                   # POST /audit/bulk {"events": events}
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Any
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+
+from .bloom import BloomFilter
+from .policy_snapshot import SNAPSHOT_TYP
+from .replay import REPLAY, RETRY, ReplayGuard
+from .security import _b64url_decode, verify_access_jwt
+
+
+class OfflineReader:
+    def __init__(self, reader_id: str, jwks: dict[str, Any], token_ttl_seconds: int = 20) -> None:
+        self.reader_id = reader_id
+        self.version = 0
+        self._replay_guard = ReplayGuard(bucket_seconds=token_ttl_seconds)
+        self._keys: dict[str, Ed25519PublicKey] = {}
+        self.set_jwks(jwks)
+
+        self._gates: dict[str, dict[str, Any]] = {}
+        self._users: dict[str, str] = {}  # user_id -> company_id
+        self._revoked_devices: set[str] | BloomFilter = set()
+        self._delegations: dict[tuple[str, str], list[int]] = {}  # (delegatee, gate) -> [valid_until]
+        self._visitor_passes: dict[str, dict[str, Any]] = {}
+        self._audit: list[dict[str, Any]] = []
+
+    def set_jwks(self, jwks: dict[str, Any]) -> None:
+        """Replace the trusted signing keys"""
+        self._keys = {
+            k["kid"]: Ed25519PublicKey.from_public_bytes(_b64url_decode(k["x"]))
+            for k in jwks.get("keys", [])
+            if k.get("kty") == "OKP" and k.get("crv") == "Ed25519"
+        }
+
+    def _key_for(self, token: str) -> Ed25519PublicKey:
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidKeyError(f"Unknown kid: {kid}")
+        return key
+
+    # -- policy snapshot ---------------------------------------------------
+
+    def apply_snapshot(self, signed: str) -> int:
+        """Verify a signed snapshot (full or delta) and merge it; returns the new policy version"""
+        if jwt.get_unverified_header(signed).get("typ") != SNAPSHOT_TYP:
+            raise ValueError("Not a policy snapshot")
+        snapshot = jwt.decode(signed, self._key_for(signed), algorithms=["EdDSA"])
+        # A validly signed but older snapshot would roll back revocations and used-up passes
+        if snapshot["version"] < self.version:
+            raise ValueError("Snapshot is older than the held version")
+        if snapshot.get("since", 0) not in (0, self.version):
+            raise ValueError("Delta does not apply to the held snapshot version")
+
+        sections = snapshot["sections"]
+        if "gates" in sections:
+            self._gates = {g["gateId"]: g for g in sections["gates"]}
+        if "users" in sections:
+            self._users = {u["userId"]: u["companyId"] for u in sections["users"]}
+        if "revokedDevices" in sections:
+            revoked = sections["revokedDevices"]
+            # The id list, or a Bloom filter for GET /reader/policy?revoked=bloom
+            self._revoked_devices = BloomFilter.from_json(revoked) if isinstance(revoked, dict) else set(revoked)
+        if "delegations" in sections:
+            grants: dict[tuple[str, str], list[int]] = {}
+            for d in sections["delegations"]:
+                for gate_id in d["gateIds"]:
+                    grants.setdefault((d["delegateeId"], gate_id), []).append(d["validUntil"])
+            self._delegations = grants
+        if "visitorPasses" in sections:
+            self._visitor_passes = {p["passId"]: dict(p) for p in sections["visitorPasses"]}
+        self.version = snapshot["version"]
+        return self.version
+
+    # -- decisions ---------------------------------------------------------
+
+    def verify(self, gate_id: str, token: str, *, door_opened: bool = False) -> dict[str, str]:
+        """Decide a scan locally and buffer its audit event"""
+        now = int(time.time())
+        gate = self._gates.get(gate_id)
+        if gate is None:
+            return self._deny(gate_id, "UNKNOWN_GATE", "Unknown gate")
+
+        try:
+            payload = verify_access_jwt(token=token, public_key=self._key_for(token))
+        except Exception:
+            return self._deny(gate_id, "INVALID_TOKEN", "Invalid token")
+
+        user_id = payload.get("sub")
+        delegated_by = payload.get("delegated_by")
+        visitor_pass_id = payload.get("visitor_pass_id")
+
+        if payload.get("did") in self._revoked_devices:
+            return self._deny(gate_id, "DEVICE_REVOKED", "Device revoked", user_id=user_id)
+
+        visitor_pass = None
+        if visitor_pass_id:
+            visitor_pass = self._visitor_passes.get(visitor_pass_id)
+            if not visitor_pass or visitor_pass["validUntil"] <= now:
+                return self._deny(gate_id, "INVALID_VISITOR_PASS", "Invalid visitor pass")
+            if visitor_pass["usedCount"] >= visitor_pass["maxUses"]:
+                return self._deny(gate_id, "USAGE_EXCEEDED", "Visitor pass usage exceeded",
+                                  company_id=visitor_pass["hostCompanyId"], visitor_pass_id=visitor_pass_id)
+
+        company_id = self._users.get(user_id)
+        door_status = "OPENED" if door_opened else "UNKNOWN"
+        if company_id is None:
+            return self._deny(gate_id, "USER_INACTIVE", "Unknown/inactive user", user_id=user_id,
+                              company_id=payload.get("cid"), door_status=door_status)
+
+        if payload.get("gid") != gate_id:
+            return self._deny(gate_id, "GATE_MISMATCH", "Token gate mismatch", user_id=user_id,
+                              company_id=company_id, door_status=door_status)
+
+        has_access = gate["kind"] == "MAIN" or gate["companyId"] == company_id
+        if not has_access and gate["kind"] == "BUILDING" and delegated_by:
+            has_access = any(until > now for until in self._delegations.get((user_id, gate_id), ()))
+        if not has_access:
+            return self._deny(gate_id, "NOT_ALLOWED", "Not allowed for building", user_id=user_id,
+                              company_id=company_id, door_status=door_status, delegated_by=delegated_by,
+                              visitor_pass_id=visitor_pass_id)
+
+        jti = payload.get("jti")
+        use, first_result = (self._replay_guard.claim(str(jti), int(payload["exp"]), self.reader_id) if jti
+                             else (REPLAY, None))
+        if use == RETRY:
+            # Answered as on first use, which already took the pass use; logged again, as an ALLOW opens the door
+            result = dict(first_result) if first_result else {"decision": "DENY", "reason": "RETRY_PENDING"}
+            allowed = result["decision"] == "ALLOW"
+            self._log(gate_id, result["decision"], "Token retried", user_id=user_id, company_id=company_id,
+                      door_status="OPENED" if door_opened else ("FAILED" if allowed else "UNKNOWN"),
+                      delegated_by=delegated_by, visitor_pass_id=visitor_pass_id)
+            return result
+        if use == REPLAY:
+            return self._deny(gate_id, "REPLAYED", "Token already used", user_id=user_id, company_id=company_id,
+                              door_status=door_status, delegated_by=delegated_by, visitor_pass_id=visitor_pass_id)
+
+        if visitor_pass is not None:
+            visitor_pass["usedCount"] += 1
+        self._log(gate_id, "ALLOW", "OK", user_id=user_id, company_id=company_id,
+                  door_status="OPENED" if door_opened else "FAILED", delegated_by=delegated_by,
+                  visitor_pass_id=visitor_pass_id)
+        result = {"decision": "ALLOW", "reason": "OK"}
+        self._replay_guard.settle(str(jti), int(payload["exp"]), result)
+        return result
+
+    def _deny(self, gate_id: str, code: str, reason: str, **fields: Any) -> dict[str, str]:
+        self._log(gate_id, "DENY", reason, **fields)
+        return {"decision": "DENY", "reason": code}
+
+    def _log(self, gate_id: str, decision: str, reason: str, *, user_id: str | None = None,
+             company_id: str | None = None, door_status: str = "UNKNOWN", delegated_by: str | None = None,
+             visitor_pass_id: str | None = None) -> None:
+        self._audit.append({
+            "ts": int(time.time()),
+            "userId": user_id,
+            "companyId": company_id,
+            "gateId": gate_id,
+            "readerId": self.reader_id,
+            "decision": decision,
+            "reason": reason,
+            "doorStatus": door_status,
+            "delegatedBy": delegated_by,
+            "visitorPassId": visitor_pass_id,
+        })
+
+    def drain_audit(self) -> list[dict[str, Any]]:
+        """Take the buffered audit events for upload to POST /audit/bulk"""
+        events, self._audit = self._audit, []
+        return events
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .store import Delegation, InMemoryStore, User, VisitorPass
+
+
+class AccessPolicy:
+    """
+    Compiled gate authorization for a store.
+
+    Every gate gets a bit; a principal's allowed gates are an int bitmask, so
+    a decision is one AND however many gates and buildings there are:
+
+    - MAIN gates are open to every active user
+    - BUILDING gates are open to users of the owning company
+    - delegations add gates per delegatee, recompiled for that user only when
+      one of their delegations changes or the earliest of them expires
+    - visitor passes are open for their own gates
+
+    Gate and company masks are recompiled whenever the store's "gates" policy
+    section changes.
+    """
+
+    def __init__(self, store: InMemoryStore) -> None:
+        self.store = store
+        self._compiled_for = 0  # "gates" section version compiled
+        self._gate_bits: dict[str, int] = {}
+        self._public_mask = 0
+        self._company_masks: dict[str, int] = {}
+        self._delegated: dict[str, tuple[int, datetime | None]] = {}  # user_id -> (mask, recompile at)
+        self._visitor_masks: dict[str, int] = {}
+
+    def _compile(self) -> None:
+        """Rebuild gate bits and per-company masks if the gates changed"""
+        version = self.store.section_versions["gates"]
+        if version == self._compiled_for:
+            return
+        gate_bits: dict[str, int] = {}
+        public_mask = 0
+        company_masks: dict[str, int] = {}
+        for i, gate in enumerate(self.store.gates.values()):
+            bit = gate_bits[gate.gate_id] = 1 << i
+            if gate.kind == "MAIN":
+                public_mask |= bit
+            elif gate.kind == "BUILDING" and gate.company_id:
+                company_masks[gate.company_id] = company_masks.get(gate.company_id, 0) | bit
+        self._gate_bits, self._public_mask, self._company_masks = gate_bits, public_mask, company_masks
+        # Bit positions may have moved
+        self._delegated.clear()
+        self._visitor_masks.clear()
+        self._compiled_for = version
+
+    def _mask(self, gate_ids: list[str]) -> int:
+        mask = 0
+        for gate_id in gate_ids:
+            mask |= self._gate_bits.get(gate_id, 0)
+        return mask
+
+    def delegation_changed(self, delegation: Delegation) -> None:
+        """Drop the delegatee's compiled delegation mask after a delegation is added or updated"""
+        self._delegated.pop(delegation.delegatee_id, None)
+
+    def visitor_pass_removed(self, pass_id: str) -> None:
+        self._visitor_masks.pop(pass_id, None)
+
+    def _delegated_mask(self, user_id: str, now: datetime) -> int:
+        entry = self._delegated.get(user_id)
+        if entry is None or (entry[1] is not None and entry[1] <= now):
+            delegations = self.store.get_active_delegations_for_user(user_id)
+            mask = 0
+            for delegation in delegations:
+                mask |= self._mask(delegation.gate_ids)
+            entry = self._delegated[user_id] = (mask, min((d.valid_until for d in delegations), default=None))
+        return entry[0]
+
+    def company_allows(self, user: User, gate_id: str) -> bool:
+        """Whether gate_id is open to user through their company alone (what they may delegate or share)"""
+        self._compile()
+        return bool((self._public_mask | self._company_masks.get(user.company_id, 0)) & self._gate_bits.get(gate_id, 0))
+
+    def check(self, user: User, gate_id: str) -> tuple[bool, Delegation | None]:
+        """Whether user may pass gate_id, and the delegation granting it if not their own company's"""
+        self._compile()
+        bit = self._gate_bits.get(gate_id)
+        if bit is None or not user.active:
+            return False, None
+        if (self._public_mask | self._company_masks.get(user.company_id, 0)) & bit:
+            return True, None
+        if self._delegated_mask(user.user_id, datetime.utcnow()) & bit:
+            # The mask is a filter; the store has the authoritative delegation (and its delegator)
+            delegation = self.store.find_delegation(user.user_id, gate_id)
+            return delegation is not None, delegation
+        return False, None
+
+    def allows_visitor(self, visitor_pass: VisitorPass, gate_id: str) -> bool:
+        """Whether a visitor pass covers gate_id"""
+        self._compile()
+        mask = self._visitor_masks.get(visitor_pass.pass_id)
+        if mask is None:
+            mask = self._visitor_masks[visitor_pass.pass_id] = self._mask(visitor_pass.gate_ids)
+        return bool(mask & self._gate_bits.get(gate_id, 0))
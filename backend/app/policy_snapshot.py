@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import time
+from datetime import datetime, timezone
+from typing import Any
+
+from .lazy import LazyModule
+from .security import SigningKeys
+from .store import POLICY_SECTIONS, InMemoryStore
+
+jwt = LazyModule("jwt")
+
+SNAPSHOT_TYP = "oneaccess-policy+jwt"
+
+
+def _epoch(dt: datetime) -> int:
+    return int(dt.replace(tzinfo=timezone.utc).timestamp())
+
+
+def _gates(store: InMemoryStore) -> list[dict[str, Any]]:
+    return [{"gateId": g.gate_id, "kind": g.kind, "companyId": g.company_id} for g in store.gates.values()]
+
+
+def _users(store: InMemoryStore) -> list[dict[str, Any]]:
+    return [{"userId": u.user_id, "companyId": u.company_id} for u in store.users_by_id.values() if u.active]
+
+
+def _revoked_devices(store: InMemoryStore) -> list[str]:
+    return sorted(store.revoked_devices)
+
+
+def _revoked_devices_bloom(store: InMemoryStore) -> dict[str, Any]:
+    return store.revoked_devices_filter().to_json()
+
+
+def _delegations(store: InMemoryStore) -> list[dict[str, Any]]:
+    now = datetime.utcnow()
+    return [
+        {
+            "delegationId": d.delegation_id,
+            "delegatorId": d.delegator_id,
+            "delegateeId": d.delegatee_id,
+            "gateIds": d.gate_ids,
+            "validUntil": _epoch(d.valid_until),
+        }
+        for d in list(store.delegations.values())
+        if d.active and d.valid_until > now
+    ]
+
+
+def _visitor_passes(store: InMemoryStore) -> list[dict[str, Any]]:
+    now = datetime.utcnow()
+    return [
+        {
+            "passId": p.pass_id,
+            "hostCompanyId": p.host_company_id,
+            "gateIds": p.gate_ids,
+            "validUntil": _epoch(p.valid_until),
+            "usedCount": p.used_count,
+            "maxUses": p.max_uses,
+        }
+        for p in list(store.visitor_passes.values())
+        if p.active and p.valid_until > now
+    ]
+
+
+_BUILDERS = {
+    "gates": _gates,
+    "users": _users,
+    "revokedDevices": _revoked_devices,
+    "delegations": _delegations,
+    "visitorPasses": _visitor_passes,
+}
+
+
+def build_snapshot(store: InMemoryStore, since: int = 0, *, revoked_bloom: bool = False) -> dict[str, Any]:
+    """
+    Build the reader policy snapshot.
+
+    With ``since`` set to a version the reader already holds, only sections
+    changed after that version are included; each included section replaces
+    the reader's copy wholesale. With ``revoked_bloom`` the revokedDevices
+    section is a Bloom filter (see bloom.py) rather than the list of ids.
+    """
+    full = since <= 0 or since > store.policy_version
+    builders = dict(_BUILDERS, revokedDevices=_revoked_devices_bloom) if revoked_bloom else _BUILDERS
+    sections = {
+        name: builders[name](store)
+        for name in POLICY_SECTIONS
+        if full or store.section_versions[name] > since
+    }
+    return {
+        "v": 1,
+        "version": store.policy_version,
+        "since": 0 if full else since,
+        "iat": int(time.time()),
+        "sections": sections,
+    }
+
+
+def sign_snapshot(snapshot: dict[str, Any], keys: SigningKeys) -> str:
+    """Sign a snapshot as a compact JWS readers can check against /.well-known/jwks.json"""
+    headers = {"kid": keys.kid, "alg": "EdDSA", "typ": SNAPSHOT_TYP}
+    return jwt.encode(snapshot, keys.private_key, algorithm="EdDSA", headers=headers)
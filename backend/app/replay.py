@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import heapq
+import threading
+import time
+
+
+# claim() outcomes
+FIRST_USE = "FIRST_USE"
+RETRY = "RETRY"  # same owner presenting the token again, e.g. after a door-sensor timeout
+REPLAY = "REPLAY"
+
+# A token may be retried this many times, within this many seconds of its first use
+MAX_RETRIES = 3
+RETRY_WINDOW_SECONDS = 10
+
+
+class ReplayGuard:
+    """
+    Remembers the jti of every token presented until that token expires.
+
+    jtis are kept in a time wheel of buckets ``bucket_seconds`` wide, keyed by
+    the token's exp. With the bucket width aligned to the token TTL only two or
+    three buckets are ever live, so memory is bounded by issuance rate x TTL,
+    and expiry drops a whole bucket at a time.
+
+    The decision made on first use is kept with the jti (settle()), so a
+    retry can be answered with it instead of being decided, and acted on,
+    again. Retries are bounded by ``max_retries`` and ``retry_window``.
+    """
+
+    def __init__(self, bucket_seconds: int, *, max_retries: int = MAX_RETRIES,
+                 retry_window: int = RETRY_WINDOW_SECONDS) -> None:
+        self.bucket_seconds = max(1, bucket_seconds)
+        self.max_retries = max_retries
+        self.retry_window = retry_window
+        # exp // bucket_seconds -> {jti: [owner, first use, retries, settled result]}
+        self._buckets: dict[int, dict[str, list]] = {}
+        self._order: list[int] = []  # heap of live bucket indexes
+        self._lock = threading.Lock()
+
+    def claim(self, jti: str, exp: int, owner: str) -> tuple[str, dict | None]:
+        """
+        Record a presentation of jti by owner. Returns FIRST_USE, RETRY or
+        REPLAY, and for RETRY the result settled on first use (None while
+        that is still being decided).
+        """
+        index = exp // self.bucket_seconds
+        now = int(time.time())
+        with self._lock:
+            self._expire(now // self.bucket_seconds)
+            bucket = self._buckets.get(index)
+            if bucket is None:
+                bucket = self._buckets[index] = {}
+                heapq.heappush(self._order, index)
+            entry = bucket.get(jti)
+            if entry is None:
+                bucket[jti] = [owner, now, 0, None]
+                return FIRST_USE, None
+            first_owner, first_use, retries, result = entry
+            if first_owner != owner or retries >= self.max_retries or now - first_use > self.retry_window:
+                return REPLAY, None
+            entry[2] = retries + 1
+        return RETRY, result
+
+    def settle(self, jti: str, exp: int, result: dict) -> None:
+        """Keep the result of jti's first use for its retries"""
+        with self._lock:
+            entry = self._buckets.get(exp // self.bucket_seconds, {}).get(jti)
+            if entry is not None:
+                entry[3] = result
+
+    def _expire(self, current: int) -> None:
+        # Every token in a bucket below the current index has already expired
+        order = self._order
+        while order and order[0] < current:
+            del self._buckets[heapq.heappop(order)]
+
+    def __len__(self) -> int:
+        return sum(len(b) for b in self._buckets.values())
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import threading
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Any, Iterable
+
+np = None  # optional: vectorized rebuilds; imported by the first rebuild instead of at startup
+_numpy_checked = False
+
+if TYPE_CHECKING:
+    from .store import TimeSession
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+DAY = 86400
+HOUR = 3600
+
+
+def _load_numpy():
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            pass
+        _numpy_checked = True
+    return np
+
+
+def _epoch(dt: datetime) -> int:
+    return int((dt - _EPOCH).total_seconds())
+
+
+def epoch_day(day: date) -> int:
+    return day.toordinal() - _EPOCH_ORDINAL
+
+
+def _bump(buckets: dict, key: tuple, count: int, seconds: int) -> None:
+    bucket = buckets.get(key)
+    if bucket is None:
+        buckets[key] = [count, seconds]
+    else:
+        bucket[0] += count
+        bucket[1] += seconds
+
+
+class TimeRollups:
+    """
+    Incrementally maintained time-tracking aggregates.
+
+    Each completed session is folded in once, when it completes:
+
+    - user_day:    (user_id, epoch day)    -> [sessions, seconds]
+    - company_day: (company_id, epoch day) -> [sessions, seconds], plus the distinct users
+    - gate_hour:   (entry gate, epoch hour) -> [entries, occupied seconds]
+
+    Sessions count towards the day they were entered, as in TimeStats. Gate
+    occupancy splits each session's seconds across the hours it spans.
+    Reports read one bucket per day or hour in the range, never the sessions.
+    """
+
+    def __init__(self) -> None:
+        self.user_day: dict[tuple[str, int], list[int]] = {}
+        self.company_day: dict[tuple[str, int], list[int]] = {}
+        self.company_day_users: dict[tuple[str, int], set[str]] = {}
+        self.gate_hour: dict[tuple[str, int], list[int]] = {}
+        self._lock = threading.Lock()
+        # Cleared while a store folds in history loaded in the background; reports wait for it
+        self.ready = threading.Event()
+        self.ready.set()
+
+    def add(self, session: TimeSession) -> None:
+        # Zero-length sessions are skipped, as in TimeStats
+        if session.exit_time is None or not session.duration_seconds:
+            return
+        entry, exit_time = _epoch(session.entry_time), _epoch(session.exit_time)
+        day = entry // DAY
+        with self._lock:
+            _bump(self.user_day, (session.user_id, day), 1, session.duration_seconds)
+            _bump(self.company_day, (session.company_id, day), 1, session.duration_seconds)
+            self.company_day_users.setdefault((session.company_id, day), set()).add(session.user_id)
+            _bump(self.gate_hour, (session.gate_id_entry, entry // HOUR), 1, 0)
+            for hour in range(entry // HOUR, (exit_time - 1) // HOUR + 1):
+                overlap = min(exit_time, (hour + 1) * HOUR) - max(entry, hour * HOUR)
+                _bump(self.gate_hour, (session.gate_id_entry, hour), 0, overlap)
+
+    def rebuild(self, sessions: Iterable[TimeSession]) -> None:
+        """
+        Recompute every rollup from scratch, vectorized with NumPy when it is
+        installed. Sessions completing while this runs are folded into the
+        tables being replaced, so run it at startup or while the store is quiet.
+        """
+        fresh = TimeRollups()
+        completed = [s for s in sessions if s.exit_time is not None and s.duration_seconds]
+        if not completed or _load_numpy() is None:
+            for session in completed:
+                fresh.add(session)
+        else:
+            fresh._rebuild_numpy(completed)
+        self.replace(fresh)
+
+    def replace(self, other: TimeRollups) -> None:
+        """Take over other's tables in place of this one's"""
+        with self._lock:
+            self.user_day, self.company_day = other.user_day, other.company_day
+            self.company_day_users, self.gate_hour = other.company_day_users, other.gate_hour
+
+    def merge(self, other: TimeRollups) -> None:
+        """
+        Fold in rollups built over other sessions. other is used up: this
+        takes over its tables, usually the larger, and folds its own in.
+        """
+        with self._lock:
+            for buckets, theirs in ((self.user_day, other.user_day), (self.company_day, other.company_day),
+                                    (self.gate_hour, other.gate_hour)):
+                for key, (count, seconds) in buckets.items():
+                    _bump(theirs, key, count, seconds)
+            for key, users in self.company_day_users.items():
+                other.company_day_users.setdefault(key, set()).update(users)
+            self.user_day, self.company_day = other.user_day, other.company_day
+            self.company_day_users, self.gate_hour = other.company_day_users, other.gate_hour
+
+    def _rebuild_numpy(self, sessions: list[TimeSession]) -> None:
+        entry = np.fromiter((_epoch(s.entry_time) for s in sessions), dtype=np.int64, count=len(sessions))
+        exit_time = np.fromiter((_epoch(s.exit_time) for s in sessions), dtype=np.int64, count=len(sessions))
+        seconds = np.fromiter((s.duration_seconds for s in sessions), dtype=np.int64, count=len(sessions))
+        users, user_codes = np.unique(np.array([s.user_id for s in sessions], dtype=object), return_inverse=True)
+        companies, company_codes = np.unique(np.array([s.company_id for s in sessions], dtype=object),
+                                             return_inverse=True)
+        gates, gate_codes = np.unique(np.array([s.gate_id_entry for s in sessions], dtype=object),
+                                      return_inverse=True)
+        day = entry // DAY
+
+        _group(self.user_day, users, user_codes, day, np.ones_like(seconds), seconds)
+        _group(self.company_day, companies, company_codes, day, np.ones_like(seconds), seconds)
+        triples = np.unique(np.stack([company_codes, day, user_codes]), axis=1)
+        for company, d, user in triples.T.tolist():
+            self.company_day_users.setdefault((companies[company], d), set()).add(users[user])
+
+        # Entries land in the entry hour; occupied seconds are spread over every hour a session spans
+        first_hour = entry // HOUR
+        spans = (exit_time - 1) // HOUR - first_hour + 1
+        rows = np.repeat(np.arange(len(sessions)), spans)
+        hour = first_hour[rows] + np.arange(len(rows)) - np.repeat(np.cumsum(spans) - spans, spans)
+        overlap = np.minimum(exit_time[rows], (hour + 1) * HOUR) - np.maximum(entry[rows], hour * HOUR)
+        _group(self.gate_hour, gates, np.concatenate([gate_codes, gate_codes[rows]]),
+               np.concatenate([first_hour, hour]), np.concatenate([np.ones_like(seconds), np.zeros_like(overlap)]),
+               np.concatenate([np.zeros_like(seconds), overlap]))
+
+    # -- reports: O(buckets in range) ----------------------------------------
+
+    def _days(self, buckets: dict, key: str, start: date, end: date) -> list[dict[str, Any]]:
+        out = []
+        self.ready.wait()
+        with self._lock:
+            for day in range(epoch_day(start), epoch_day(end) + 1):
+                sessions, seconds = buckets.get((key, day), (0, 0))
+                row = {"date": date.fromordinal(day + _EPOCH_ORDINAL).isoformat(),
+                       "sessions": sessions, "totalSeconds": seconds}
+                if buckets is self.company_day:
+                    row["users"] = len(self.company_day_users.get((key, day), ()))
+                out.append(row)
+        return out
+
+    def user_days(self, user_id: str, start: date, end: date) -> list[dict[str, Any]]:
+        """Per-day totals for a user, start and end inclusive"""
+        return self._days(self.user_day, user_id, start, end)
+
+    def company_days(self, company_id: str, start: date, end: date) -> list[dict[str, Any]]:
+        """Per-day totals and distinct users for a company, start and end inclusive"""
+        return self._days(self.company_day, company_id, start, end)
+
+    def gate_hours(self, gate_id: str, start: date, end: date) -> list[dict[str, Any]]:
+        """Per-hour entries and occupancy for a gate over whole days, start and end inclusive"""
+        out = []
+        self.ready.wait()
+        with self._lock:
+            for hour in range(epoch_day(start) * 24, (epoch_day(end) + 1) * 24):
+                entries, seconds = self.gate_hour.get((gate_id, hour), (0, 0))
+                out.append({
+                    "hour": (_EPOCH + timedelta(hours=hour)).isoformat(),
+                    "entries": entries,
+                    "occupiedSeconds": seconds,
+                    "averageOccupancy": round(seconds / HOUR, 2),
+                })
+        return out
+
+
+def _group(buckets: dict, names, codes, periods, counts, seconds) -> None:
+    """Sum counts and seconds per (name, period) into buckets"""
+    base = periods.min()
+    width = int(periods.max() - base) + 1
+    keys, inverse = np.unique(codes.astype(np.int64) * width + (periods - base), return_inverse=True)
+    count_sums = np.bincount(inverse, weights=counts, minlength=len(keys)).astype(np.int64)
+    second_sums = np.bincount(inverse, weights=seconds, minlength=len(keys)).astype(np.int64)
+    pairs = zip(names[keys // width].tolist(), (keys % width + base).tolist())
+    sums = map(list, zip(count_sums.tolist(), second_sums.tolist()))
+    if not buckets:
+        # A rebuild's fresh tables: keys are unique, so build them without a Python-level loop
+        buckets.update(zip(pairs, sums))
+        return
+    for key, (n, secs) in zip(pairs, sums):
+        _bump(buckets, key, n, secs)
@@ -1,14 +1,30 @@
 from __future__ import annotations
 
 import base64
+import hashlib
+import json
 import os
+import threading
 import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Any
+from typing import TYPE_CHECKING, Any, Iterator
 
-import jwt
-from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
-from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, PublicFormat, NoEncryption
+from .lazy import LazyModule
+
+if TYPE_CHECKING:
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+
+# Imported on first use, so app.main starts without them (see warm_up there)
+jwt = LazyModule("jwt")
+_ed25519 = LazyModule("cryptography.hazmat.primitives.asymmetric.ed25519")
+_serialization = LazyModule("cryptography.hazmat.primitives.serialization")
+
+try:  # POSIX; elsewhere rotations from several processes at once are not serialised
+    import fcntl
+except ImportError:
+    fcntl = None
 
 
 def _b64url(data: bytes) -> str:
@@ -20,6 +36,15 @@ def _b64url_decode(s: str) -> bytes:
     return base64.urlsafe_b64decode((s + pad).encode("ascii"))
 
 
+def _raw_private(private_key: Ed25519PrivateKey) -> bytes:
+    return private_key.private_bytes(_serialization.Encoding.Raw, _serialization.PrivateFormat.Raw,
+                                     _serialization.NoEncryption())
+
+
+def _raw_public(public_key: Ed25519PublicKey) -> bytes:
+    return public_key.public_bytes(_serialization.Encoding.Raw, _serialization.PublicFormat.Raw)
+
+
 @dataclass(frozen=True)
 class SigningKeys:
     kid: str
@@ -27,7 +52,7 @@ class SigningKeys:
     public_key: Ed25519PublicKey
 
     def public_jwk(self) -> dict[str, Any]:
-        pub = self.public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
+        pub = _raw_public(self.public_key)
         return {"kty": "OKP", "crv": "Ed25519", "x": _b64url(pub), "kid": self.kid, "use": "sig", "alg": "EdDSA"}
 
 
@@ -46,16 +71,16 @@ def load_or_create_keys(data_dir: str) -> SigningKeys:
             kid = f.read().strip()
         return SigningKeys(
             kid=kid,
-            private_key=Ed25519PrivateKey.from_private_bytes(priv_raw),
-            public_key=Ed25519PublicKey.from_public_bytes(pub_raw),
+            private_key=_ed25519.Ed25519PrivateKey.from_private_bytes(priv_raw),
+            public_key=_ed25519.Ed25519PublicKey.from_public_bytes(pub_raw),
         )
 
-    private_key = Ed25519PrivateKey.generate()
+    private_key = _ed25519.Ed25519PrivateKey.generate()
     public_key = private_key.public_key()
     kid = _b64url(os.urandom(8))
 
-    priv_raw = private_key.private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption())
-    pub_raw = public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
+    priv_raw = _raw_private(private_key)
+    pub_raw = _raw_public(public_key)
     with open(priv_path, "wb") as f:
         f.write(priv_raw)
     with open(pub_path, "wb") as f:
@@ -66,16 +91,294 @@ def load_or_create_keys(data_dir: str) -> SigningKeys:
     return SigningKeys(kid=kid, private_key=private_key, public_key=public_key)
 
 
-def issue_access_jwt(*, keys: SigningKeys, claims: dict[str, Any], ttl_seconds: int) -> str:
-    now = int(time.time())
+def _keys_from_private(kid: str, priv_raw: bytes) -> SigningKeys:
+    private_key = _ed25519.Ed25519PrivateKey.from_private_bytes(priv_raw)
+    return SigningKeys(kid=kid, private_key=private_key, public_key=private_key.public_key())
+
+
+class KeyRing:
+    """
+    Signing keys listed in data_dir/keyring.json, for rotation without a restart.
+
+    Each entry is {"kid", "file", "notBefore"}. The signer is the newest key
+    whose notBefore has passed; the ``keep_previous`` keys before it still
+    verify, so tokens and snapshots signed just before a rotation stay valid.
+    Keys scheduled for later are published in the JWKS straight away, letting
+    readers fetch them before the first token signed with them arrives.
+
+    Nothing is read from disk until the ring is first used. A missing
+    manifest is then created around the single key from load_or_create_keys,
+    so existing deployments keep their kid. Every process re-reads the
+    manifest when it changes (checked every ``reload_seconds``), so a
+    rotation made by one worker or from the command line reaches all of
+    them. Readers hold the manifest lock shared, writers exclusive.
+    """
+
+    MANIFEST = "keyring.json"
+
+    def __init__(self, data_dir: str, *, keep_previous: int = 2, reload_seconds: float = 5.0) -> None:
+        self.data_dir = data_dir
+        self.keep_previous = max(0, keep_previous)
+        self.reload_seconds = reload_seconds
+        self._path = os.path.join(data_dir, self.MANIFEST)
+        self._lock = threading.Lock()
+        self._version: tuple[int, int] | None = None  # manifest (inode, mtime_ns); every write is a new file
+        self._entries: list[tuple[int, SigningKeys]] = []  # (notBefore, keys), oldest first
+        self._current: SigningKeys | None = None
+        self._verify: dict[str, Ed25519PublicKey] = {}  # kid -> key, for every key that verifies
+        self._by_header: dict[str, Ed25519PublicKey] = {}  # access token header segment -> key
+        self._jwks: dict[str, Any] = {"keys": []}
+        self._next_check = 0.0  # first use loads the keys
+
+    # -- manifest ----------------------------------------------------------
+
+    @contextmanager
+    def _manifest_lock(self, shared: bool = False) -> Iterator[None]:
+        """Serialise manifest writers across processes; shared, keeps them out while keys load"""
+        os.makedirs(self.data_dir, exist_ok=True)
+        with open(f"{self._path}.lock", "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+
+    def _read(self) -> list[dict[str, Any]]:
+        with open(self._path, "r", encoding="utf-8") as f:
+            return json.load(f)["keys"]
+
+    def _write(self, entries: list[dict[str, Any]]) -> None:
+        tmp = f"{self._path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"keys": entries}, f, indent=2)
+        os.replace(tmp, self._path)
+
+    def _create_if_missing(self) -> None:
+        """Start the manifest from the single legacy key; caller holds the manifest lock"""
+        if not os.path.exists(self._path):
+            legacy = load_or_create_keys(self.data_dir)
+            self._write([{"kid": legacy.kid, "file": "ed25519_private.key", "notBefore": 0}])
+
+    def _refresh(self, now: float) -> None:
+        """Reload the manifest if it changed and re-derive the signer; called when _next_check passes"""
+        with self._lock:
+            if not os.path.exists(self._path):
+                with self._manifest_lock():
+                    self._create_if_missing()
+            st = os.stat(self._path)
+            if (st.st_ino, st.st_mtime_ns) != self._version:
+                # Shared lock: a rotation can't swap the manifest or delete a key file mid-read
+                with self._manifest_lock(shared=True):
+                    st = os.stat(self._path)
+                    entries = []
+                    for e in self._read():
+                        with open(os.path.join(self.data_dir, e["file"]), "rb") as f:
+                            entries.append((int(e["notBefore"]), _keys_from_private(e["kid"], f.read())))
+                entries.sort(key=lambda entry: entry[0])
+                self._entries, self._version = entries, (st.st_ino, st.st_mtime_ns)
+            active = [keys for not_before, keys in self._entries if not_before <= now] or [self._entries[0][1]]
+            pending = [(not_before, keys) for not_before, keys in self._entries if not_before > now]
+            published = active[-1 - self.keep_previous:] + [keys for _, keys in pending]
+
+            self._verify = {keys.kid: keys.public_key for keys in published}
+            self._by_header = {access_token_signer(keys).header_segment: keys.public_key for keys in published}
+            self._jwks = {"keys": [keys.public_jwk() for keys in reversed(published)]}
+            self._current = active[-1]
+            # Look again at the next scheduled activation or reload check, whichever is first
+            self._next_check = min([now + self.reload_seconds] + [not_before for not_before, _ in pending])
+
+    def _maybe_refresh(self) -> None:
+        now = time.time()
+        if now >= self._next_check:
+            self._refresh(now)
+
+    # -- use ---------------------------------------------------------------
+
+    def current(self) -> SigningKeys:
+        """The key to sign with now"""
+        self._maybe_refresh()
+        return self._current
+
+    def public_key(self, kid: str) -> Ed25519PublicKey | None:
+        """Verification key for kid, if it is current, recent enough or scheduled"""
+        self._maybe_refresh()
+        return self._verify.get(kid)
+
+    def key_for_token(self, token: str) -> Ed25519PublicKey | None:
+        """
+        Verification key for a compact JWS, found from its kid in one dict
+        lookup. Tokens from AccessTokenSigner match on the raw header
+        segment, so the header is only decoded for other serializations.
+        """
+        self._maybe_refresh()
+        header_segment = token.partition(".")[0]
+        key = self._by_header.get(header_segment)
+        if key is None:
+            try:
+                kid = json.loads(_b64url_decode(header_segment)).get("kid")
+            except (ValueError, AttributeError):
+                return None
+            key = self._verify.get(kid) if isinstance(kid, str) else None
+        return key
+
+    def jwks(self) -> dict[str, Any]:
+        """Public keys of every key that verifies now or will sign later, newest first"""
+        self._maybe_refresh()
+        return self._jwks
+
+    def rotate(self, activate_at: float | None = None) -> SigningKeys:
+        """
+        Add a new key that becomes the signer at activate_at (epoch seconds,
+        default now). Keys too old to verify any more are dropped from the
+        manifest and their files deleted.
+        """
+        private_key = _ed25519.Ed25519PrivateKey.generate()
+        kid = _b64url(os.urandom(8))
+        os.makedirs(os.path.join(self.data_dir, "keys"), exist_ok=True)
+        file = os.path.join("keys", f"{kid}.ed25519")
+        with open(os.path.join(self.data_dir, file), "wb") as f:
+            f.write(_raw_private(private_key))
+
+        with self._manifest_lock():
+            # A ring nobody has used yet has no manifest; the legacy key stays in it
+            self._create_if_missing()
+            now = time.time()
+            entries = sorted(self._read(), key=lambda e: e["notBefore"])
+            not_before = int(activate_at if activate_at is not None else now)
+            entries.append({"kid": kid, "file": file, "notBefore": not_before})
+            entries.sort(key=lambda e: e["notBefore"])
+            # Keep every scheduled key, the newest active one and keep_previous before it
+            active = [e for e in entries if e["notBefore"] <= now]
+            dropped = active[:-1 - self.keep_previous] if active else []
+            self._write([e for e in entries if e not in dropped])
+            for e in dropped:
+                if e["file"] != "ed25519_private.key":
+                    try:
+                        os.remove(os.path.join(self.data_dir, e["file"]))
+                    except OSError:
+                        pass
+        self._refresh(time.time())
+        return SigningKeys(kid=kid, private_key=private_key, public_key=private_key.public_key())
+
+
+class AccessTokenSigner:
+    """
+    Compact EdDSA JWS encoder for one signing key.
+
+    The header segment is serialized once per key instead of on every call,
+    and payloads go straight to json/base64 and the Ed25519 sign without
+    PyJWT's per-call algorithm lookup and header merging. Output is
+    byte-identical to jwt.encode with the same header.
+    """
+
+    def __init__(self, keys: SigningKeys) -> None:
+        self.kid = keys.kid
+        self._sign = keys.private_key.sign
+        header = {"alg": "EdDSA", "kid": keys.kid, "typ": "JWT"}
+        self.header_segment = _b64url(json.dumps(header, separators=(",", ":"), sort_keys=True).encode("utf-8"))
+
+    def encode(self, payload: dict[str, Any]) -> str:
+        signing_input = f"{self.header_segment}.{_b64url(json.dumps(payload, separators=(',', ':')).encode('utf-8'))}"
+        return f"{signing_input}.{_b64url(self._sign(signing_input.encode('ascii')))}"
+
+
+_signers: dict[str, AccessTokenSigner] = {}
+
+
+def access_token_signer(keys: SigningKeys) -> AccessTokenSigner:
+    """Get the cached signer for keys"""
+    signer = _signers.get(keys.kid)
+    if signer is None:
+        signer = _signers[keys.kid] = AccessTokenSigner(keys)
+    return signer
+
+
+def _timed_payload(claims: dict[str, Any], now: int, ttl_seconds: int) -> dict[str, Any]:
     payload = dict(claims)
     payload["iat"] = now
     payload["nbf"] = now - 1
     payload["exp"] = now + ttl_seconds
-    headers = {"kid": keys.kid, "alg": "EdDSA", "typ": "JWT"}
-    return jwt.encode(payload, keys.private_key, algorithm="EdDSA", headers=headers)
+    return payload
+
+
+def issue_access_jwt(*, keys: SigningKeys, claims: dict[str, Any], ttl_seconds: int) -> str:
+    return access_token_signer(keys).encode(_timed_payload(claims, int(time.time()), ttl_seconds))
+
+
+def issue_access_jwts(*, keys: SigningKeys, claims: list[dict[str, Any]], ttl_seconds: int) -> list[str]:
+    """Sign several tokens sharing one iat/exp"""
+    now = int(time.time())
+    encode = access_token_signer(keys).encode
+    return [encode(_timed_payload(c, now, ttl_seconds)) for c in claims]
+
+
+_ACCESS_ALGORITHMS = ["EdDSA"]
+_access_decoder = None
+
+
+def _build_access_decoder():
+    """Decoder with options resolved once instead of re-merged on every call"""
+    global _access_decoder
+    _access_decoder = jwt.PyJWT(options={"require": ["exp", "iat"]})
+    return _access_decoder
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of verified token payloads keyed by a hash of the token.
+
+    Entries are only served until the token's exp, so a reader retrying the
+    same token skips the Ed25519 check without extending its lifetime.
+    """
+
+    def __init__(self, max_entries: int = 10_000) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[bytes, tuple[int, dict[str, Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token: str) -> dict[str, Any] | None:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, token: str, payload: dict[str, Any]) -> None:
+        exp = payload.get("exp")
+        if not isinstance(exp, int) or self.max_entries <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (exp, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
 
 
-def verify_access_jwt(*, token: str, public_key: Ed25519PublicKey) -> dict[str, Any]:
-    return jwt.decode(token, public_key, algorithms=["EdDSA"], options={"require": ["exp", "iat"]})
+def verify_access_jwt(*, token: str, public_key: Ed25519PublicKey | None = None, keys: KeyRing | None = None,
+                      cache: VerifiedTokenCache | None = None) -> dict[str, Any]:
+    """Verify with public_key, or with the key ring's key for the token's kid"""
+    if keys is not None:
+        # Before the cache: a token whose key has rotated out of the ring must stop verifying
+        public_key = keys.key_for_token(token)
+        if public_key is None:
+            raise jwt.InvalidKeyError("Unknown kid")
+    if cache is not None:
+        payload = cache.get(token)
+        if payload is not None:
+            return payload
+    payload = (_access_decoder or _build_access_decoder()).decode(token, public_key, algorithms=_ACCESS_ALGORITHMS)
+    if cache is not None:
+        cache.put(token, payload)
+    return payload
 
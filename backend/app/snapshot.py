@@ -0,0 +1,471 @@
+"""
+Binary snapshots of an InMemoryStore, and the write-ahead log records that
+follow them.
+
+Snapshot file: ``OASNAP01``, a u32 header length and a JSON header (format,
+generation, policy versions and a table of sections as name -> [offset,
+length]), then the sections, each 8-byte aligned. All integers are
+little-endian.
+
+- ``strings`` / ``history_strings`` / ``audit_strings``: u32 count, u32
+  character length per string, then the UTF-8 text of all of them. Id 0 is
+  None.
+- ``users``, ``gates``, ``revoked_devices``, ``delegations``,
+  ``visitor_passes``, ``active_sessions``: a table of u32 row count and one
+  column block per field. Strings are u32 ids into ``strings``, datetimes
+  i64 microseconds since the epoch, nullable ints i64 with INT64_MIN for
+  None, flags u8, and string lists an offsets block (u32, rows + 1) plus
+  a u32 id block.
+- ``session_history``: completed sessions in entry order, the same table
+  layout with ids into ``history_strings``.
+- ``audit``: u32 segment count, then per segment i64 base_seq, count,
+  min_ts and max_ts, the i64 ts column and one u32 column per string field
+  holding ids into ``audit_strings``, exactly as AuditLog keeps them.
+
+MappedSnapshot restores a store in two steps. restore_state() decodes what
+requests need into objects and reads the audit columns in place: full
+segments keep pointing at the mapping and are paged in, and indexed, only
+when a query reaches them. session_history() decodes the bulk of the file,
+which only history and report reads need, so it can run afterwards.
+
+WAL records: u32 payload length, u32 CRC-32 of the payload, then the
+payload, a kind byte and its fields. A torn record at the end of a log (a
+crash mid-write) fails its length or CRC check and ends the replay there.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from dataclasses import fields
+from datetime import datetime, timedelta
+from typing import Any, Iterator
+
+from .audit_log import AuditEvent
+from .store import Delegation, Gate, InMemoryStore, TimeSession, User, VisitorPass
+
+MAGIC = b"OASNAP01"
+FORMAT = 1
+NONE_INT = -(2 ** 63)
+_NONE_STR = 0xFFFFFFFF
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Field kinds, in dataclass field order: s string, L string list, d datetime, n nullable int, q int, B flag
+_KINDS = {
+    User: "sssB",
+    Gate: "sss",
+    Delegation: "sssLdsBd",
+    VisitorPass: "ssssLdsBdqq",
+    TimeSession: "ssssddns",
+    AuditEvent: "qsssssssss",
+}
+for _cls, _kinds in _KINDS.items():
+    assert len(_kinds) == len(fields(_cls)), _cls
+
+# WAL record kinds
+AUDIT, DELEGATION, VISITOR_PASS, SESSION, REVOKED, USER_STATUS, VERSION = range(1, 8)
+_RECORD_TYPES = {DELEGATION: Delegation, VISITOR_PASS: VisitorPass, SESSION: TimeSession}
+
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_FRAME = struct.Struct("<II")
+_SEGMENT = struct.Struct("<qqqq")
+
+
+def _micros(dt: datetime | None) -> int:
+    return NONE_INT if dt is None else (dt - _EPOCH) // _MICROSECOND
+
+
+def _datetime(micros: int) -> datetime | None:
+    return None if micros == NONE_INT else _EPOCH + timedelta(microseconds=micros)
+
+
+def _row(obj: Any) -> tuple:
+    return tuple(getattr(obj, f.name) for f in fields(obj))
+
+
+# -- snapshot writing -----------------------------------------------------------
+
+class _StringTable:
+    def __init__(self) -> None:
+        self.ids: dict[str, int] = {}
+        self.strings: list[str] = []
+
+    def id(self, value: str | None) -> int:
+        if value is None:
+            return 0
+        code = self.ids.get(value)
+        if code is None:
+            self.strings.append(value)
+            code = self.ids[value] = len(self.strings)
+        return code
+
+
+def _strings_block(strings: list[str | None]) -> bytes:
+    """Strings by id, with id 0 (None) implied"""
+    strings = strings[1:] if strings and strings[0] is None else strings
+    return (_U32.pack(len(strings)) + array("I", [len(s) for s in strings]).tobytes()
+            + "".join(strings).encode("utf-8"))
+
+
+def _pad(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 8)
+
+
+def _table_block(rows: list[tuple], kinds: str, strings: _StringTable) -> bytes:
+    parts = [_pad(_U32.pack(len(rows)))]
+    for i, kind in enumerate(kinds):
+        column = [row[i] for row in rows]
+        if kind == "s":
+            parts.append(_pad(array("I", map(strings.id, column)).tobytes()))
+        elif kind == "B":
+            parts.append(_pad(bytes(map(bool, column))))
+        elif kind == "q":
+            parts.append(array("q", column).tobytes())
+        elif kind == "n":
+            parts.append(array("q", (NONE_INT if v is None else v for v in column)).tobytes())
+        elif kind == "d":
+            parts.append(array("q", map(_micros, column)).tobytes())
+        elif kind == "L":
+            offsets = array("I", [0])
+            ids = array("I")
+            for values in column:
+                ids.extend(map(strings.id, values))
+                offsets.append(len(ids))
+            parts.append(_pad(offsets.tobytes()))
+            parts.append(_pad(ids.tobytes()))
+    return b"".join(parts)
+
+
+def _audit_block(segments: list) -> bytes:
+    parts = [_pad(_U32.pack(len(segments)))]
+    for base_seq, min_ts, max_ts, ts, cols in segments:
+        parts.append(_SEGMENT.pack(base_seq, len(ts), min_ts, max_ts))
+        parts.append(bytes(ts))
+        parts.extend(_pad(bytes(col)) for col in cols)
+    return b"".join(parts)
+
+
+def write_snapshot(store: InMemoryStore, path: str, *, generation: int = 0) -> int:
+    """
+    Write store to path (atomically, through a temporary file) and return
+    its size in bytes. Safe while other threads use the store: each
+    collection is copied in one step, so an object changing meanwhile is
+    saved either before or after the change.
+    """
+    strings, history_strings = _StringTable(), _StringTable()
+    users = [_row(u) for u in list(store.users_by_id.values())]
+    gates = [_row(g) for g in list(store.gates.values())]
+    revoked = [(d,) for d in list(store.revoked_devices)]
+    delegations = [_row(d) for d in list(store.delegations.values())]
+    passes = [_row(p) for p in list(store.visitor_passes.values())]
+    # Entry order, which keeps each user's history in order when indexed again
+    sessions = sorted(list(store.time_sessions.values()), key=lambda s: s.entry_time)
+    active = [_row(s) for s in sessions if s.status == "ACTIVE"]
+    history = [_row(s) for s in sessions if s.status != "ACTIVE"]
+    audit_strings, audit_segments = store.audit.columns()
+
+    sections = {
+        "users": _table_block(users, _KINDS[User], strings),
+        "gates": _table_block(gates, _KINDS[Gate], strings),
+        "revoked_devices": _table_block(revoked, "s", strings),
+        "delegations": _table_block(delegations, _KINDS[Delegation], strings),
+        "visitor_passes": _table_block(passes, _KINDS[VisitorPass], strings),
+        "active_sessions": _table_block(active, _KINDS[TimeSession], strings),
+        "session_history": _table_block(history, _KINDS[TimeSession], history_strings),
+        "history_strings": _strings_block(history_strings.strings),
+        "audit_strings": _strings_block(audit_strings),
+        "audit": _audit_block(audit_segments),
+    }
+    sections["strings"] = _strings_block(strings.strings)
+
+    table: dict[str, list[int]] = {}
+    offset = 0
+    for name, data in sections.items():
+        table[name] = [offset, len(data)]
+        offset += len(data) + (-len(data) % 8)
+    header = json.dumps({
+        "format": FORMAT,
+        "generation": generation,
+        "policyVersion": store.policy_version,
+        "sectionVersions": store.section_versions,
+        "sections": table,
+    }).encode("utf-8")
+    preamble = _pad(MAGIC + _U32.pack(len(header)) + header)
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(preamble)
+        for data in sections.values():
+            f.write(_pad(data))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(preamble) + offset
+
+
+# -- snapshot loading -----------------------------------------------------------
+
+class _Cursor:
+    def __init__(self, view: memoryview, offset: int) -> None:
+        self.view = view
+        self.offset = offset
+
+    def take(self, size: int, fmt: str | None = None) -> memoryview:
+        """The next size bytes, as fmt items if given; blocks are 8-byte aligned"""
+        block = self.view[self.offset:self.offset + size]
+        self.offset += size + (-size % 8)
+        return block.cast(fmt) if fmt else block
+
+    def u32(self) -> int:
+        return self.take(4, "I")[0]
+
+
+def _read_strings(view: memoryview) -> list[str | None]:
+    count = _U32.unpack_from(view)[0]
+    lengths = view[4:4 + 4 * count].cast("I").tolist()
+    text = bytes(view[4 + 4 * count:]).decode("utf-8")
+    strings: list[str | None] = [None]
+    start = 0
+    for length in lengths:
+        strings.append(text[start:start + length])
+        start += length
+    return strings
+
+
+def _read_table(view: memoryview, kinds: str, strings: list[str | None]) -> list[tuple]:
+    """Rows of a table block as tuples of Python values"""
+    cursor = _Cursor(view, 0)
+    rows = cursor.u32()
+    columns: list[list] = []
+    for kind in kinds:
+        if kind == "s":
+            columns.append([strings[i] for i in cursor.take(4 * rows, "I").tolist()])
+        elif kind == "B":
+            columns.append([bool(b) for b in cursor.take(rows)])
+        elif kind == "q":
+            columns.append(cursor.take(8 * rows, "q").tolist())
+        elif kind == "n":
+            columns.append([None if v == NONE_INT else v for v in cursor.take(8 * rows, "q").tolist()])
+        elif kind == "d":
+            columns.append([_datetime(v) for v in cursor.take(8 * rows, "q").tolist()])
+        elif kind == "L":
+            offsets = cursor.take(4 * (rows + 1), "I").tolist()
+            ids = [strings[i] for i in cursor.take(4 * offsets[-1], "I").tolist()]
+            columns.append([ids[offsets[r]:offsets[r + 1]] for r in range(rows)])
+    return list(zip(*columns)) if columns else []
+
+
+def _read_audit(view: memoryview) -> list:
+    cursor = _Cursor(view, 0)
+    segments = []
+    for _ in range(cursor.u32()):
+        base_seq, count, min_ts, max_ts = _SEGMENT.unpack(cursor.take(_SEGMENT.size))
+        ts = cursor.take(8 * count, "q")
+        cols = tuple(cursor.take(4 * count, "I") for _ in range(len(_KINDS[AuditEvent]) - 1))
+        segments.append((base_seq, min_ts, max_ts, ts, cols))
+    return segments
+
+
+def read_header(path: str) -> dict[str, Any]:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a store snapshot: {path}")
+        (length,) = _U32.unpack(f.read(4))
+        header = json.loads(f.read(length))
+    if header.get("format") != FORMAT:
+        raise ValueError(f"Unsupported snapshot format {header.get('format')}")
+    header["dataOffset"] = len(MAGIC) + 4 + length + (-(len(MAGIC) + 4 + length) % 8)
+    return header
+
+
+class MappedSnapshot:
+    """A snapshot file mapped into memory, restored into a store in parts"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.header = read_header(path)
+        with open(path, "rb") as f:
+            # Stays mapped for as long as restored audit segments refer to it
+            self._view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @property
+    def generation(self) -> int:
+        return self.header["generation"]
+
+    def _section(self, name: str) -> memoryview:
+        offset, length = self.header["sections"][name]
+        start = self.header["dataOffset"] + offset
+        return self._view[start:start + length]
+
+    def _rows(self, name: str, cls: type, strings: list[str | None]) -> list[tuple]:
+        return _read_table(self._section(name), _KINDS[cls], strings)
+
+    def restore_state(self, store: InMemoryStore) -> None:
+        """Fill a freshly created store with everything but the completed sessions"""
+        strings = _read_strings(self._section("strings"))
+        users = [User(*row) for row in self._rows("users", User, strings)]
+        store.users_by_id = {u.user_id: u for u in users}
+        store.users_by_email = {u.email: u for u in users}
+        store.gates = {g.gate_id: g for g in (Gate(*row) for row in self._rows("gates", Gate, strings))}
+        store.revoked_devices = {row[0] for row in _read_table(self._section("revoked_devices"), "s", strings)}
+        for row in self._rows("delegations", Delegation, strings):
+            store._index_delegation(Delegation(*row))
+        for row in self._rows("visitor_passes", VisitorPass, strings):
+            store._index_visitor_pass(VisitorPass(*row))
+        for row in self._rows("active_sessions", TimeSession, strings):
+            store._index_session(TimeSession(*row))
+        store.audit.restore(_read_strings(self._section("audit_strings")), _read_audit(self._section("audit")))
+        store.policy_version = self.header["policyVersion"]
+        store.section_versions.update(self.header["sectionVersions"])
+
+    def session_history(self) -> list[TimeSession]:
+        """Completed sessions, in entry order"""
+        strings = _read_strings(self._section("history_strings"))
+        return [TimeSession(*row) for row in self._rows("session_history", TimeSession, strings)]
+
+
+# -- write-ahead log records ----------------------------------------------------
+
+def _pack_str(out: list[bytes], value: str | None) -> None:
+    if value is None:
+        out.append(_U32.pack(_NONE_STR))
+    else:
+        data = value.encode("utf-8")
+        out.append(_U32.pack(len(data)))
+        out.append(data)
+
+
+def _pack_row(out: list[bytes], kinds: str, row: tuple) -> None:
+    for kind, value in zip(kinds, row):
+        if kind == "s":
+            _pack_str(out, value)
+        elif kind == "L":
+            out.append(_U32.pack(len(value)))
+            for item in value:
+                _pack_str(out, item)
+        elif kind == "B":
+            out.append(b"\1" if value else b"\0")
+        elif kind == "d":
+            out.append(_I64.pack(_micros(value)))
+        else:
+            out.append(_I64.pack(NONE_INT if value is None else value))
+
+
+def _frame(kind: int, parts: list[bytes]) -> bytes:
+    payload = bytes([kind]) + b"".join(parts)
+    return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def audit_record(first_seq: int, events: list[AuditEvent]) -> bytes:
+    parts = [_I64.pack(first_seq), _U32.pack(len(events))]
+    kinds = _KINDS[AuditEvent]
+    for event in events:
+        _pack_row(parts, kinds, _row(event))
+    return _frame(AUDIT, parts)
+
+
+def object_record(obj: Delegation | VisitorPass | TimeSession) -> bytes:
+    kind = next(k for k, cls in _RECORD_TYPES.items() if isinstance(obj, cls))
+    parts: list[bytes] = []
+    _pack_row(parts, _KINDS[type(obj)], _row(obj))
+    return _frame(kind, parts)
+
+
+def ids_record(kind: int, flag: bool, ids: list[str]) -> bytes:
+    """REVOKED (flag: revoked) or USER_STATUS (flag: active) for several ids"""
+    parts = [b"\1" if flag else b"\0", _U32.pack(len(ids))]
+    for value in ids:
+        _pack_str(parts, value)
+    return _frame(kind, parts)
+
+
+def version_record(policy_version: int) -> bytes:
+    return _frame(VERSION, [_I64.pack(policy_version)])
+
+
+class _Unpacker:
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.pos = 0
+
+    def u32(self) -> int:
+        value = _U32.unpack_from(self.data, self.pos)[0]
+        self.pos += 4
+        return value
+
+    def i64(self) -> int:
+        value = _I64.unpack_from(self.data, self.pos)[0]
+        self.pos += 8
+        return value
+
+    def flag(self) -> bool:
+        self.pos += 1
+        return self.data[self.pos - 1] != 0
+
+    def str(self) -> str | None:
+        length = self.u32()
+        if length == _NONE_STR:
+            return None
+        self.pos += length
+        return self.data[self.pos - length:self.pos].decode("utf-8")
+
+    def row(self, kinds: str) -> tuple:
+        values = []
+        for kind in kinds:
+            if kind == "s":
+                values.append(self.str())
+            elif kind == "L":
+                values.append([self.str() for _ in range(self.u32())])
+            elif kind == "B":
+                values.append(self.flag())
+            elif kind == "d":
+                values.append(_datetime(self.i64()))
+            elif kind == "n":
+                value = self.i64()
+                values.append(None if value == NONE_INT else value)
+            else:
+                values.append(self.i64())
+        return tuple(values)
+
+
+def read_wal(path: str) -> Iterator[tuple[int, Any, int]]:
+    """
+    Yield (kind, value, end offset) for each intact record in a log, where
+    value is (first seq, events) for AUDIT, the object for DELEGATION,
+    VISITOR_PASS and SESSION, (flag, ids) for REVOKED and USER_STATUS and
+    the policy version for VERSION. Stops at the first torn record.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos + _FRAME.size <= len(data):
+        length, crc = _FRAME.unpack_from(data, pos)
+        payload = data[pos + _FRAME.size:pos + _FRAME.size + length]
+        if len(payload) < length or not length or zlib.crc32(payload) != crc:
+            return
+        pos += _FRAME.size + length
+        kind = payload[0]
+        body = _Unpacker(payload)
+        body.pos = 1
+        if kind == AUDIT:
+            first_seq = body.i64()
+            kinds = _KINDS[AuditEvent]
+            value: Any = (first_seq, [AuditEvent(*body.row(kinds)) for _ in range(body.u32())])
+        elif kind in _RECORD_TYPES:
+            cls = _RECORD_TYPES[kind]
+            value = cls(*body.row(_KINDS[cls]))
+        elif kind in (REVOKED, USER_STATUS):
+            flag = body.flag()
+            value = (flag, [body.str() for _ in range(body.u32())])
+        elif kind == VERSION:
+            value = body.i64()
+        else:
+            return
+        yield kind, value, pos
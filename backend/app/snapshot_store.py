@@ -0,0 +1,398 @@
+from __future__ import annotations
+
+import gc
+import glob
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from . import snapshot
+from .audit_log import AuditEvent, AuditLog
+from .rollups import TimeRollups
+from .store import InMemoryStore, TimeSession, TimeStats, VisitorPass
+
+
+try:  # POSIX; elsewhere a second process on the directory is not detected
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "store.snap"
+LOCK_FILE = "store.lock"
+
+
+def _wal_path(directory: str, generation: int) -> str:
+    return os.path.join(directory, f"wal-{generation:08d}.log")
+
+
+def _wal_generations(directory: str) -> list[int]:
+    return sorted(int(os.path.basename(p)[4:12]) for p in glob.glob(os.path.join(directory, "wal-*.log")))
+
+
+@contextmanager
+def _bulk_load():
+    """
+    Pause the cyclic GC while millions of long-lived objects are created,
+    since every collection on the way would re-scan all of them, and then
+    freeze them so later collections skip them too.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.freeze()
+        if enabled:
+            gc.enable()
+
+
+class SnapshotStore(InMemoryStore):
+    """
+    InMemoryStore persisted as binary snapshots plus a write-ahead log.
+
+    Every state change (and audit event) is appended to the log of the
+    current generation by a background thread, in groups at most every
+    ``commit_interval`` seconds. Every ``snapshot_interval`` seconds, or
+    once the log passes ``snapshot_wal_bytes``, the same thread starts the
+    next generation's log and writes the whole store to ``store.snap`` (see
+    snapshot.py); older logs are then deleted.
+
+    Construction only maps the snapshot; a loader thread restores it and
+    replays the logs since. sync(), which every request calls first, waits
+    for that: users, gates, delegations, passes, open sessions and the audit
+    (read in place from the mapping). Completed sessions are loaded after
+    it, while requests are served; the session history, stats and report
+    reads wait for them, and nothing else does.
+
+    Log records are whole rows, so replaying one the snapshot already holds
+    is harmless. Audit records carry their sequence numbers and those below
+    the snapshot's are skipped. For one process at a time: unlike
+    SQLiteStore, workers can't share the files, so the constructor takes an
+    exclusive lock on the directory and raises RuntimeError if another
+    process holds it.
+    """
+
+    def __init__(self, directory: str, *, audit: AuditLog | None = None, commit_interval: float = 0.05,
+                 snapshot_interval: float = 300.0, snapshot_wal_bytes: int = 64 << 20) -> None:
+        super().__init__(audit=audit)
+        self.directory = directory
+        self.commit_interval = commit_interval
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_wal_bytes = snapshot_wal_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._dir_lock = self._lock_directory()
+
+        path = os.path.join(directory, SNAPSHOT_FILE)
+        self._mapped = snapshot.MappedSnapshot(path) if os.path.exists(path) else None
+        self.generation = self._mapped.generation if self._mapped else 0
+        self._wal = None
+        self._wal_bytes = 0  # appended by this process; a snapshot is only due once there are some
+        self._last_snapshot = time.monotonic()
+        self._pending: list[bytes] = []
+        self._cond = threading.Condition()
+        self._queued = 0
+        self._committed = 0
+        self._closing = False
+        self._writer = threading.Thread(target=self._writer_loop, name="snapshot-store-writer", daemon=True)
+
+        self._ready = threading.Event()
+        self._history_loaded = threading.Event()
+        self._history_complete = False
+        self._load_error: BaseException | None = None
+        self.rollups.ready.clear()
+        self._loader = threading.Thread(target=self._load, name="snapshot-store-loader", daemon=True)
+        self._loader.start()
+
+    def _lock_directory(self):
+        """Hold an exclusive flock on the directory's lock file until close(), or fail fast"""
+        lock = open(os.path.join(self.directory, LOCK_FILE), "w")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                raise RuntimeError(f"{self.directory} is in use by another process; "
+                                   "the snapshot store is for one process only (WEB_CONCURRENCY=1)") from None
+        return lock
+
+    def sync(self) -> None:
+        """Wait until the store is restored"""
+        self._ready.wait()
+        if self._load_error is not None:
+            raise RuntimeError(f"Store could not be restored from {self.directory}") from self._load_error
+
+    # -- recovery ----------------------------------------------------------
+
+    def _load(self) -> None:
+        started = time.perf_counter()
+        try:
+            with _bulk_load():
+                if self._mapped:
+                    self._mapped.restore_state(self)
+                self.generation = self._replay_logs()
+            self._wal = open(_wal_path(self.directory, self.generation), "ab")
+            self.audit.listener = self._log_audit
+            self._writer.start()
+        except BaseException as e:
+            self._load_error = e
+            log.exception("Store restore from %s failed", self.directory)
+            return
+        finally:
+            self._ready.set()
+        log.info("Store restored from %s in %.3fs", self.directory, time.perf_counter() - started)
+
+        try:
+            if self._mapped:
+                with _bulk_load():
+                    self._load_history(self._mapped.session_history())
+            self._history_complete = True
+            log.info("Session history loaded in %.3fs", time.perf_counter() - started)
+        except Exception:
+            log.exception("Session history could not be loaded; no snapshots will be written")
+        finally:
+            self.rollups.ready.set()
+            self._history_loaded.set()
+
+    def _replay_logs(self) -> int:
+        """Replay the logs after the snapshot; returns the generation to append to"""
+        generation = self.generation
+        for stale in (g for g in _wal_generations(self.directory) if g < generation):
+            os.remove(_wal_path(self.directory, stale))
+
+        replayed = [g for g in _wal_generations(self.directory) if g >= generation]
+        version = None
+        for g in replayed:
+            wal = _wal_path(self.directory, g)
+            end = 0
+            for kind, value, end in snapshot.read_wal(wal):
+                if kind == snapshot.VERSION:
+                    version = value
+                else:
+                    self._replay(kind, value)
+            if end < os.path.getsize(wal):
+                log.warning("Dropping a torn record at the end of %s", wal)
+                os.truncate(wal, end)
+        if version is not None:
+            # Past any version handed out before the restart; every section counts as changed
+            self.policy_version = max(self.policy_version, version) + 1
+            self.section_versions = dict.fromkeys(self.section_versions, self.policy_version)
+        return replayed[-1] if replayed else generation
+
+    def _replay(self, kind: int, value) -> None:
+        if kind == snapshot.AUDIT:
+            first_seq, events = value
+            skip = self.audit.next_seq - first_seq
+            if skip < len(events):
+                self.audit.extend(events[max(0, skip):])
+        elif kind == snapshot.DELEGATION:
+            self._apply_delegation(value)
+        elif kind == snapshot.VISITOR_PASS:
+            current = self.visitor_passes.get(value.pass_id)
+            if current is not None:
+                # Uses only grow, so the larger count is the later one
+                value.used_count = max(value.used_count, current.used_count)
+            self._index_visitor_pass(value)
+        elif kind == snapshot.SESSION:
+            self._apply_session(value)
+        elif kind == snapshot.REVOKED:
+            revoked, device_ids = value
+            if revoked:
+                self.revoked_devices.update(device_ids)
+            else:
+                self.revoked_devices.difference_update(device_ids)
+        elif kind == snapshot.USER_STATUS:
+            active, user_ids = value
+            for user_id in user_ids:
+                self._apply_user_status(user_id, active)
+
+    def _load_history(self, sessions: list[TimeSession]) -> None:
+        """
+        Fold the snapshot's completed sessions in under the sessions since.
+        Those the logs replayed are already indexed, with their newer state.
+        """
+        history = [s for s in sessions if s.session_id not in self.time_sessions]
+        by_user: dict[str, list[TimeSession]] = {}
+        for session in history:
+            by_user.setdefault(session.user_id, []).append(session)
+        rollups = TimeRollups()
+        rollups.rebuild(history)
+
+        self.time_sessions.update((s.session_id, s) for s in history)
+        for user_id, older in by_user.items():
+            with self._user_locks.for_key(user_id):
+                stats = self._time_stats.setdefault(user_id, TimeStats())
+                for session in older:
+                    stats.add(session)
+                self._sessions_by_user[user_id] = older + self._sessions_by_user.get(user_id, [])
+        self.rollups.merge(rollups)
+
+    def get_user_time_sessions(self, user_id: str, limit: int = 50) -> list[TimeSession]:
+        self._history_loaded.wait()
+        return super().get_user_time_sessions(user_id, limit)
+
+    def iter_time_sessions(self, **kwargs) -> Iterator[TimeSession]:
+        self._history_loaded.wait()
+        return super().iter_time_sessions(**kwargs)
+
+    def get_user_time_stats(self, user_id: str) -> TimeStats:
+        self._history_loaded.wait()
+        return super().get_user_time_stats(user_id)
+
+    def rebuild_rollups(self) -> None:
+        self._history_loaded.wait()
+        super().rebuild_rollups()
+
+    # -- write-ahead log -----------------------------------------------------
+
+    def _enqueue(self, record: bytes) -> None:
+        with self._cond:
+            self._pending.append(record)
+            self._queued += 1
+            self._cond.notify_all()
+
+    def _log_audit(self, first_seq: int, events: list[AuditEvent]) -> None:
+        # Called under the audit log's lock, so records are queued in sequence order
+        self._enqueue(snapshot.audit_record(first_seq, events))
+
+    def _snapshot_due(self, closing: bool = False) -> bool:
+        # A snapshot without the whole history would drop the rest
+        if not self._wal_bytes or not self._history_complete:
+            return False
+        return (closing or self._wal_bytes >= self.snapshot_wal_bytes
+                or time.monotonic() - self._last_snapshot >= self.snapshot_interval)
+
+    def _writer_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing and not self._snapshot_due():
+                    self._cond.wait(timeout=min(self.snapshot_interval, 1.0))
+                closing = self._closing
+            # Give concurrent requests a moment to join this group
+            if not closing:
+                time.sleep(self.commit_interval)
+            with self._cond:
+                batch, self._pending = self._pending, []
+            # Any failure is logged and the loop goes on: a dead writer would silently stop persistence
+            if batch:
+                try:
+                    self._append(batch)
+                except Exception:
+                    log.exception("Store log write failed; %d records lost", len(batch))
+            try:
+                if self._snapshot_due(closing):
+                    self._snapshot()
+            except Exception:
+                # The new generation's log is open, so later records are kept; the logs before it stay for replay
+                log.exception("Store snapshot failed")
+            with self._cond:
+                self._committed += len(batch)
+                self._cond.notify_all()
+                if closing and not self._pending:
+                    return
+
+    def _append(self, batch: list[bytes]) -> None:
+        data = b"".join(batch) + snapshot.version_record(self.policy_version)
+        self._wal.write(data)
+        self._wal.flush()
+        self._wal_bytes += len(data)
+
+    def _snapshot(self) -> None:
+        """
+        Start the next generation's log, then save the store. A change
+        queued before the switch was applied before the save began, so the
+        snapshot holds it; anything later is in the new log.
+        """
+        started = time.perf_counter()
+        generation = self.generation + 1
+        os.fsync(self._wal.fileno())
+        self._wal.close()
+        self._wal = open(_wal_path(self.directory, generation), "ab")
+        self._wal_bytes = 0
+        self.generation = generation
+        size = snapshot.write_snapshot(self, os.path.join(self.directory, SNAPSHOT_FILE), generation=generation)
+        for stale in (g for g in _wal_generations(self.directory) if g < generation):
+            os.remove(_wal_path(self.directory, stale))
+        self._last_snapshot = time.monotonic()
+        log.info("Store snapshot %d written: %d bytes in %.3fs", generation, size, time.perf_counter() - started)
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Block until everything queued so far is in the log"""
+        with self._cond:
+            target = self._queued
+            return self._cond.wait_for(lambda: self._committed >= target, timeout)
+
+    def close(self) -> None:
+        """Write outstanding records and a final snapshot, then release the directory"""
+        self._loader.join()
+        if self._writer.is_alive():
+            with self._cond:
+                self._closing = True
+                self._cond.notify_all()
+            self._writer.join()
+            self._wal.close()
+            self.audit.listener = None
+        self._dir_lock.close()  # drops the flock
+
+    # -- write-through overrides -------------------------------------------
+
+    def create_delegation(self, *args, **kwargs) -> str:
+        delegation_id = super().create_delegation(*args, **kwargs)
+        self._enqueue(snapshot.object_record(self.delegations[delegation_id]))
+        return delegation_id
+
+    def create_visitor_pass(self, *args, **kwargs) -> str:
+        pass_id = super().create_visitor_pass(*args, **kwargs)
+        self._enqueue(snapshot.object_record(self.visitor_passes[pass_id]))
+        return pass_id
+
+    def use_visitor_pass(self, pass_id: str) -> VisitorPass | None:
+        visitor_pass = super().use_visitor_pass(pass_id)
+        if visitor_pass:
+            self._enqueue(snapshot.object_record(visitor_pass))
+        return visitor_pass
+
+    def revoke_devices(self, device_ids: list[str]) -> list[str]:
+        added = super().revoke_devices(device_ids)
+        if added:
+            self._enqueue(snapshot.ids_record(snapshot.REVOKED, True, added))
+        return added
+
+    def unrevoke_devices(self, device_ids: list[str]) -> list[str]:
+        removed = super().unrevoke_devices(device_ids)
+        if removed:
+            self._enqueue(snapshot.ids_record(snapshot.REVOKED, False, removed))
+        return removed
+
+    def set_users_active(self, user_ids: list[str], active: bool) -> tuple[list[str], list[str]]:
+        changed, unknown = super().set_users_active(user_ids, active)
+        if changed:
+            self._enqueue(snapshot.ids_record(snapshot.USER_STATUS, active, changed))
+        return changed, unknown
+
+    def start_time_session(self, user_id: str, company_id: str, gate_id: str) -> str:
+        with self._user_locks.for_key(user_id):
+            previous = self.get_active_session(user_id)
+            session_id = super().start_time_session(user_id, company_id, gate_id)
+            if previous is not None:
+                self._enqueue(snapshot.object_record(previous))
+            self._enqueue(snapshot.object_record(self.time_sessions[session_id]))
+        return session_id
+
+    def end_time_session(self, user_id: str, gate_id: str) -> TimeSession | None:
+        with self._user_locks.for_key(user_id):
+            session = super().end_time_session(user_id, gate_id)
+            if session:
+                self._enqueue(snapshot.object_record(session))
+        return session
+
+    def close_stale_sessions(self, now: datetime, max_duration: timedelta) -> list[TimeSession]:
+        closed = super().close_stale_sessions(now, max_duration)
+        for session in closed:
+            self._enqueue(snapshot.object_record(session))
+        return closed
@@ -0,0 +1,624 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from .audit_log import AuditEvent, AuditLog
+from .replay import FIRST_USE, MAX_RETRIES, REPLAY, RETRY, RETRY_WINDOW_SECONDS
+from .store import Delegation, InMemoryStore, TimeSession, VisitorPass
+
+
+log = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS delegations (
+    delegation_id TEXT PRIMARY KEY,
+    delegator_id TEXT NOT NULL,
+    delegatee_id TEXT NOT NULL,
+    gate_ids TEXT NOT NULL,
+    valid_until TEXT NOT NULL,
+    created_by TEXT NOT NULL,
+    active INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS visitor_passes (
+    pass_id TEXT PRIMARY KEY,
+    created_by TEXT NOT NULL,
+    visitor_name TEXT NOT NULL,
+    visitor_phone TEXT NOT NULL,
+    gate_ids TEXT NOT NULL,
+    valid_until TEXT NOT NULL,
+    host_company_id TEXT NOT NULL,
+    active INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    used_count INTEGER NOT NULL,
+    max_uses INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS time_sessions (
+    session_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    company_id TEXT NOT NULL,
+    gate_id_entry TEXT NOT NULL,
+    entry_time TEXT NOT NULL,
+    exit_time TEXT,
+    duration_seconds INTEGER,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS time_sessions_entry ON time_sessions (entry_time);
+CREATE TABLE IF NOT EXISTS audit (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts INTEGER NOT NULL,
+    user_id TEXT,
+    company_id TEXT,
+    gate_id TEXT NOT NULL,
+    reader_id TEXT NOT NULL,
+    decision TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    door_status TEXT NOT NULL,
+    delegated_by TEXT,
+    visitor_pass_id TEXT,
+    origin TEXT
+);
+CREATE TABLE IF NOT EXISTS revoked_devices (
+    device_id TEXT PRIMARY KEY,
+    revoked_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_status (
+    user_id TEXT PRIMARY KEY,
+    active INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    origin TEXT NOT NULL
+);
+"""
+
+_REPLAY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS used_tokens (
+    jti TEXT PRIMARY KEY,
+    exp INTEGER NOT NULL,
+    owner TEXT NOT NULL,
+    first_use INTEGER,
+    retries INTEGER NOT NULL DEFAULT 0,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS used_tokens_exp ON used_tokens (exp);
+"""
+
+# Statements are module constants so sqlite3's per-connection statement
+# cache keeps them compiled across batches.
+_UPSERT_DELEGATION = "INSERT OR REPLACE INTO delegations VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+_UPSERT_VISITOR_PASS = "INSERT OR REPLACE INTO visitor_passes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+_UPSERT_SESSION = "INSERT OR REPLACE INTO time_sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+_INSERT_AUDIT = (
+    "INSERT INTO audit (ts, user_id, company_id, gate_id, reader_id, decision, reason, door_status, "
+    "delegated_by, visitor_pass_id, origin) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+_USE_VISITOR_PASS = ("UPDATE visitor_passes SET used_count = used_count + 1"
+                     " WHERE pass_id = ? AND used_count < max_uses RETURNING used_count")
+_REVOKE_DEVICE = "INSERT OR IGNORE INTO revoked_devices VALUES (?, ?)"
+_UNREVOKE_DEVICE = "DELETE FROM revoked_devices WHERE device_id = ?"
+_UPSERT_USER_STATUS = "INSERT OR REPLACE INTO user_status VALUES (?, ?)"
+_INSERT_CHANGE = "INSERT INTO changes (kind, key, origin) VALUES (?, ?, ?)"
+_PRUNE_CHANGES = "DELETE FROM changes WHERE id <= (SELECT max(id) FROM changes) - ?"
+_AUDIT_COLUMNS = (
+    "ts, user_id, company_id, gate_id, reader_id, decision, reason, door_status, delegated_by, visitor_pass_id"
+)
+
+# Change log kinds and the policy snapshot section each one belongs to
+_CHANGE_SECTIONS = {"delegation": "delegations", "visitor_pass": "visitorPasses", "session": None,
+                    "revoked_device": "revokedDevices", "user_status": "users"}
+CHANGES_KEEP = 100_000
+# Cache state _reload() swaps in; everything _load() fills
+_RELOADED_FIELDS = (
+    "users_by_email", "users_by_id", "revoked_devices", "_revoked_filter", "delegations",
+    "_delegations_by_delegatee", "_delegation_grants", "_delegation_expiry", "visitor_passes",
+    "_visitor_pass_expiry", "time_sessions", "active_sessions", "_sessions_by_user", "_session_starts",
+    "_time_stats", "policy_version", "section_versions", "_change_id",
+)
+_ARCHIVE_PAGE = 1000
+# Longest pause between attempts to commit a batch while the database is locked
+_RETRY_MAX_DELAY = 1.0
+
+
+def _dt(value: str | None) -> datetime | None:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SQLiteStore(InMemoryStore):
+    """
+    InMemoryStore persisted to a SQLite database in WAL mode.
+
+    The in-memory structures stay the read path, so lookups on the verify
+    path never touch the database. Writes are queued and a background
+    thread commits them in groups, at most every ``commit_interval`` seconds,
+    so a burst of verifies shares one transaction instead of one each. The
+    one exception is taking a visitor pass use, which the database decides
+    on the spot so processes sharing it can't together exceed max_uses.
+
+    Several processes may share one database file. Every state write is
+    also appended to a ``changes`` log tagged with this process's origin;
+    sync() pulls other processes' changes and audit rows into the cache,
+    and is cheap (one PRAGMA) when nothing was committed.
+
+    Audit events are numbered by the ``audit`` table's seq, so every process
+    (and every restart) agrees on them, and cursors work across workers.
+    An event recorded here therefore reaches the audit log only once it is
+    committed, in seq order with everyone else's, within about one
+    ``commit_interval``.
+    """
+
+    def __init__(self, path: str, *, audit: AuditLog | None = None, commit_interval: float = 0.05) -> None:
+        super().__init__(audit=audit)
+        self.path = path
+        self.commit_interval = commit_interval
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._conn = _connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._reader = _connect(path)
+        self._sync_lock = threading.Lock()
+        self._direct = _connect(path)  # writes that can't wait for the group commit
+        self._direct_lock = threading.Lock()
+        self._data_version = self._reader.execute("PRAGMA data_version").fetchone()[0]
+        self._change_id = 0
+        self._load(self._conn)
+        self._load_audit(self._conn)
+
+        self._pending: list[tuple[str, tuple]] = []
+        self._cond = threading.Condition()
+        self._queued = 0
+        self._committed = 0
+        self._closing = False
+        self._writer = threading.Thread(target=self._writer_loop, name="sqlite-store-writer", daemon=True)
+        self._writer.start()
+
+    def _migrate(self) -> None:
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(audit)")}
+        if "origin" not in columns:
+            self._conn.execute("ALTER TABLE audit ADD COLUMN origin TEXT")
+
+    # -- loading -----------------------------------------------------------
+
+    def _load(self, conn: sqlite3.Connection) -> None:
+        """Warm the in-memory cache from the database"""
+        for row in conn.execute("SELECT * FROM delegations"):
+            self._index_delegation(self._delegation(row))
+        for row in conn.execute("SELECT * FROM visitor_passes"):
+            self._index_visitor_pass(self._visitor_pass(row))
+        for row in conn.execute("SELECT * FROM time_sessions ORDER BY entry_time"):
+            self._index_session(self._session(row))
+        self.revoked_devices.update(row[0] for row in conn.execute("SELECT device_id FROM revoked_devices"))
+        for user_id, active in conn.execute("SELECT user_id, active FROM user_status"):
+            self._apply_user_status(user_id, bool(active))
+
+        # Policy version = change id + 1, so an empty log is version 1 as in InMemoryStore
+        self._change_id = conn.execute("SELECT coalesce(max(id), 0) FROM changes").fetchone()[0]
+        self.policy_version = self._change_id + 1
+        for kind, section in _CHANGE_SECTIONS.items():
+            if section:
+                row = conn.execute("SELECT coalesce(max(id), 0) FROM changes WHERE kind = ?", (kind,)).fetchone()
+                self.section_versions[section] = row[0] + 1
+
+    def _load_audit(self, conn: sqlite3.Connection) -> None:
+        capacity = self.audit.segment_size * (self.audit.max_segments - 1)
+        self._extend_audit(conn.execute(
+            f"SELECT seq, {_AUDIT_COLUMNS} FROM (SELECT * FROM audit ORDER BY seq DESC LIMIT ?) ORDER BY seq",
+            (capacity,),
+        ).fetchall())
+
+    def _extend_audit(self, rows: list[tuple]) -> None:
+        """Append audit rows (seq first, ascending) to the log under their own seqs"""
+        start = 0
+        for end in range(1, len(rows) + 1):
+            if end == len(rows) or rows[end][0] != rows[end - 1][0] + 1:
+                self.audit.extend([AuditEvent(*row[1:]) for row in rows[start:end]], first_seq=rows[start][0])
+                start = end
+
+    @staticmethod
+    def _delegation(row: tuple) -> Delegation:
+        return Delegation(
+            delegation_id=row[0], delegator_id=row[1], delegatee_id=row[2], gate_ids=json.loads(row[3]),
+            valid_until=_dt(row[4]), created_by=row[5], active=bool(row[6]), created_at=_dt(row[7]),
+        )
+
+    @staticmethod
+    def _visitor_pass(row: tuple) -> VisitorPass:
+        return VisitorPass(
+            pass_id=row[0], created_by=row[1], visitor_name=row[2], visitor_phone=row[3],
+            gate_ids=json.loads(row[4]), valid_until=_dt(row[5]), host_company_id=row[6],
+            active=bool(row[7]), created_at=_dt(row[8]), used_count=row[9], max_uses=row[10],
+        )
+
+    @staticmethod
+    def _session(row: tuple) -> TimeSession:
+        return TimeSession(
+            session_id=row[0], user_id=row[1], company_id=row[2], gate_id_entry=row[3],
+            entry_time=_dt(row[4]), exit_time=_dt(row[5]), duration_seconds=row[6], status=row[7],
+        )
+
+    # -- cross-process sync --------------------------------------------------
+
+    def touch(self, section: str) -> int:
+        # Versions come from the shared change log (see sync) so every process agrees on them
+        return self.policy_version
+
+    def sync(self) -> None:
+        with self._sync_lock:
+            reader = self._reader
+            data_version = reader.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return
+            self._data_version = data_version
+            reader.execute("BEGIN")
+            try:
+                self._pull_changes(reader)
+                self._pull_audit(reader)
+            finally:
+                reader.execute("COMMIT")
+
+    def _pull_changes(self, reader: sqlite3.Connection) -> None:
+        rows = reader.execute(
+            "SELECT id, kind, key, origin FROM changes WHERE id > ? ORDER BY id", (self._change_id,)
+        ).fetchall()
+        if not rows:
+            return
+        if rows[0][0] != self._change_id + 1:
+            oldest = reader.execute("SELECT min(id) FROM changes").fetchone()[0]
+            if oldest > self._change_id + 1:
+                # Fell behind the pruned change log: rebuild the cache from the tables
+                log.warning("Store change log pruned past id %d; reloading cache", self._change_id)
+                self._reload(reader)
+                return
+        for change_id, kind, key, origin in rows:
+            if origin != self.origin:
+                self._apply_change(reader, kind, key)
+            section = _CHANGE_SECTIONS.get(kind)
+            if section:
+                self.section_versions[section] = change_id + 1
+        self._change_id = rows[-1][0]
+        self.policy_version = self._change_id + 1
+
+    def _reload(self, reader: sqlite3.Connection) -> None:
+        """Rebuild the cache from the tables off to the side, then swap it in while requests keep running"""
+        fresh = object.__new__(type(self))
+        InMemoryStore.__init__(fresh, audit=self.audit)
+        fresh._load(reader)
+        # Same locks, occupancy and rollups objects: requests and streams hold on to them
+        with self._index_lock, self._version_lock:
+            for name in _RELOADED_FIELDS:
+                setattr(self, name, getattr(fresh, name))
+            self.rollups.replace(fresh.rollups)
+            self.occupancy.replace(fresh.occupancy)
+
+    def _apply_change(self, reader: sqlite3.Connection, kind: str, key: str) -> None:
+        if kind == "delegation":
+            row = reader.execute("SELECT * FROM delegations WHERE delegation_id = ?", (key,)).fetchone()
+            if row:
+                self._apply_delegation(self._delegation(row))
+        elif kind == "visitor_pass":
+            row = reader.execute("SELECT * FROM visitor_passes WHERE pass_id = ?", (key,)).fetchone()
+            if row:
+                self._index_visitor_pass(self._visitor_pass(row))
+        elif kind == "session":
+            row = reader.execute("SELECT * FROM time_sessions WHERE session_id = ?", (key,)).fetchone()
+            if row:
+                self._apply_session(self._session(row))
+        elif kind == "revoked_device":
+            # One change per device, revoked or not as the table now says
+            if reader.execute("SELECT 1 FROM revoked_devices WHERE device_id = ?", (key,)).fetchone():
+                self.revoked_devices.add(key)
+            else:
+                self.revoked_devices.discard(key)
+        elif kind == "user_status":
+            row = reader.execute("SELECT active FROM user_status WHERE user_id = ?", (key,)).fetchone()
+            if row:
+                self._apply_user_status(key, bool(row[0]))
+
+    def _pull_audit(self, reader: sqlite3.Connection) -> None:
+        # This process's rows too: the log holds everyone's, in seq order
+        self._extend_audit(reader.execute(
+            f"SELECT seq, {_AUDIT_COLUMNS} FROM audit WHERE seq >= ? ORDER BY seq", (self.audit.next_seq,)
+        ).fetchall())
+
+    # -- audit archive -----------------------------------------------------
+
+    def iter_archived_audit(self, from_seq: int, before_seq: int, *, since_ts: int | None = None,
+                            until_ts: int | None = None,
+                            company_id: str | None = None) -> Iterator[tuple[int, AuditEvent]]:
+        # The audit table keeps every event; its own connection, as an export streams for as long as its client reads
+        where, params = ["seq >= ?", "seq < ?"], [from_seq, before_seq]
+        for clause, value in (("ts >= ?", since_ts), ("ts < ?", until_ts), ("company_id = ?", company_id)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        sql = f"SELECT seq, {_AUDIT_COLUMNS} FROM audit WHERE {' AND '.join(where)} ORDER BY seq LIMIT ?"
+        conn = _connect(self.path)
+        try:
+            while True:
+                rows = conn.execute(sql, (*params, _ARCHIVE_PAGE)).fetchall()
+                if not rows:
+                    return
+                for row in rows:
+                    yield row[0], AuditEvent(*row[1:])
+                params[0] = rows[-1][0] + 1
+        finally:
+            conn.close()
+
+    def audit_complete_since(self, since_ts: int | None) -> bool:
+        return True
+
+    # -- group commit ------------------------------------------------------
+
+    def _enqueue(self, *writes: tuple[str, tuple]) -> None:
+        with self._cond:
+            self._pending.extend(writes)
+            self._queued += len(writes)
+            self._cond.notify_all()
+
+    def _writer_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+            # Give concurrent requests a moment to join this group
+            if not self._closing:
+                time.sleep(self.commit_interval)
+            with self._cond:
+                batch, self._pending = self._pending, []
+            self._commit_until_done(batch)
+            with self._cond:
+                self._committed += len(batch)
+                self._cond.notify_all()
+                prune = self._closing or self._committed // 10_000 != (self._committed - len(batch)) // 10_000
+            try:
+                if any(sql is _INSERT_AUDIT for sql, _ in batch):
+                    # Show the events just written without waiting for the next request's sync
+                    self.sync()
+                if prune:
+                    self._conn.execute(_PRUNE_CHANGES, (CHANGES_KEEP,))
+            except sqlite3.Error:
+                log.exception("Store upkeep after a commit failed")
+
+    def _commit_until_done(self, batch: list[tuple[str, tuple]]) -> None:
+        # A locked or busy database is retried until it clears: the API has already answered for these writes
+        delay = self.commit_interval or 0.01
+        while True:
+            try:
+                self._commit(batch)
+                return
+            except sqlite3.OperationalError:
+                log.warning("Retrying %d store writes after a failed commit", len(batch), exc_info=True)
+                time.sleep(delay)
+                delay = min(delay * 2, _RETRY_MAX_DELAY)
+            except sqlite3.Error:
+                break
+        # Anything else is a bad row; commit the rest one by one so only it is lost
+        for write in batch:
+            try:
+                self._commit([write])
+            except sqlite3.OperationalError:
+                self._commit_until_done([write])
+            except sqlite3.Error:
+                log.exception("Dropping a store write that cannot be committed: %s", write[0].split("(")[0].strip())
+
+    def _commit(self, batch: list[tuple[str, tuple]]) -> None:
+        conn = self._conn
+        conn.execute("BEGIN")
+        try:
+            # Consecutive writes of the same kind go through one executemany
+            start = 0
+            while start < len(batch):
+                sql = batch[start][0]
+                end = start + 1
+                while end < len(batch) and batch[end][0] == sql:
+                    end += 1
+                conn.executemany(sql, [params for _, params in batch[start:end]])
+                start = end
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Block until everything queued so far is committed"""
+        with self._cond:
+            target = self._queued
+            return self._cond.wait_for(lambda: self._committed >= target, timeout)
+
+    def close(self) -> None:
+        """Commit outstanding writes and close the database"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._writer.join()
+        self._conn.close()
+        self._reader.close()
+        self._direct.close()
+
+    # -- row builders --------------------------------------------------------
+
+    def _audit_row(self, e: AuditEvent) -> tuple:
+        return (
+            e.ts, e.user_id, e.company_id, e.gate_id, e.reader_id, e.decision, e.reason, e.door_status,
+            e.delegated_by, e.visitor_pass_id, self.origin,
+        )
+
+    def _change(self, kind: str, key: str) -> tuple[str, tuple]:
+        return _INSERT_CHANGE, (kind, key, self.origin)
+
+    def _save_delegation(self, d: Delegation) -> None:
+        self._enqueue((_UPSERT_DELEGATION, (
+            d.delegation_id, d.delegator_id, d.delegatee_id, json.dumps(d.gate_ids), d.valid_until.isoformat(),
+            d.created_by, int(d.active), d.created_at.isoformat(),
+        )), self._change("delegation", d.delegation_id))
+
+    def _save_visitor_pass(self, p: VisitorPass) -> None:
+        self._enqueue((_UPSERT_VISITOR_PASS, (
+            p.pass_id, p.created_by, p.visitor_name, p.visitor_phone, json.dumps(p.gate_ids),
+            p.valid_until.isoformat(), p.host_company_id, int(p.active), p.created_at.isoformat(),
+            p.used_count, p.max_uses,
+        )), self._change("visitor_pass", p.pass_id))
+
+    def _save_session(self, s: TimeSession) -> None:
+        self._enqueue((_UPSERT_SESSION, (
+            s.session_id, s.user_id, s.company_id, s.gate_id_entry, s.entry_time.isoformat(),
+            s.exit_time.isoformat() if s.exit_time else None, s.duration_seconds, s.status,
+        )), self._change("session", s.session_id))
+
+    # -- write-through overrides -------------------------------------------
+
+    def _log_events(self, events: list[AuditEvent]) -> None:
+        # The audit log takes them from the table once committed, numbered by seq (see sync)
+        self._enqueue(*[(_INSERT_AUDIT, self._audit_row(e)) for e in events])
+
+    def create_delegation(self, *args, **kwargs) -> str:
+        delegation_id = super().create_delegation(*args, **kwargs)
+        self._save_delegation(self.delegations[delegation_id])
+        return delegation_id
+
+    def create_visitor_pass(self, *args, **kwargs) -> str:
+        pass_id = super().create_visitor_pass(*args, **kwargs)
+        self._save_visitor_pass(self.visitor_passes[pass_id])
+        return pass_id
+
+    def use_visitor_pass(self, pass_id: str) -> VisitorPass | None:
+        visitor_pass = self.visitor_passes.get(pass_id)
+        if visitor_pass is None:
+            return None
+        used_count = self._take_visitor_pass_use(pass_id)
+        if used_count is None:
+            return None
+        with self._company_locks.for_key(visitor_pass.host_company_id):
+            visitor_pass.used_count = max(visitor_pass.used_count, used_count)
+        self.touch("visitorPasses")
+        return visitor_pass
+
+    def _take_visitor_pass_use(self, pass_id: str, wait_for_queue: bool = True) -> int | None:
+        """Count one use in the database, committed before returning; the new used_count, or None if used up"""
+        with self._direct_lock:
+            conn = self._direct
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(_USE_VISITOR_PASS, (pass_id,)).fetchall()
+                if rows:
+                    conn.execute(*self._change("visitor_pass", pass_id))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            if rows:
+                return rows[0][0]
+            known = conn.execute("SELECT 1 FROM visitor_passes WHERE pass_id = ?", (pass_id,)).fetchone()
+        if known is None and wait_for_queue and self.flush():
+            # Created moments ago and still queued for the database
+            return self._take_visitor_pass_use(pass_id, wait_for_queue=False)
+        return None
+
+    def revoke_devices(self, device_ids: list[str]) -> list[str]:
+        added = super().revoke_devices(device_ids)
+        now = datetime.utcnow().isoformat()
+        self._enqueue(*[(_REVOKE_DEVICE, (d, now)) for d in added],
+                      *[self._change("revoked_device", d) for d in added])
+        return added
+
+    def unrevoke_devices(self, device_ids: list[str]) -> list[str]:
+        removed = super().unrevoke_devices(device_ids)
+        self._enqueue(*[(_UNREVOKE_DEVICE, (d,)) for d in removed],
+                      *[self._change("revoked_device", d) for d in removed])
+        return removed
+
+    def set_users_active(self, user_ids: list[str], active: bool) -> tuple[list[str], list[str]]:
+        changed, unknown = super().set_users_active(user_ids, active)
+        self._enqueue(*[(_UPSERT_USER_STATUS, (u, int(active))) for u in changed],
+                      *[self._change("user_status", u) for u in changed])
+        return changed, unknown
+
+    def start_time_session(self, user_id: str, company_id: str, gate_id: str) -> str:
+        with self._user_locks.for_key(user_id):
+            previous = self.get_active_session(user_id)
+            session_id = super().start_time_session(user_id, company_id, gate_id)
+        if previous is not None:
+            self._save_session(previous)
+        self._save_session(self.time_sessions[session_id])
+        return session_id
+
+    def end_time_session(self, user_id: str, gate_id: str) -> TimeSession | None:
+        session = super().end_time_session(user_id, gate_id)
+        if session:
+            self._save_session(session)
+        return session
+
+    def close_stale_sessions(self, now: datetime, max_duration: timedelta) -> list[TimeSession]:
+        closed = super().close_stale_sessions(now, max_duration)
+        for session in closed:
+            self._save_session(session)
+        return closed
+
+
+class SQLiteReplayGuard:
+    """
+    ReplayGuard (see replay.py) backed by the store database, so every
+    process sharing the file sees every claimed jti. Claims are single
+    autocommit statements; expired jtis are purged once per bucket period.
+    """
+
+    def __init__(self, path: str, bucket_seconds: int, *, max_retries: int = MAX_RETRIES,
+                 retry_window: int = RETRY_WINDOW_SECONDS) -> None:
+        self.bucket_seconds = max(1, bucket_seconds)
+        self.max_retries = max_retries
+        self.retry_window = retry_window
+        self._conn = _connect(path)
+        self._conn.executescript(_REPLAY_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(used_tokens)")}
+        for column, spec in (("first_use", "INTEGER"), ("retries", "INTEGER NOT NULL DEFAULT 0"), ("result", "TEXT")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE used_tokens ADD COLUMN {column} {spec}")
+        self._lock = threading.Lock()
+        self._next_purge = 0
+
+    def claim(self, jti: str, exp: int, owner: str) -> tuple[str, dict | None]:
+        now = int(time.time())
+        with self._lock:
+            conn = self._conn
+            if now >= self._next_purge:
+                conn.execute("DELETE FROM used_tokens WHERE exp < ?", (now,))
+                self._next_purge = now + self.bucket_seconds
+            inserted = conn.execute(
+                "INSERT INTO used_tokens (jti, exp, owner, first_use) VALUES (?, ?, ?, ?) ON CONFLICT (jti) DO NOTHING",
+                (jti, exp, owner, now),
+            ).rowcount
+            if inserted:
+                return FIRST_USE, None
+            # One statement, so concurrent retries from several workers can't exceed the bound
+            rows = conn.execute(
+                "UPDATE used_tokens SET retries = retries + 1 WHERE jti = ? AND owner = ? AND retries < ? "
+                "AND first_use >= ? RETURNING result",
+                (jti, owner, self.max_retries, now - self.retry_window),
+            ).fetchall()
+        if not rows:
+            return REPLAY, None
+        return RETRY, json.loads(rows[0][0]) if rows[0][0] else None
+
+    def settle(self, jti: str, exp: int, result: dict) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE used_tokens SET result = ? WHERE jti = ?", (json.dumps(result), jti))
@@ -1,9 +1,19 @@
 from __future__ import annotations
 
+import heapq
+import threading
 import time
 import uuid
-from dataclasses import dataclass
-from datetime import datetime, timedelta
+from dataclasses import dataclass, field, replace
+from datetime import date, datetime, timedelta
+from typing import Iterator
+
+from .audit_log import AuditEvent, AuditLog
+from .bloom import BloomFilter
+from .locks import StripedLock
+from .occupancy import Occupancy
+from .policy import AccessPolicy
+from .rollups import TimeRollups
 
 
 @dataclass(frozen=True)
@@ -21,20 +31,6 @@ class Gate:
     company_id: str | None  # only for building gates
 
 
-@dataclass
-class AuditEvent:
-    ts: int
-    user_id: str | None
-    company_id: str | None
-    gate_id: str
-    reader_id: str
-    decision: str
-    reason: str
-    door_status: str = "UNKNOWN"  # "OPENED", "FAILED", "UNKNOWN"
-    delegated_by: str | None = None
-    visitor_pass_id: str | None = None
-
-
 @dataclass
 class Delegation:
     delegation_id: str
@@ -87,12 +83,48 @@ class TimeSession:
         object.__setattr__(self, 'status', 'COMPLETED')
 
 
+@dataclass
+class TimeStats:
+    """Running totals over a user's completed sessions"""
+    completed_sessions: int = 0
+    total_seconds: int = 0
+    by_day: dict[date, list[int]] = field(default_factory=dict)  # entry day -> [sessions, seconds]
+
+    def add(self, session: TimeSession) -> None:
+        if not session.duration_seconds:
+            return
+        self.completed_sessions += 1
+        self.total_seconds += session.duration_seconds
+        bucket = self.by_day.setdefault(session.entry_time.date(), [0, 0])
+        bucket[0] += 1
+        bucket[1] += session.duration_seconds
+
+    def day(self, day: date) -> tuple[int, int]:
+        sessions, seconds = self.by_day.get(day, (0, 0))
+        return sessions, seconds
+
+
+# Sections of the reader policy snapshot, see policy_snapshot.py
+POLICY_SECTIONS = ("gates", "users", "revokedDevices", "delegations", "visitorPasses")
+LOCK_STRIPES = 64
+
+
 class InMemoryStore:
     """
     MVP in-memory store. Replace with Postgres later.
+
+    Safe for many request threads without a global lock. Single dict reads
+    and writes are atomic, so lookups take no lock at all; read-modify-write
+    sequences lock a stripe of the key they change:
+
+    - a user's sessions, active session and totals: the user's stripe
+    - visitor pass use counts: the host company's stripe
+    - the shared expiry heaps and delegation indexes: the index lock, held briefly
+
+    A user stripe may be held while taking the index lock, never the reverse.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, audit: AuditLog | None = None) -> None:
         self.users_by_email: dict[str, User] = {
             "alice@acme.com": User(user_id="U_ALICE", email="alice@acme.com", company_id="ACME"),
             "bob@globex.com": User(user_id="U_BOB", email="bob@globex.com", company_id="GLOBEX"),
@@ -105,34 +137,168 @@ class InMemoryStore:
             "BLD_GLOBEX": Gate(gate_id="BLD_GLOBEX", kind="BUILDING", company_id="GLOBEX"),
         }
 
-        self.audit: list[AuditEvent] = []
+        self.audit: AuditLog = audit if audit is not None else AuditLog()
         self.revoked_devices: set[str] = set()
+        self._revoked_filter: tuple[int, BloomFilter] | None = None  # (section version, filter)
         
         # New collections for extended features
         self.delegations: dict[str, Delegation] = {}
+        # Secondary delegation indexes, kept in step with self.delegations
+        self._delegations_by_delegatee: dict[str, dict[str, Delegation]] = {}
+        self._delegation_grants: dict[tuple[str, str], list[tuple[datetime, str]]] = {}  # heap per (user, gate)
+        self._delegation_expiry: list[tuple[datetime, str]] = []  # global heap of (valid_until, delegation_id)
         self.visitor_passes: dict[str, VisitorPass] = {}
+        self._visitor_pass_expiry: list[tuple[datetime, str]] = []  # heap of (valid_until, pass_id)
+        self._index_lock = threading.RLock()  # guards the expiry heaps and delegation indexes
+        self._user_locks = StripedLock(LOCK_STRIPES, threading.RLock)
+        self._company_locks = StripedLock(LOCK_STRIPES)
         
         # Time tracking sessions
         self.time_sessions: dict[str, TimeSession] = {}  # session_id -> TimeSession
         self.active_sessions: dict[str, str] = {}  # user_id -> session_id (for quick lookup)
+        self._sessions_by_user: dict[str, list[TimeSession]] = {}  # user_id -> sessions in entry order
+        self._session_starts: list[tuple[datetime, str]] = []  # heap of (entry_time, session_id) when ACTIVE
+        self._time_stats: dict[str, TimeStats] = {}
+        self.rollups = TimeRollups()  # per-user/company day and per-gate hour reports
+        self.occupancy = Occupancy()  # head counts from ACTIVE sessions
+
+        # Reader policy snapshot versions: bumped whenever a section readers cache changes
+        self.policy_version = 1
+        self.section_versions: dict[str, int] = dict.fromkeys(POLICY_SECTIONS, 1)
+        self._version_lock = threading.Lock()
+        self.access_policy = AccessPolicy(self)
+
+    def sync(self) -> None:
+        """Pull in changes made by other processes sharing this store (nothing to do in memory)"""
+
+    def touch(self, section: str) -> int:
+        """Mark a policy snapshot section as changed and return the new policy version"""
+        with self._version_lock:
+            self.policy_version += 1
+            self.section_versions[section] = self.policy_version
+            return self.policy_version
+
+    def revoke_devices(self, device_ids: list[str]) -> list[str]:
+        """Add devices to the revoked set; returns the ones that were not already revoked"""
+        added = [d for d in dict.fromkeys(device_ids) if d not in self.revoked_devices]
+        if added:
+            self.revoked_devices.update(added)
+            self.touch("revokedDevices")
+        return added
+
+    def unrevoke_devices(self, device_ids: list[str]) -> list[str]:
+        """Remove devices from the revoked set; returns the ones that were revoked"""
+        removed = [d for d in dict.fromkeys(device_ids) if d in self.revoked_devices]
+        if removed:
+            self.revoked_devices.difference_update(removed)
+            self.touch("revokedDevices")
+        return removed
+
+    def revoked_devices_filter(self) -> BloomFilter:
+        """Bloom filter of the revoked devices, rebuilt only after the set changes"""
+        version = self.section_versions["revokedDevices"]
+        cached = self._revoked_filter
+        if cached is None or cached[0] != version:
+            cached = self._revoked_filter = (version, BloomFilter.of(list(self.revoked_devices)))
+        return cached[1]
+
+    def set_users_active(self, user_ids: list[str], active: bool) -> tuple[list[str], list[str]]:
+        """Activate or deactivate users; returns (changed, unknown) user ids"""
+        changed: list[str] = []
+        unknown: list[str] = []
+        for user_id in dict.fromkeys(user_ids):
+            user = self.users_by_id.get(user_id)
+            if user is None:
+                unknown.append(user_id)
+            elif user.active != active:
+                self._put_user(replace(user, active=active))
+                changed.append(user_id)
+        if changed:
+            self.touch("users")
+        return changed, unknown
+
+    def _put_user(self, user: User) -> None:
+        self.users_by_id[user.user_id] = user
+        self.users_by_email[user.email] = user
+
+    # -- applying state written elsewhere (another process, or a log being replayed) --
+
+    def _apply_user_status(self, user_id: str, active: bool) -> None:
+        user = self.users_by_id.get(user_id)
+        if user is not None and user.active != active:
+            self._put_user(replace(user, active=active))
+
+    def _apply_delegation(self, delegation: Delegation) -> None:
+        """Index a new delegation, or take the active flag and expiry of a known one"""
+        current = self.delegations.get(delegation.delegation_id)
+        if current is None:
+            self._index_delegation(delegation)
+        else:
+            current.active, current.valid_until = delegation.active, delegation.valid_until
+            self.access_policy.delegation_changed(current)
+
+    def _apply_session(self, session: TimeSession) -> None:
+        """Index a new session, or complete a known one that is still ACTIVE here"""
+        with self._user_locks.for_key(session.user_id):
+            current = self.time_sessions.get(session.session_id)
+            if current is None:
+                self._index_session(session)
+                return
+            if current.status == "ACTIVE" and session.status != "ACTIVE":
+                current.exit_time = session.exit_time
+                current.duration_seconds = session.duration_seconds
+                current.status = session.status
+                if self.active_sessions.get(current.user_id) == current.session_id:
+                    del self.active_sessions[current.user_id]
+                self.occupancy.leave(current)
+                self._session_completed(current)
 
     def record(self, *, user_id: str | None, company_id: str | None, gate_id: str, reader_id: str, 
                decision: str, reason: str, door_status: str = "UNKNOWN", 
-               delegated_by: str | None = None, visitor_pass_id: str | None = None) -> None:
-        self.audit.append(
-            AuditEvent(
-                ts=int(time.time()),
-                user_id=user_id,
-                company_id=company_id,
-                gate_id=gate_id,
-                reader_id=reader_id,
-                decision=decision,
-                reason=reason,
-                door_status=door_status,
-                delegated_by=delegated_by,
-                visitor_pass_id=visitor_pass_id,
-            )
+               delegated_by: str | None = None, visitor_pass_id: str | None = None) -> AuditEvent:
+        event = AuditEvent(
+            ts=int(time.time()),
+            user_id=user_id,
+            company_id=company_id,
+            gate_id=gate_id,
+            reader_id=reader_id,
+            decision=decision,
+            reason=reason,
+            door_status=door_status,
+            delegated_by=delegated_by,
+            visitor_pass_id=visitor_pass_id,
         )
+        self._log_events([event])
+        return event
+
+    def record_many(self, entries: list[dict]) -> list[AuditEvent]:
+        """Record several audit events (each a dict of record() arguments, optionally with ts) in one append"""
+        ts = int(time.time())
+        events = [AuditEvent(**{"ts": ts, **entry}) for entry in entries]
+        self._log_events(events)
+        return events
+
+    def _log_events(self, events: list[AuditEvent]) -> None:
+        """Add recorded events to the audit log"""
+        self.audit.extend(events)
+
+    def iter_archived_audit(self, from_seq: int, before_seq: int, *, since_ts: int | None = None,
+                            until_ts: int | None = None,
+                            company_id: str | None = None) -> Iterator[tuple[int, AuditEvent]]:
+        """
+        Lazily yield (seq, event) for audit events evicted from memory, with
+        from_seq <= seq < before_seq and since_ts <= ts < until_ts, oldest first
+        """
+        for seq, event in self.audit.spilled(from_seq, before_seq):
+            if since_ts is not None and event.ts < since_ts or until_ts is not None and event.ts >= until_ts:
+                continue
+            if company_id is None or event.company_id == company_id:
+                yield seq, event
+
+    def audit_complete_since(self, since_ts: int | None) -> bool:
+        """Whether every audit event with ts >= since_ts is still held or archived"""
+        dropped = self.audit.dropped_max_ts
+        return dropped is None or since_ts is not None and since_ts > dropped
 
     def create_delegation(self, delegator_id: str, delegatee_email: str, gate_ids: list[str], 
                          hours: int, created_by: str) -> str:
@@ -151,9 +317,70 @@ class InMemoryStore:
             valid_until=valid_until,
             created_by=created_by
         )
-        self.delegations[delegation_id] = delegation
+        self._index_delegation(delegation)
         return delegation_id
 
+    def _index_delegation(self, delegation: Delegation) -> None:
+        """Add a delegation to the primary dict and its secondary indexes"""
+        with self._index_lock:
+            self.delegations[delegation.delegation_id] = delegation
+            self._delegations_by_delegatee.setdefault(delegation.delegatee_id, {})[delegation.delegation_id] = delegation
+            self._push_delegation_entries(delegation)
+        self.access_policy.delegation_changed(delegation)
+        self.touch("delegations")
+
+    def _push_delegation_entries(self, delegation: Delegation) -> None:
+        entry = (delegation.valid_until, delegation.delegation_id)
+        for gate_id in set(delegation.gate_ids):
+            heapq.heappush(self._delegation_grants.setdefault((delegation.delegatee_id, gate_id), []), entry)
+        heapq.heappush(self._delegation_expiry, entry)
+
+    def _evict_expired_delegations(self, now: datetime) -> list[Delegation]:
+        """Remove delegations past valid_until from the dict and its indexes (amortised O(log n) each)"""
+        evicted: list[Delegation] = []
+        with self._index_lock:
+            expiry = self._delegation_expiry
+            while expiry and expiry[0][0] <= now:
+                _, delegation_id = heapq.heappop(expiry)
+                delegation = self.delegations.get(delegation_id)
+                if delegation is None:
+                    continue
+                if delegation.valid_until > now:
+                    # Extended since this entry was pushed
+                    self._push_delegation_entries(delegation)
+                    continue
+                del self.delegations[delegation_id]
+                by_user = self._delegations_by_delegatee.get(delegation.delegatee_id)
+                if by_user is not None:
+                    by_user.pop(delegation_id, None)
+                    if not by_user:
+                        del self._delegations_by_delegatee[delegation.delegatee_id]
+                for gate_id in set(delegation.gate_ids):
+                    self._prune_grants(delegation.delegatee_id, gate_id, now)
+                evicted.append(delegation)
+        for delegation in evicted:
+            self.access_policy.delegation_changed(delegation)
+        if evicted:
+            self.touch("delegations")
+        return evicted
+
+    def _prune_grants(self, user_id: str, gate_id: str, now: datetime) -> None:
+        """Pop dead entries off a (user, gate) grant heap, dropping it once empty"""
+        grants = self._delegation_grants.get((user_id, gate_id))
+        if grants is None:
+            return
+        while grants:
+            valid_until, delegation_id = grants[0]
+            delegation = self.delegations.get(delegation_id)
+            if delegation is not None and delegation.active and delegation.valid_until > now:
+                if delegation.valid_until == valid_until:
+                    return
+                # Extended or shortened since this entry was pushed: re-file it under its current expiry
+                heapq.heapreplace(grants, (delegation.valid_until, delegation_id))
+                continue
+            heapq.heappop(grants)
+        del self._delegation_grants[(user_id, gate_id)]
+
     def create_visitor_pass(self, created_by: str, visitor_name: str, visitor_phone: str, 
                            gate_ids: list[str], hours: int, host_company_id: str) -> str:
         """Create a new visitor pass"""
@@ -169,62 +396,183 @@ class InMemoryStore:
             valid_until=valid_until,
             host_company_id=host_company_id
         )
-        self.visitor_passes[pass_id] = visitor_pass
+        self._index_visitor_pass(visitor_pass)
+        self.touch("visitorPasses")
         return pass_id
 
+    def _index_visitor_pass(self, visitor_pass: VisitorPass) -> None:
+        """Add or replace a visitor pass, scheduling its expiry the first time it is seen"""
+        with self._index_lock:
+            if visitor_pass.pass_id not in self.visitor_passes:
+                heapq.heappush(self._visitor_pass_expiry, (visitor_pass.valid_until, visitor_pass.pass_id))
+            self.visitor_passes[visitor_pass.pass_id] = visitor_pass
+
+    def expire_visitor_passes(self, now: datetime) -> list[VisitorPass]:
+        """Remove visitor passes past valid_until"""
+        expired: list[VisitorPass] = []
+        with self._index_lock:
+            expiry = self._visitor_pass_expiry
+            while expiry and expiry[0][0] <= now:
+                _, pass_id = heapq.heappop(expiry)
+                visitor_pass = self.visitor_passes.pop(pass_id, None)
+                if visitor_pass is not None:
+                    expired.append(visitor_pass)
+        for visitor_pass in expired:
+            self.access_policy.visitor_pass_removed(visitor_pass.pass_id)
+        if expired:
+            self.touch("visitorPasses")
+        return expired
+
     def get_active_delegations_for_user(self, user_id: str) -> list[Delegation]:
         """Get all active delegations where user is the delegatee"""
         now = datetime.utcnow()
-        return [d for d in self.delegations.values() 
-                if d.delegatee_id == user_id and d.active and d.valid_until > now]
+        self._evict_expired_delegations(now)
+        by_user = self._delegations_by_delegatee.get(user_id)
+        if not by_user:
+            return []
+        return [d for d in by_user.values() if d.active and d.valid_until > now]
+
+    def find_delegation(self, user_id: str, gate_id: str) -> Delegation | None:
+        """Get the earliest-expiring valid delegation granting user access to gate"""
+        if (user_id, gate_id) not in self._delegation_grants:
+            return None
+        with self._index_lock:
+            self._prune_grants(user_id, gate_id, datetime.utcnow())
+            grants = self._delegation_grants.get((user_id, gate_id))
+            return self.delegations.get(grants[0][1]) if grants else None
 
     def get_visitor_pass(self, pass_id: str) -> VisitorPass | None:
         """Get visitor pass by ID"""
         return self.visitor_passes.get(pass_id)
 
+    def use_visitor_pass(self, pass_id: str) -> VisitorPass | None:
+        """Count one use of a visitor pass if it has uses left; None if it is unknown or used up"""
+        visitor_pass = self.visitor_passes.get(pass_id)
+        if visitor_pass is None:
+            return None
+        # Compare-and-increment: concurrent scans can't both take the last use
+        with self._company_locks.for_key(visitor_pass.host_company_id):
+            if visitor_pass.used_count >= visitor_pass.max_uses:
+                return None
+            visitor_pass.used_count += 1
+        self.touch("visitorPasses")
+        return visitor_pass
+
     def start_time_session(self, user_id: str, company_id: str, gate_id: str) -> str:
         """Start a time tracking session for entry"""
-        # Close any existing active session for this user (shouldn't happen, but handle it)
-        if user_id in self.active_sessions:
-            old_session_id = self.active_sessions[user_id]
-            if old_session_id in self.time_sessions:
-                old_session = self.time_sessions[old_session_id]
-                if old_session.status == "ACTIVE":
-                    # Auto-complete the old session
-                    old_session.complete_session(gate_id, datetime.utcnow())
-        
-        session_id = f"SES_{uuid.uuid4().hex[:12].upper()}"
-        session = TimeSession(
-            session_id=session_id,
-            user_id=user_id,
-            company_id=company_id,
-            gate_id_entry=gate_id,
-            entry_time=datetime.utcnow(),
-            status="ACTIVE"
-        )
-        self.time_sessions[session_id] = session
-        self.active_sessions[user_id] = session_id
-        return session_id
+        with self._user_locks.for_key(user_id):
+            # Close any existing active session for this user (shouldn't happen, but handle it)
+            if user_id in self.active_sessions:
+                old_session_id = self.active_sessions[user_id]
+                if old_session_id in self.time_sessions:
+                    old_session = self.time_sessions[old_session_id]
+                    if old_session.status == "ACTIVE":
+                        # Auto-complete the old session
+                        self._complete_session(old_session, gate_id, datetime.utcnow())
+            
+            session_id = f"SES_{uuid.uuid4().hex[:12].upper()}"
+            session = TimeSession(
+                session_id=session_id,
+                user_id=user_id,
+                company_id=company_id,
+                gate_id_entry=gate_id,
+                entry_time=datetime.utcnow(),
+                status="ACTIVE"
+            )
+            self._index_session(session)
+            return session_id
+
+    def _index_session(self, session: TimeSession) -> None:
+        """Add a session (in entry order) to the session dict, per-user history and totals"""
+        self.time_sessions[session.session_id] = session
+        self._sessions_by_user.setdefault(session.user_id, []).append(session)
+        if session.status == "ACTIVE":
+            self.active_sessions[session.user_id] = session.session_id
+            with self._index_lock:
+                heapq.heappush(self._session_starts, (session.entry_time, session.session_id))
+            self.occupancy.enter(session)
+        else:
+            self._session_completed(session)
+
+    def _complete_session(self, session: TimeSession, gate_id: str, exit_time: datetime) -> None:
+        """Complete a session and fold it into the user's running totals"""
+        session.complete_session(gate_id, exit_time)
+        self.occupancy.leave(session)
+        self._session_completed(session)
+
+    def _session_completed(self, session: TimeSession) -> None:
+        """Update aggregates for a session that has just become COMPLETED"""
+        self._time_stats.setdefault(session.user_id, TimeStats()).add(session)
+        self.rollups.add(session)
 
     def end_time_session(self, user_id: str, gate_id: str) -> TimeSession | None:
         """End the active time tracking session for exit"""
-        if user_id not in self.active_sessions:
-            return None
-        
-        session_id = self.active_sessions[user_id]
-        session = self.time_sessions.get(session_id)
-        if not session or session.status != "ACTIVE":
-            return None
-        
-        session.complete_session(gate_id, datetime.utcnow())
-        del self.active_sessions[user_id]
-        return session
+        with self._user_locks.for_key(user_id):
+            if user_id not in self.active_sessions:
+                return None
+            
+            session_id = self.active_sessions[user_id]
+            session = self.time_sessions.get(session_id)
+            if not session or session.status != "ACTIVE":
+                return None
+            
+            self._complete_session(session, gate_id, datetime.utcnow())
+            del self.active_sessions[user_id]
+            return session
+
+    def close_stale_sessions(self, now: datetime, max_duration: timedelta) -> list[TimeSession]:
+        """
+        Auto-close ACTIVE sessions older than max_duration (e.g. after tailgating
+        out) with a synthetic exit at entry_time + max_duration. The exit time
+        is deterministic, so workers closing the same session write the same row.
+        """
+        due: list[str] = []
+        with self._index_lock:
+            starts = self._session_starts
+            while starts and starts[0][0] + max_duration <= now:
+                due.append(heapq.heappop(starts)[1])
+        closed: list[TimeSession] = []
+        for session_id in due:
+            session = self.time_sessions.get(session_id)
+            if session is None:
+                continue
+            with self._user_locks.for_key(session.user_id):
+                if session.status != "ACTIVE":
+                    continue
+                self._complete_session(session, session.gate_id_entry, session.entry_time + max_duration)
+                if self.active_sessions.get(session.user_id) == session_id:
+                    del self.active_sessions[session.user_id]
+            closed.append(session)
+        return closed
 
     def get_user_time_sessions(self, user_id: str, limit: int = 50) -> list[TimeSession]:
         """Get time sessions for a user, most recent first"""
-        sessions = [s for s in self.time_sessions.values() if s.user_id == user_id]
-        sessions.sort(key=lambda s: s.entry_time, reverse=True)
-        return sessions[:limit]
+        sessions = self._sessions_by_user.get(user_id, [])
+        return sessions[:-limit - 1:-1] if limit > 0 else []
+
+    def iter_time_sessions(self, *, company_id: str | None = None, since: datetime | None = None,
+                           until: datetime | None = None) -> Iterator[TimeSession]:
+        """Lazily yield sessions by user then entry order, with since <= entry_time < until"""
+        for user_id in list(self._sessions_by_user):
+            sessions = self._sessions_by_user.get(user_id, [])
+            # Index walk rather than iteration: the list may grow while a long export is paused
+            for i in range(len(sessions)):
+                session = sessions[i]
+                if company_id is not None and session.company_id != company_id:
+                    continue
+                if since is not None and session.entry_time < since:
+                    continue
+                if until is not None and session.entry_time >= until:
+                    continue
+                yield session
+
+    def rebuild_rollups(self) -> None:
+        """Recompute the time rollups from every held session"""
+        self.rollups.rebuild(list(self.time_sessions.values()))
+
+    def get_user_time_stats(self, user_id: str) -> TimeStats:
+        """Get running totals over a user's completed sessions"""
+        return self._time_stats.get(user_id) or TimeStats()
 
     def get_active_session(self, user_id: str) -> TimeSession | None:
         """Get active session for a user"""
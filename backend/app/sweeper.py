@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from .store import InMemoryStore
+
+log = logging.getLogger(__name__)
+
+
+class ExpirySweeper:
+    """
+    Background thread that keeps a store free of dead entries.
+
+    Every ``interval_seconds`` it drops delegations and visitor passes past
+    their valid_until and auto-closes sessions ACTIVE for longer than
+    ``max_session_seconds`` (0 disables that). Each of these is scheduled on
+    a min-heap in the store, so a sweep only touches what is due.
+    """
+
+    def __init__(self, store: InMemoryStore, *, interval_seconds: float = 1.0,
+                 max_session_seconds: int = 0) -> None:
+        self.store = store
+        self.interval_seconds = interval_seconds
+        self.max_session = timedelta(seconds=max_session_seconds) if max_session_seconds > 0 else None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self, now: datetime | None = None) -> dict[str, int]:
+        """Sweep everything due at ``now``; returns how many of each were removed or closed"""
+        now = now or datetime.utcnow()
+        # Pick up other workers' exits first so their real exit times win over a synthetic one
+        self.store.sync()
+        delegations = self.store._evict_expired_delegations(now)
+        visitor_passes = self.store.expire_visitor_passes(now)
+        sessions = self.store.close_stale_sessions(now, self.max_session) if self.max_session else []
+        return {"delegations": len(delegations), "visitorPasses": len(visitor_passes), "sessions": len(sessions)}
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="oneaccess-sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("Expiry sweep failed")
@@ -0,0 +1,38 @@
+"""
+Gunicorn settings for multi-process serving:
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The app is imported once in the master, so signing keys are loaded (or
+created) exactly once and inherited by every worker. With
+ONEACCESS_LAZY_STARTUP=1 the master skips that and each worker loads them
+in the background after fork, so workers accept connections sooner after a
+cold start. Workers share state
+through the SQLite store; each one re-opens its own handles after fork.
+"""
+
+import multiprocessing
+import os
+
+# Workers only see each other's delegations, sessions and audit through a shared database
+os.environ.setdefault("ONEACCESS_STORE", "sqlite")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+preload_app = True
+timeout = 30
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG") or None
+
+
+def post_fork(server, worker):
+    from app import main
+
+    main.init_worker()
+
+
+def post_worker_init(worker):
+    from app import main
+
+    # With ONEACCESS_LAZY_STARTUP=1, load keys and crypto while the worker waits for its first request
+    main.start_warm_up()
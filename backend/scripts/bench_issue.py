@@ -0,0 +1,98 @@
+"""
+Micro-benchmark for access token issuance throughput on one core.
+
+    cd backend
+    python scripts/bench_issue.py [--seconds 2] [--batch 50] [--json]
+
+Signing: the original per-call jwt.encode path against the signer with the
+header segment precomputed, one token at a time and in batches. Endpoint:
+tokens per second through POST /qr/token against POST /qr/token/batch with
+the Flask test client, i.e. including auth, policy checks and JSON.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+os.environ.setdefault("ONEACCESS_STORE", "memory")
+
+import jwt  # noqa: E402
+
+from app.security import issue_access_jwt, issue_access_jwts, load_or_create_keys  # noqa: E402
+
+CLAIMS = {"v": 1, "sub": "U_ALICE", "cid": "ACME", "gid": "MAIN_GATE", "rnonce": "NONCE0000001",
+          "did": "UNKNOWN_DEVICE", "jti": "U_ALICE:NONCE0000001:0"}
+
+
+def _rate(fn, per_call: int, seconds: float) -> float:
+    """Tokens per second of fn(), which issues per_call tokens"""
+    done = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while True:
+        for _ in range(20):
+            fn()
+        done += 20 * per_call
+        now = time.perf_counter()
+        if now >= deadline:
+            return done / (now - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=2.0, help="time per scenario")
+    parser.add_argument("--batch", type=int, default=50, help="tokens per batch call")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    keys = load_or_create_keys(tempfile.mkdtemp(prefix="oneaccess-bench-"))
+    batch_claims = [CLAIMS] * args.batch
+
+    def baseline() -> None:
+        now = int(time.time())
+        payload = dict(CLAIMS, iat=now, nbf=now - 1, exp=now + 20)
+        jwt.encode(payload, keys.private_key, algorithm="EdDSA", headers={"kid": keys.kid, "alg": "EdDSA", "typ": "JWT"})
+
+    def single() -> None:
+        issue_access_jwt(keys=keys, claims=CLAIMS, ttl_seconds=20)
+
+    def batched() -> None:
+        issue_access_jwts(keys=keys, claims=batch_claims, ttl_seconds=20)
+
+    from app.main import app
+
+    client = app.test_client()
+    token = client.post("/auth/login", json={"email": "alice@acme.com"}).get_json()["accessToken"]
+    auth = {"Authorization": f"Bearer {token}"}
+    batch_body = {"gateId": "MAIN_GATE", "requests": [{"readerNonce": f"NONCE{i:08d}"} for i in range(args.batch)]}
+
+    def endpoint_single() -> None:
+        client.post("/qr/token", json={"gateId": "MAIN_GATE", "readerNonce": "NONCE0000001"}, headers=auth)
+
+    def endpoint_batch() -> None:
+        client.post("/qr/token/batch", json=batch_body, headers=auth)
+
+    results = {
+        "baseline_jwt_encode": _rate(baseline, 1, args.seconds),
+        "precomputed_header": _rate(single, 1, args.seconds),
+        "precomputed_header_batch": _rate(batched, args.batch, args.seconds),
+        "endpoint_qr_token": _rate(endpoint_single, 1, args.seconds),
+        "endpoint_qr_token_batch": _rate(endpoint_batch, args.batch, args.seconds),
+    }
+    if args.json:
+        print(json.dumps({"unit": "tokens_per_second_per_core", "batch": args.batch, "results": results}))
+        return
+    for name, rate in results.items():
+        base = results["endpoint_qr_token" if name.startswith("endpoint") else "baseline_jwt_encode"]
+        print(f"{name:26s} {rate:12,.0f} tokens/s   x{rate / base:.2f}")
+
+
+if __name__ == "__main__":
+    main()
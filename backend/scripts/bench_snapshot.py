@@ -0,0 +1,141 @@
+"""
+Snapshot store benchmark: save, restart and write-ahead log costs.
+
+    cd backend
+    python scripts/bench_snapshot.py [--scale 1.0] [--seed 1] [--runs 3] [--writes 20000] [--json]
+
+Seeds a store as bench_suite.py does (at --scale 1: 100k users, 1M audit
+events, 50k delegations, 200k completed sessions) and writes its snapshot.
+Then, in a scratch directory:
+
+- restore: a fresh SnapshotStore on the snapshot, timed to the constructor
+  returning, to sync() returning (requests are served from here on) and to
+  the session history being loaded in the background (median of --runs)
+- wal:     --writes changes (delegations, session entries and exits, audit
+           events) through the store, timed until flush() has them in the log
+- replay:  a restart after those writes without a snapshot, as after a
+           crash: the same restore plus replaying the log
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import snapshot  # noqa: E402
+from app.audit_log import AuditLog  # noqa: E402
+from app.snapshot_store import SNAPSHOT_FILE, SnapshotStore  # noqa: E402
+from app.store import InMemoryStore  # noqa: E402
+from bench_suite import Plan, seed_store  # noqa: E402
+
+
+def _audit(plan: Plan) -> AuditLog:
+    return AuditLog(max_events=max(100_000, plan.audit_events + 100_000))
+
+
+def restore(directory: str, plan: Plan) -> tuple[SnapshotStore, dict[str, float]]:
+    """Open a store on directory; returns it and ms to construct, to sync() and to history loaded"""
+    started = time.perf_counter()
+    store = SnapshotStore(directory, audit=_audit(plan), snapshot_interval=1e9)
+    constructed = time.perf_counter()
+    store.sync()
+    ready = time.perf_counter()
+    store.get_user_time_stats(plan.user_id(0))
+    loaded = time.perf_counter()
+    return store, {"construct_ms": (constructed - started) * 1000, "ready_ms": (ready - started) * 1000,
+                   "history_ms": (loaded - started) * 1000}
+
+
+def write_load(store: SnapshotStore, plan: Plan, writes: int) -> dict[str, float]:
+    """Apply writes changes spread over delegations, sessions and audit events; returns the rates"""
+    started = time.perf_counter()
+    for n in range(writes):
+        user_id = plan.user_id(n % plan.users)
+        company_id = plan.company(n % plan.users)
+        kind = n % 4
+        if kind == 0:
+            store.create_delegation(plan.user_id((n + 1) % plan.users), plan.email(n % plan.users),
+                                    [plan.building(company_id)], 1, plan.user_id((n + 1) % plan.users))
+        elif kind == 1:
+            store.start_time_session(user_id, company_id, plan.building(company_id))
+        elif kind == 2:
+            previous = (n - 1) % plan.users
+            store.end_time_session(plan.user_id(previous), plan.building(plan.company(previous)))
+        else:
+            store.record(user_id=user_id, company_id=company_id, gate_id=plan.building(company_id),
+                         reader_id="R001", decision="ALLOW", reason="OK")
+    applied = time.perf_counter()
+    store.flush()
+    flushed = time.perf_counter()
+    return {"writes": writes, "apply_per_s": writes / (applied - started),
+            "logged_per_s": writes / (flushed - started), "flush_ms": (flushed - applied) * 1000}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1.0, help="synthetic store size (1 = 100k users, 1M events)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--runs", type=int, default=3, help="restores to take the median of")
+    parser.add_argument("--writes", type=int, default=20_000, help="changes written before the replay run")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    plan = Plan(args.scale, args.seed)
+    directory = tempfile.mkdtemp(prefix="oneaccess-snapshot-")
+    try:
+        seeded = InMemoryStore(audit=_audit(plan))
+        seed_store(seeded, plan)
+        started = time.perf_counter()
+        size = snapshot.write_snapshot(seeded, os.path.join(directory, SNAPSHOT_FILE))
+        report: dict = {
+            "scale": args.scale,
+            "store": {"users": plan.users, "audit_events": plan.audit_events, "delegations": plan.delegations,
+                      "time_sessions": plan.heavy_users * plan.sessions_per_heavy_user},
+            "snapshot": {"bytes": size, "write_ms": (time.perf_counter() - started) * 1000},
+        }
+        del seeded
+
+        runs = []
+        for _ in range(args.runs):
+            store, timings = restore(directory, plan)
+            store.close()
+            runs.append(timings)
+        report["restore"] = {k: statistics.median(r[k] for r in runs) for k in runs[0]}
+
+        # Left open without a final snapshot, like a crashed process, which also releases the directory lock
+        store, _ = restore(directory, plan)
+        report["wal"] = write_load(store, plan, args.writes)
+        store._dir_lock.close()
+        report["wal"]["log_bytes"] = sum(os.path.getsize(os.path.join(directory, f))
+                                         for f in os.listdir(directory) if f.startswith("wal-"))
+        replayed, report["replay"] = restore(directory, plan)
+        replayed.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report))
+        return
+    snap, wal = report["snapshot"], report["wal"]
+    print(f"store: {report['store']}")
+    print(f"snapshot   {snap['bytes'] / 1e6:8.1f} MB written in {snap['write_ms']:8.1f} ms")
+    for name in ("restore", "replay"):
+        r = report[name]
+        print(f"{name:10s} constructed {r['construct_ms']:7.1f} ms  ready {r['ready_ms']:8.1f} ms  "
+              f"history loaded {r['history_ms']:8.1f} ms")
+    print(f"wal        {wal['writes']} writes: {wal['apply_per_s']:,.0f}/s applied, "
+          f"{wal['logged_per_s']:,.0f}/s logged, {wal['log_bytes'] / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Cold-start benchmark: process spawn to first HTTP response.
+
+    cd backend
+    python scripts/bench_startup.py [--runs 10] [--path /healthz] [--json]
+
+Each run starts a fresh interpreter that imports app.main and serves it with
+Werkzeug, and times from spawn until the server answers --path. It then
+requests a route that needs the signing key (/.well-known/jwks.json) and
+times that too. Both startup modes are measured, with runs interleaved so
+machine noise hits them equally:
+
+- eager: the default; app.main loads PyJWT, cryptography and the keys at import
+- lazy:  ONEACCESS_LAZY_STARTUP=1; they load on first use, so the process
+         listens sooner and the first key-needing request pays the rest
+         (warm-up is not started here, to show that cost)
+
+The interpreter's own start (``python -c pass``) is reported for reference.
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+KEY_PATH = "/.well-known/jwks.json"
+MODES = {"eager": "0", "lazy": "1"}
+
+
+def serve(port: int) -> None:
+    """Child process: import the app, report the import time and serve until killed"""
+    started = time.perf_counter()
+    sys.path.insert(0, BACKEND_DIR)
+    from app import main
+
+    imported = time.perf_counter() - started
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", port, main.app, threaded=True)
+    print(json.dumps({"import_ms": imported * 1000}), flush=True)
+    server.serve_forever()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get(port: int, path: str) -> int | None:
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        conn.request("GET", path)
+        status = conn.getresponse().status
+        conn.close()
+        return status
+    except OSError:
+        return None
+
+
+def run_once(mode: str, path: str) -> dict:
+    port = _free_port()
+    env = dict(os.environ, ONEACCESS_LAZY_STARTUP=MODES[mode], ONEACCESS_STORE="memory")
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(port)],
+                              cwd=BACKEND_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        deadline = started + 60
+        while _get(port, path) != 200:
+            if server.poll() is not None or time.perf_counter() > deadline:
+                raise RuntimeError(f"{mode} server did not start")
+            time.sleep(0.002)
+        first = time.perf_counter()
+        if _get(port, KEY_PATH) != 200:
+            raise RuntimeError(f"{mode} server failed {KEY_PATH}")
+        keyed = time.perf_counter()
+        reported = json.loads(server.stdout.readline())
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return {"import_ms": reported["import_ms"], "first_response_ms": (first - started) * 1000,
+            "first_key_response_ms": (keyed - started) * 1000}
+
+
+def interpreter_ms(runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="cold starts per mode")
+    parser.add_argument("--path", default="/healthz", help="route timed as the first response")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--serve", type=int, default=None, help=argparse.SUPPRESS)  # child process
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        serve(args.serve)
+        return
+
+    samples: dict[str, list[dict]] = {mode: [] for mode in MODES}
+    for _ in range(args.runs):
+        for mode in MODES:
+            samples[mode].append(run_once(mode, args.path))
+    results = {"interpreter_ms": round(interpreter_ms(args.runs), 1), "path": args.path, "runs": args.runs, "modes": {}}
+    for mode, runs in samples.items():
+        results["modes"][mode] = {
+            metric: round(statistics.median(r[metric] for r in runs), 1)
+            for metric in ("import_ms", "first_response_ms", "first_key_response_ms")
+        }
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    print(f"python -c pass   {results['interpreter_ms']:8.1f} ms  (median of {args.runs})")
+    print(f"{'mode':8s} {'import':>10s} {'first ' + args.path:>22s} {'then ' + KEY_PATH:>30s}")
+    for mode, r in results["modes"].items():
+        print(f"{mode:8s} {r['import_ms']:8.1f}ms {r['first_response_ms']:20.1f}ms {r['first_key_response_ms']:28.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+"""
+Benchmark and load suite for the backend.
+
+    cd backend
+    python scripts/bench_suite.py [--mode inprocess|http] [--scenarios login,qr_token,...]
+                                  [--requests 5000] [--clients 4] [--scale 1.0] [--seed 1] [--json]
+
+Builds a synthetic store and runs each scenario against it. At --scale 1 the
+store holds 100k users in 50 companies, 1M audit events, 50k delegations and
+200k completed time sessions (2,000 each for the first 100 users). Use a
+smaller --scale for quick runs.
+
+- inprocess: the Flask test client in this process, one request at a time,
+  so the numbers are the app's own cost with no network or server.
+- http: a threaded Werkzeug server seeded the same way in a child process,
+  driven by --clients client processes over keep-alive connections.
+
+Scenarios:
+
+    login          POST /auth/login for random users
+    qr_token       POST /qr/token burst, random users and permitted gates
+    verify_mixed   POST /access/verify: about 60% ALLOW (own, MAIN and delegated gates),
+                   GATE_MISMATCH, NOT_ALLOWED and INVALID_TOKEN denials
+    audit_poll     GET /audit: latest, filtered by gate/user, and cursor pages
+    time_summary   GET /time/summary for users with large histories
+    time_history   GET /time/sessions for the same users
+
+Each scenario reports requests per second and p50/p90/p99/max latency in ms,
+plus response status counts (and decision reasons for verify_mixed). --json
+prints one JSON document, suitable for tracking regressions in CI.
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BACKEND_DIR)
+
+SCENARIOS = ("login", "qr_token", "verify_mixed", "audit_poll", "time_summary", "time_history")
+COMPANIES = 50
+HEAVY_USERS = 100
+AUDIT_CHUNK = 10_000
+DAY = 86400
+
+
+class Plan:
+    """Synthetic data sizes and ids, derived from --scale and --seed alone so client and server agree"""
+
+    def __init__(self, scale: float, seed: int) -> None:
+        self.seed = seed
+        self.users = max(COMPANIES * 2, int(100_000 * scale))
+        self.audit_events = int(1_000_000 * scale)
+        self.delegations = int(50_000 * scale)
+        self.sessions_per_heavy_user = max(1, int(2_000 * scale))
+        self.heavy_users = min(HEAVY_USERS, self.users)
+
+    @staticmethod
+    def user_id(i: int) -> str:
+        return f"U{i:07d}"
+
+    @staticmethod
+    def email(i: int) -> str:
+        return f"user{i:07d}@{Plan.company(i).lower()}.example"
+
+    @staticmethod
+    def company(i: int) -> str:
+        return f"CO{i % COMPANIES:03d}"
+
+    @staticmethod
+    def building(company_id: str) -> str:
+        return f"BLD_{company_id}"
+
+    def delegation_grants(self) -> list[tuple[int, str]]:
+        """(delegatee index, building gate of another company) per delegation"""
+        rng = random.Random(self.seed * 7919 + 1)
+        grants = []
+        for _ in range(self.delegations):
+            user = rng.randrange(self.users)
+            other = (user + rng.randrange(1, COMPANIES)) % COMPANIES
+            grants.append((user, self.building(f"CO{other:03d}")))
+        return grants
+
+
+def _load_app(plan: Plan):
+    """Import the app with an in-memory store sized for the plan"""
+    os.environ["ONEACCESS_STORE"] = "memory"
+    os.environ["ONEACCESS_AUDIT_MAX_EVENTS"] = str(max(100_000, plan.audit_events + 100_000))
+    os.environ.setdefault("ONEACCESS_SWEEP_INTERVAL_SECONDS", "0")
+    from app import main
+
+    return main
+
+
+def seed_store(store, plan: Plan) -> dict[str, float]:
+    """Fill a fresh store with the plan's data; returns seconds spent per collection"""
+    from app.store import Delegation, Gate, TimeSession, User
+
+    rng = random.Random(plan.seed)
+    timings: dict[str, float] = {}
+
+    started = time.perf_counter()
+    for c in range(COMPANIES):
+        company_id = f"CO{c:03d}"
+        gate_id = plan.building(company_id)
+        store.gates[gate_id] = Gate(gate_id=gate_id, kind="BUILDING", company_id=company_id)
+    for i in range(plan.users):
+        user = User(user_id=plan.user_id(i), email=plan.email(i), company_id=plan.company(i))
+        store.users_by_id[user.user_id] = user
+        store.users_by_email[user.email] = user
+    store.touch("gates")
+    store.touch("users")
+    timings["users"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    valid_until = datetime.utcnow() + timedelta(days=1)
+    for n, (user, gate_id) in enumerate(plan.delegation_grants()):
+        store._index_delegation(Delegation(
+            delegation_id=f"DEL_B{n:07d}", delegator_id=plan.user_id((user + 1) % plan.users),
+            delegatee_id=plan.user_id(user), gate_ids=[gate_id], valid_until=valid_until,
+            created_by=plan.user_id((user + 1) % plan.users),
+        ))
+    timings["delegations"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    now = int(time.time())
+    gate_ids = list(store.gates)
+    reasons = [("ALLOW", "OK")] * 8 + [("DENY", "Token gate mismatch"), ("DENY", "Invalid token")]
+    for base in range(0, plan.audit_events, AUDIT_CHUNK):
+        entries = []
+        for k in range(min(AUDIT_CHUNK, plan.audit_events - base)):
+            user = rng.randrange(plan.users)
+            decision, reason = rng.choice(reasons)
+            entries.append({
+                # Oldest first, spread over the last 30 days
+                "ts": now - 30 * DAY + (base + k) * 30 * DAY // max(1, plan.audit_events),
+                "user_id": plan.user_id(user), "company_id": plan.company(user),
+                "gate_id": rng.choice(gate_ids), "reader_id": f"R{rng.randrange(500):03d}",
+                "decision": decision, "reason": reason,
+                "door_status": "OPENED" if decision == "ALLOW" else "UNKNOWN",
+            })
+        store.record_many(entries)
+    timings["audit"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    first_day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) \
+        - timedelta(days=plan.sessions_per_heavy_user)
+    for i in range(plan.heavy_users):
+        gate_id = plan.building(plan.company(i))
+        for day in range(plan.sessions_per_heavy_user):
+            entry = first_day + timedelta(days=day, hours=8, minutes=rng.randrange(60))
+            session = TimeSession(session_id=f"SES_B{i:04d}{day:06d}", user_id=plan.user_id(i),
+                                  company_id=plan.company(i), gate_id_entry=gate_id, entry_time=entry)
+            session.complete_session(gate_id, entry + timedelta(seconds=rng.randrange(4 * 3600, 10 * 3600)))
+            store._index_session(session)
+    timings["sessions"] = time.perf_counter() - started
+    return timings
+
+
+# -- request sets ------------------------------------------------------------
+
+def _bearer_tokens(main, plan: Plan, count: int, rng: random.Random) -> list[tuple[int, str]]:
+    from app.store import User
+
+    users = [rng.randrange(plan.users) for _ in range(count)]
+    return [(i, main._issue_app_session(user=User(user_id=plan.user_id(i), email=plan.email(i),
+                                                  company_id=plan.company(i)))) for i in users]
+
+
+def _json_request(method: str, path: str, body: dict | None = None, bearer: str | None = None) -> tuple:
+    headers = {"Content-Type": "application/json"}
+    if bearer:
+        headers["Authorization"] = f"Bearer {bearer}"
+    return method, path, json.dumps(body).encode() if body is not None else None, headers
+
+
+def build_requests(main, plan: Plan, scenario: str, n: int, rng: random.Random) -> list[tuple]:
+    """n prepared (method, path, body, headers) requests; anything costly (signing) happens here, untimed"""
+    from app.security import issue_access_jwts
+
+    if scenario == "login":
+        return [_json_request("POST", "/auth/login", {"email": plan.email(rng.randrange(plan.users))})
+                for _ in range(n)]
+
+    if scenario == "qr_token":
+        bearers = _bearer_tokens(main, plan, min(n, 1000), rng)
+        out = []
+        for k in range(n):
+            i, bearer = bearers[k % len(bearers)]
+            gate_id = "MAIN_GATE" if k % 2 else plan.building(plan.company(i))
+            out.append(_json_request("POST", "/qr/token", {"gateId": gate_id, "readerNonce": f"BENCH{k:011d}"},
+                                     bearer))
+        return out
+
+    if scenario == "verify_mixed":
+        grants = plan.delegation_grants()
+        scans, claims = [], []
+        for k in range(n):
+            roll = rng.random()
+            i = rng.randrange(plan.users)
+            own = plan.building(plan.company(i))
+            if roll < 0.7:
+                if grants and roll < 0.2:
+                    i, gate_id = grants[rng.randrange(len(grants))]
+                    token_gate = gate_id
+                else:
+                    gate_id = token_gate = own if roll < 0.45 else "MAIN_GATE"
+            elif roll < 0.8:  # GATE_MISMATCH
+                token_gate, gate_id = "MAIN_GATE", own
+            else:  # NOT_ALLOWED, or INVALID_TOKEN once tampered below
+                other = f"CO{(i % COMPANIES + 1) % COMPANIES:03d}"
+                gate_id = token_gate = plan.building(other)
+            claims.append({"v": 1, "sub": plan.user_id(i), "cid": plan.company(i), "gid": token_gate,
+                           "rnonce": f"BENCH{k:011d}", "did": "BENCH", "jti": f"bench:{plan.seed}:{k}"})
+            scans.append({"readerId": f"R{k % 500:03d}", "gateId": gate_id})
+        # Long TTL so the set stays valid however long preparation and the run take
+        tokens = issue_access_jwts(keys=main.key_ring.current(), claims=claims, ttl_seconds=3600)
+        out = []
+        for k, (scan, token) in enumerate(zip(scans, tokens)):
+            if k % 10 == 9:
+                token = token[:-4] + ("AAAA" if not token.endswith("AAAA") else "BBBB")
+            out.append(_json_request("POST", "/access/verify", dict(scan, token=token)))
+        return out
+
+    if scenario == "audit_poll":
+        out = []
+        for _ in range(n):
+            roll = rng.random()
+            if roll < 0.3:
+                path = "/audit?limit=50"
+            elif roll < 0.55:
+                path = f"/audit?limit=50&gateId={plan.building(f'CO{rng.randrange(COMPANIES):03d}')}"
+            elif roll < 0.8:
+                path = f"/audit?limit=50&userId={plan.user_id(rng.randrange(plan.users))}"
+            else:
+                path = f"/audit?limit=200&cursor={rng.randrange(max(1, plan.audit_events))}"
+            out.append(_json_request("GET", path))
+        return out
+
+    if scenario in ("time_summary", "time_history"):
+        from app.store import User
+
+        bearers = [main._issue_app_session(user=User(user_id=plan.user_id(i), email=plan.email(i),
+                                                     company_id=plan.company(i)))
+                   for i in range(plan.heavy_users)]
+        path = "/time/summary" if scenario == "time_summary" else "/time/sessions?limit=100"
+        return [_json_request("GET", path, bearer=bearers[k % len(bearers)]) for k in range(n)]
+
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+# -- runners -----------------------------------------------------------------
+
+def _reason(body: bytes) -> str | None:
+    try:
+        return json.loads(body).get("reason")
+    except (ValueError, AttributeError):
+        return None
+
+
+def run_inprocess(main, requests: list[tuple], track_reasons: bool) -> tuple[list[float], Counter, Counter, float]:
+    client = main.app.test_client()
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    reasons: Counter = Counter()
+    started = time.perf_counter()
+    for method, path, body, headers in requests:
+        t0 = time.perf_counter()
+        response = client.open(path, method=method, data=body, headers=headers)
+        data = response.get_data()
+        latencies.append(time.perf_counter() - t0)
+        statuses[response.status_code] += 1
+        if track_reasons:
+            reasons[_reason(data)] += 1
+    return latencies, statuses, reasons, time.perf_counter() - started
+
+
+def _http_client(port: int, requests: list[tuple], track_reasons: bool, results) -> None:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    reasons: Counter = Counter()
+    for method, path, body, headers in requests:
+        t0 = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            data, status = b"", 0
+        latencies.append(time.perf_counter() - t0)
+        statuses[status] += 1
+        if track_reasons:
+            reasons[_reason(data)] += 1
+    conn.close()
+    results.put((latencies, statuses, reasons))
+
+
+def run_http(port: int, requests: list[tuple], clients: int,
+             track_reasons: bool) -> tuple[list[float], Counter, Counter, float]:
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_http_client, args=(port, requests[c::clients], track_reasons, results))
+             for c in range(clients)]
+    started = time.perf_counter()
+    for p in procs:
+        p.start()
+    parts = [results.get() for _ in procs]
+    elapsed = time.perf_counter() - started
+    for p in procs:
+        p.join()
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    reasons: Counter = Counter()
+    for part_latencies, part_statuses, part_reasons in parts:
+        latencies.extend(part_latencies)
+        statuses.update(part_statuses)
+        reasons.update(part_reasons)
+    return latencies, statuses, reasons, elapsed
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def summarize(scenario: str, latencies: list[float], statuses: Counter, reasons: Counter, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    result = {
+        "scenario": scenario,
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_percentile(ordered, 0.50) * 1000, 3),
+        "p90_ms": round(_percentile(ordered, 0.90) * 1000, 3),
+        "p99_ms": round(_percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+    }
+    if reasons:
+        result["reasons"] = dict(reasons.most_common())
+    return result
+
+
+# -- http server -------------------------------------------------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(port: int, plan: Plan) -> None:
+    """Child process for --mode http: seed a store and serve it until killed"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    main = _load_app(plan)
+    seed_store(main.store, plan)
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"  # keep-alive, so clients don't pay a connect per request
+    make_server("127.0.0.1", port, main.app, threaded=True).serve_forever()
+
+
+def _wait_ready(port: int, server: subprocess.Popen, timeout: float) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("benchmark server exited during startup")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/healthz")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("benchmark server did not become ready")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("inprocess", "http"), default="inprocess")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset to run")
+    parser.add_argument("--requests", type=int, default=5000, help="requests per scenario")
+    parser.add_argument("--clients", type=int, default=4, help="client processes in http mode")
+    parser.add_argument("--scale", type=float, default=1.0, help="synthetic store size (1 = 100k users, 1M events)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--serve", type=int, default=None, help=argparse.SUPPRESS)  # http mode's child process
+    args = parser.parse_args()
+
+    plan = Plan(args.scale, args.seed)
+    if args.serve is not None:
+        serve(args.serve, plan)
+        return
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    main_module = _load_app(plan)
+    server = None
+    report: dict = {
+        "mode": args.mode, "scale": args.scale, "seed": args.seed,
+        "store": {"users": plan.users, "audit_events": plan.audit_events, "delegations": plan.delegations,
+                  "time_sessions": plan.heavy_users * plan.sessions_per_heavy_user},
+        "python": sys.version.split()[0], "cpus": os.cpu_count(),
+    }
+    if args.mode == "inprocess":
+        report["seed_seconds"] = {k: round(v, 2) for k, v in seed_store(main_module.store, plan).items()}
+    else:
+        port = _free_port()
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve", str(port), "--scale", str(args.scale),
+             "--seed", str(args.seed)],
+            cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        report["clients"] = args.clients
+
+    try:
+        if server is not None:
+            _wait_ready(port, server, timeout=900)
+            report["startup_seconds"] = round(time.perf_counter() - started, 2)
+        rng = random.Random(args.seed)
+        results = []
+        for scenario in scenarios:
+            requests = build_requests(main_module, plan, scenario, args.requests, rng)
+            track = scenario == "verify_mixed"
+            if server is None:
+                run = run_inprocess(main_module, requests, track)
+            else:
+                run = run_http(port, requests, args.clients, track)
+            results.append(summarize(scenario, *run))
+        report["results"] = results
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    if args.json:
+        print(json.dumps(report))
+        return
+    print(f"{args.mode}: {plan.users:,} users, {plan.audit_events:,} audit events, "
+          f"{plan.delegations:,} delegations, {report['store']['time_sessions']:,} sessions")
+    for r in report["results"]:
+        print(f"{r['scenario']:14s} {r['requests_per_second']:10,.0f} req/s  p50 {r['p50_ms']:8.3f} ms  "
+              f"p99 {r['p99_ms']:8.3f} ms  max {r['max_ms']:8.2f} ms  {r['statuses']}"
+              + (f"  {r['reasons']}" if "reasons" in r else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Micro-benchmark for access token verification throughput on one core.
+
+    cd backend
+    python scripts/bench_verify.py [--seconds 2] [--json]
+
+Compares the original per-call jwt.decode path with the pre-resolved decoder,
+and the verified-token cache on both misses (fresh tokens) and hits (reader
+retries of the same token).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import jwt  # noqa: E402
+
+from app.security import VerifiedTokenCache, issue_access_jwt, load_or_create_keys, verify_access_jwt  # noqa: E402
+
+
+def _rate(fn, tokens: list[str], seconds: float) -> float:
+    """Calls per second of fn(token), cycling through tokens"""
+    n = len(tokens)
+    done = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while True:
+        for i in range(1000):
+            fn(tokens[(done + i) % n])
+        done += 1000
+        now = time.perf_counter()
+        if now >= deadline:
+            return done / (now - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=2.0, help="time per scenario")
+    parser.add_argument("--tokens", type=int, default=20_000, help="distinct tokens for the miss scenarios")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    keys = load_or_create_keys(tempfile.mkdtemp(prefix="oneaccess-bench-"))
+    pub = keys.public_key
+    tokens = [
+        issue_access_jwt(keys=keys, claims={"sub": f"U{i}", "gid": "MAIN_GATE", "jti": str(i)}, ttl_seconds=600)
+        for i in range(args.tokens)
+    ]
+
+    def baseline(token: str) -> dict:
+        return jwt.decode(token, pub, algorithms=["EdDSA"], options={"require": ["exp", "iat"]})
+
+    def preresolved(token: str) -> dict:
+        return verify_access_jwt(token=token, public_key=pub)
+
+    miss_cache = VerifiedTokenCache(max_entries=args.tokens // 2)  # smaller than the token set: always misses
+    hit_cache = VerifiedTokenCache()
+
+    def cached_miss(token: str) -> dict:
+        return verify_access_jwt(token=token, public_key=pub, cache=miss_cache)
+
+    def cached_hit(token: str) -> dict:
+        return verify_access_jwt(token=token, public_key=pub, cache=hit_cache)
+
+    results = {
+        "baseline_jwt_decode": _rate(baseline, tokens, args.seconds),
+        "preresolved_decoder": _rate(preresolved, tokens, args.seconds),
+        "cache_miss": _rate(cached_miss, tokens, args.seconds),
+        "cache_hit_retry": _rate(cached_hit, tokens[:100], args.seconds),
+    }
+    if args.json:
+        print(json.dumps({"unit": "verifies_per_second_per_core", "results": results}))
+        return
+    base = results["baseline_jwt_decode"]
+    for name, rate in results.items():
+        print(f"{name:22s} {rate:12,.0f} verifies/s   x{rate / base:.2f}")
+
+
+if __name__ == "__main__":
+    main()
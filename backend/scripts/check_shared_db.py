@@ -0,0 +1,154 @@
+"""
+Correctness checks for several SQLiteStores sharing one database file, as
+gunicorn workers do.
+
+    cd backend
+    python scripts/check_shared_db.py [--events 2000] [--json]
+
+- audit seqs: two stores record events concurrently; afterwards both hold
+  every event exactly once, under the same seq, and a store reopened on the
+  file sees the same seqs
+- audit cursor: paging /audit-style with the cursor from the previous page,
+  alternating between the two stores, returns every event exactly once; a
+  cursor from the store that is further along never moves back on the other
+- visitor pass: threads in both stores race to use one pass; exactly
+  max_uses uses succeed, and the database agrees
+
+Exits non-zero if any check fails.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.audit_log import AuditLog  # noqa: E402
+from app.sqlite_store import SQLiteStore  # noqa: E402
+
+
+def _open(path: str) -> SQLiteStore:
+    return SQLiteStore(path, audit=AuditLog(max_events=1_000_000), commit_interval=0.001)
+
+
+def _held(store: SQLiteStore) -> list[tuple[int, str]]:
+    events, _ = store.audit.query(limit=sys.maxsize, cursor=0)
+    return [(seq, e.reader_id) for seq, e in events]
+
+
+def check_audit_seqs(path: str, events: int) -> dict:
+    stores = [_open(path), _open(path)]
+
+    def worker(n: int) -> None:
+        for i in range(events):
+            stores[n].record(user_id=f"U{i % 50}", company_id="CO1", gate_id="MAIN_GATE",
+                             reader_id=f"R{n}-{i}", decision="ALLOW", reason="OK")
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(len(stores))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for store in stores:
+        store.flush()
+    for store in stores:
+        store.sync()
+    held = [_held(store) for store in stores]
+    for store in stores:
+        store.close()
+    reopened = _open(path)
+    reloaded = _held(reopened)
+    reopened.close()
+
+    expected = {f"R{n}-{i}" for n in range(len(stores)) for i in range(events)}
+    readers = [reader for _, reader in held[0]]
+    ok = held[0] == held[1] == reloaded and len(readers) == len(expected) and set(readers) == expected
+    return {"check": "audit_seqs", "ok": ok, "events": [len(h) for h in held], "reloaded": len(reloaded)}
+
+
+def check_audit_cursor(path: str, limit: int = 37) -> dict:
+    stores = [_open(path), _open(path)]
+    for store in stores:
+        store.sync()
+    expected = _held(stores[0])
+    seen: list[tuple[int, str]] = []
+    cursor, page = 0, 0
+    while True:
+        events, cursor = stores[page % 2].audit.query(limit=limit, cursor=cursor)
+        if not events:
+            break
+        seen.extend((seq, e.reader_id) for seq, e in events)
+        page += 1
+    # stores[0] sees its new events on commit; stores[1] hasn't synced them yet
+    stores[0].record(user_id="U0", company_id="CO1", gate_id="MAIN_GATE", reader_id="R0-late",
+                     decision="ALLOW", reason="OK")
+    stores[0].flush()
+    ahead = stores[0].audit.next_seq
+    _, behind_cursor = stores[1].audit.query(limit=limit, cursor=ahead)
+    for store in stores:
+        store.close()
+    ok = bool(expected) and seen == expected and behind_cursor == ahead
+    return {"check": "audit_cursor", "ok": ok, "pages": page, "events": len(seen), "expected": len(expected),
+            "cursor_kept": behind_cursor == ahead}
+
+
+def check_visitor_pass(path: str, threads: int = 8) -> dict:
+    stores = [_open(path), _open(path)]
+    pass_id = stores[0].create_visitor_pass("U1", "Visitor", "", ["MAIN_GATE"], 1, "CO1")
+    stores[0].flush()
+    stores[1].sync()
+    max_uses = stores[0].visitor_passes[pass_id].max_uses
+    barrier = threading.Barrier(threads)
+    successes: list[int] = []
+
+    def worker(n: int) -> None:
+        barrier.wait()
+        for _ in range(max_uses):
+            if stores[n % 2].use_visitor_pass(pass_id) is not None:
+                successes.append(n)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    for store in stores:
+        store.close()
+    reopened = _open(path)
+    stored = reopened.visitor_passes[pass_id].used_count
+    reopened.close()
+    ok = len(successes) == stored == max_uses
+    return {"check": "visitor_pass", "ok": ok, "max_uses": max_uses, "succeeded": len(successes), "stored": stored}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000, help="audit events recorded per store")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="oneaccess-shared-")
+    try:
+        path = os.path.join(directory, "oneaccess.db")
+        checks = [check_audit_seqs(path, args.events), check_audit_cursor(path), check_visitor_pass(path)]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    ok = all(c["ok"] for c in checks)
+
+    if args.json:
+        print(json.dumps({"ok": ok, "checks": checks}))
+    else:
+        for c in checks:
+            details = {k: v for k, v in c.items() if k not in ("check", "ok")}
+            print(f"{c['check']:14s} {'ok' if c['ok'] else 'FAILED'}  {details}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Load test for /qr/token issuance across gunicorn worker counts.
+
+    cd backend
+    python scripts/load_qr_tokens.py [--workers 1,2,4] [--seconds 5] [--clients 8] [--json]
+
+For each worker count it starts `gunicorn -c gunicorn.conf.py app.main:app`
+on a scratch SQLite database, drives /qr/token from client processes for a
+fixed time and reports tokens issued per second. Clients run on the same
+machine, so leave spare cores for them when reading the scaling numbers.
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _request(port: int, method: str, path: str, body: dict | None = None, token: str | None = None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    resp = conn.getresponse()
+    data = resp.read()
+    conn.close()
+    return resp.status, data
+
+
+def _wait_ready(port: int, timeout: float = 20.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if _request(port, "GET", "/healthz")[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("server did not become ready")
+
+
+def _client(port: int, token: str, seconds: float, client_id: int, counts) -> None:
+    done = errors = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        body = {"gateId": "MAIN_GATE", "readerNonce": f"LOAD{client_id:04d}{done:010d}"}
+        try:
+            status, _ = _request(port, "POST", "/qr/token", body, token)
+        except OSError:
+            status = 0
+        if status == 200:
+            done += 1
+        else:
+            errors += 1
+    counts.put((done, errors))
+
+
+def run(workers: int, seconds: float, clients: int) -> dict:
+    port = _free_port()
+    tmp = tempfile.mkdtemp(prefix="oneaccess-load-")
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY=str(workers), ONEACCESS_STORE="sqlite",
+               ONEACCESS_DB_PATH=os.path.join(tmp, "load.db"))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app.main:app"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_ready(port)
+        status, data = _request(port, "POST", "/auth/login", {"email": "alice@acme.com"})
+        token = json.loads(data)["accessToken"]
+
+        counts: multiprocessing.Queue = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_client, args=(port, token, seconds, i, counts))
+                 for i in range(clients)]
+        start = time.perf_counter()
+        for p in procs:
+            p.start()
+        results = [counts.get() for _ in procs]
+        elapsed = time.perf_counter() - start
+        for p in procs:
+            p.join()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=10)
+
+    issued = sum(r[0] for r in results)
+    return {"workers": workers, "clients": clients, "issued": issued, "errors": sum(r[1] for r in results),
+            "tokens_per_second": issued / elapsed}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client processes")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = [run(int(w), args.seconds, args.clients) for w in args.workers.split(",")]
+    base = results[0]["tokens_per_second"] / results[0]["workers"]
+    for r in results:
+        r["scaling_efficiency"] = r["tokens_per_second"] / (base * r["workers"]) if base else 0.0
+    if args.json:
+        print(json.dumps({"results": results}))
+        return
+    for r in results:
+        print(f"{r['workers']:3d} workers  {r['tokens_per_second']:10,.0f} tokens/s  "
+              f"efficiency {r['scaling_efficiency']:.0%}  errors {r['errors']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Concurrency stress test for InMemoryStore.
+
+    cd backend
+    python scripts/stress_store.py [--threads 1,2,4,8] [--seconds 2] [--users 200] [--json]
+
+Correctness, with the largest thread count hammering shared keys:
+
+- visitor passes: every thread races to use the same passes; exactly
+  max_uses uses may succeed per pass
+- sessions: threads alternate ENTRY/EXIT for overlapping users; afterwards
+  each user has at most one ACTIVE session, active_sessions and occupancy
+  agree with the sessions, and running totals match the completed sessions
+- policy versions: concurrent touch() calls all get distinct versions
+
+Throughput: a mixed workload (session ENTRY/EXIT, visitor pass use, audit
+writes, delegation lookups) run for --seconds per thread count, reported as
+operations per second. On a GIL build of CPython the total stays roughly
+flat as threads are added, since only one runs Python at a time; the point
+is that it doesn't collapse from lock contention. On a free-threaded build
+(3.13t and later) disjoint users proceed in parallel.
+
+Exits non-zero if any correctness check fails.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.audit_log import AuditLog  # noqa: E402
+from app.store import InMemoryStore, User, VisitorPass  # noqa: E402
+
+COMPANIES = 8
+
+
+def _store(users: int) -> InMemoryStore:
+    store = InMemoryStore(audit=AuditLog(max_events=1_000_000))
+    for i in range(users):
+        user = User(user_id=f"U{i:05d}", email=f"u{i:05d}@co{i % COMPANIES}.example", company_id=f"CO{i % COMPANIES}")
+        store.users_by_id[user.user_id] = user
+        store.users_by_email[user.email] = user
+    return store
+
+
+def _visitor_pass(c: int, max_uses: int) -> VisitorPass:
+    return VisitorPass(pass_id=f"VIS_{c}", created_by=f"U{c:05d}", visitor_name="v", visitor_phone="",
+                       gate_ids=["MAIN_GATE"], valid_until=datetime.utcnow() + timedelta(hours=1),
+                       host_company_id=f"CO{c}", max_uses=max_uses)
+
+
+def _run_threads(count: int, target) -> float:
+    barrier = threading.Barrier(count + 1)
+    threads = [threading.Thread(target=target, args=(n, barrier)) for n in range(count)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - started
+
+
+def check_visitor_passes(threads: int) -> dict:
+    store = _store(COMPANIES)
+    passes = [_visitor_pass(c, max_uses=50) for c in range(COMPANIES)]
+    for visitor_pass in passes:
+        store._index_visitor_pass(visitor_pass)
+    granted = [0] * threads
+
+    def worker(n: int, barrier: threading.Barrier) -> None:
+        barrier.wait()
+        for _ in range(200):
+            for visitor_pass in passes:
+                if store.use_visitor_pass(visitor_pass.pass_id) is not None:
+                    granted[n] += 1
+
+    _run_threads(threads, worker)
+    expected = sum(p.max_uses for p in passes)
+    ok = sum(granted) == expected and all(p.used_count == p.max_uses for p in passes)
+    return {"check": "visitor_pass_uses", "ok": ok, "granted": sum(granted), "expected": expected}
+
+
+def check_sessions(threads: int, users: int) -> dict:
+    store = _store(users)
+
+    def worker(n: int, barrier: threading.Barrier) -> None:
+        barrier.wait()
+        for k in range(3000):
+            i = (n * 7 + k * 13) % users  # every user is hit by several threads
+            user = store.users_by_id[f"U{i:05d}"]
+            if (n + k) % 2:
+                store.start_time_session(user.user_id, user.company_id, f"BLD_{user.company_id}")
+            else:
+                store.end_time_session(user.user_id, f"BLD_{user.company_id}")
+
+    _run_threads(threads, worker)
+    active: dict[str, int] = {}
+    completed: dict[str, int] = {}
+    by_gate: dict[str, int] = {}
+    for session in store.time_sessions.values():
+        if session.status == "ACTIVE":
+            active[session.user_id] = active.get(session.user_id, 0) + 1
+            by_gate[session.gate_id_entry] = by_gate.get(session.gate_id_entry, 0) + 1
+        elif session.duration_seconds:
+            completed[session.user_id] = completed.get(session.user_id, 0) + 1
+    problems = []
+    if any(n > 1 for n in active.values()):
+        problems.append("user with several ACTIVE sessions")
+    if set(active) != set(store.active_sessions):
+        problems.append("active_sessions out of step")
+    if by_gate != store.occupancy.by_gate:
+        problems.append("occupancy out of step")
+    if any(store.get_user_time_stats(u).completed_sessions != n for u, n in completed.items()):
+        problems.append("running totals out of step")
+    return {"check": "sessions", "ok": not problems, "problems": problems, "sessions": len(store.time_sessions),
+            "active": len(store.active_sessions)}
+
+
+def check_policy_versions(threads: int) -> dict:
+    store = _store(1)
+    start = store.policy_version
+    seen: list[list[int]] = [[] for _ in range(threads)]
+
+    def worker(n: int, barrier: threading.Barrier) -> None:
+        barrier.wait()
+        for _ in range(5000):
+            seen[n].append(store.touch("visitorPasses"))
+
+    _run_threads(threads, worker)
+    versions = [v for part in seen for v in part]
+    ok = len(set(versions)) == len(versions) and store.policy_version == start + len(versions)
+    return {"check": "policy_versions", "ok": ok, "touches": len(versions)}
+
+
+def throughput(threads: int, seconds: float, users: int) -> dict:
+    store = _store(users)
+    for c in range(COMPANIES):
+        store._index_visitor_pass(_visitor_pass(c, max_uses=10**9))
+    ops = [0] * threads
+    stop = threading.Event()
+
+    def worker(n: int, barrier: threading.Barrier) -> None:
+        # Each thread works its own slice of users, as request threads for different people would
+        mine = [store.users_by_id[f"U{i:05d}"] for i in range(n, users, threads)] or [store.users_by_id["U00000"]]
+        barrier.wait()
+        done = k = 0
+        while not stop.is_set():
+            for _ in range(100):
+                user = mine[k % len(mine)]
+                gate_id = f"BLD_{user.company_id}"
+                if k % 2:
+                    store.start_time_session(user.user_id, user.company_id, gate_id)
+                else:
+                    store.end_time_session(user.user_id, gate_id)
+                store.use_visitor_pass(f"VIS_{k % COMPANIES}")
+                store.record(user_id=user.user_id, company_id=user.company_id, gate_id=gate_id, reader_id="R1",
+                             decision="ALLOW", reason="OK")
+                store.find_delegation(user.user_id, gate_id)
+                k += 1
+                done += 4
+            ops[n] = done
+
+    timer = threading.Timer(seconds, stop.set)
+    timer.start()
+    elapsed = _run_threads(threads, worker)
+    return {"threads": threads, "ops": sum(ops), "ops_per_second": round(sum(ops) / elapsed, 1)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", default="1,2,4,8", help="comma-separated thread counts")
+    parser.add_argument("--seconds", type=float, default=2.0, help="throughput run per thread count")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    counts = [int(t) for t in args.threads.split(",")]
+    # A tiny switch interval makes the interpreter interleave threads far more often than usual
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    checks = [check_visitor_passes(max(counts)), check_sessions(max(counts), args.users),
+              check_policy_versions(max(counts))]
+    sys.setswitchinterval(interval)
+    results = [throughput(n, args.seconds, args.users) for n in counts]
+    base = results[0]["ops_per_second"]
+    for r in results:
+        r["relative"] = round(r["ops_per_second"] / base, 2) if base else 0.0
+
+    ok = all(c["ok"] for c in checks)
+    if args.json:
+        print(json.dumps({"ok": ok, "checks": checks, "throughput": results,
+                          "gil": getattr(sys, "_is_gil_enabled", lambda: True)()}))
+    else:
+        for c in checks:
+            print(f"{c['check']:18s} {'ok' if c['ok'] else 'FAILED'}  "
+                  + "  ".join(f"{k}={v}" for k, v in c.items() if k not in ("check", "ok")))
+        for r in results:
+            print(f"{r['threads']:3d} threads  {r['ops_per_second']:12,.0f} ops/s  x{r['relative']:.2f}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()